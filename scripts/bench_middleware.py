@@ -0,0 +1,155 @@
+"""Compare the request overhead of the middleware stack.
+
+Runs an in-process ASGI app (no network, no server) with a trivial JSON
+endpoint behind either the previous stack (two @app.middleware functions
+plus a BaseHTTPMiddleware telemetry layer, all over CORS) or the current
+single RequestMiddleware over CORS, and reports requests per second.
+
+    python scripts/bench_middleware.py [requests] [concurrency]
+
+Logs go to /dev/null at INFO, so logging cost is included but not the
+terminal's.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from src.middleware import RequestMiddleware, AccessLog
+from src.metrics import HTTP_REQUEST_SECONDS, status_class
+from src.telemetry import request_log_writer
+from src import timing
+
+logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+logger = logging.getLogger("bench")
+
+
+def base_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/v1/ping")
+    async def ping(user: str = None):
+        return {"user": user, "ok": True}
+
+    app.add_middleware(CORSMiddleware, allow_origin_regex=".*", allow_credentials=True,
+                       allow_methods=["*"], allow_headers=["*"])
+    return app
+
+
+class LegacyTelemetryMiddleware(BaseHTTPMiddleware):
+    # The telemetry layer as it was, minus profiling
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        timer = timing.begin()
+        response = await call_next(request)
+        latency_ms = (time.time() - start_time) * 1000
+        response.headers["Server-Timing"] = timer.server_timing(latency_ms)
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route else "unmatched", status_class(response.status_code)
+        ).observe(latency_ms / 1000)
+        request_log_writer.log(
+            endpoint=request.url.path, status_code=response.status_code, latency_ms=latency_ms,
+            api_key=request.headers.get("X-API-Key"), user_addr=request.query_params.get("user"),
+        )
+        return response
+
+
+def legacy_app() -> FastAPI:
+    app = base_app()
+
+    @app.middleware("http")
+    async def add_security_headers(request: Request, call_next):
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        response.headers["Content-Security-Policy"] = "default-src 'self'"
+        return response
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        logger.info(f"Request: {request.method} {request.url.path}")
+        logger.info(f"Client IP: {request.client.host if request.client else 'unknown'}")
+        api_key = request.headers.get('X-API-Key', 'No API Key')
+        logger.info(f"API Key: {api_key[:10]}..." if len(api_key) > 10 else "API Key: None")
+        response = await call_next(request)
+        logger.info(f"Response: {response.status_code}")
+        return response
+
+    app.add_middleware(LegacyTelemetryMiddleware)
+    return app
+
+
+def current_app(access_log: AccessLog) -> FastAPI:
+    app = base_app()
+    app.add_middleware(RequestMiddleware, access_log=access_log)
+    return app
+
+
+async def call(app, scope):
+    # Behaves like a server connection: the body once, then a disconnect
+    # only after the response has been sent
+    sent = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await app(dict(scope), receive, send)
+
+
+async def run(app, requests: int, concurrency: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/v1/ping", "raw_path": b"/v1/ping", "root_path": "",
+        "query_string": b"user=0xabc", "server": ("bench", 80), "client": ("127.0.0.1", 5000),
+        "headers": [(b"host", b"bench"), (b"x-api-key", b"pk_benchmarkkey"), (b"origin", b"http://example.com")],
+    }
+    # Warm up routing, metric children and imports
+    for _ in range(200):
+        await call(app, scope)
+
+    start = time.perf_counter()
+    for _ in range(requests // concurrency):
+        await asyncio.gather(*(call(app, scope) for _ in range(concurrency)))
+    return (requests // concurrency * concurrency) / (time.perf_counter() - start)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    # The writer is not started, keep its queue from filling up mid-run
+    request_log_writer.max_size = 10 ** 9
+    request_log_writer._queue.maxsize = 10 ** 9
+
+    access_log = AccessLog()
+    access_log.start()
+    try:
+        for name, app in (("legacy", legacy_app()), ("asgi", current_app(access_log))):
+            rps = asyncio.run(run(app, requests, concurrency))
+            print(f"{name:>7}: {rps:8.0f} req/s  ({1e6 / rps:6.1f} us/req)")
+    finally:
+        access_log.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -101,11 +101,8 @@ async def get_token(request: Request, token: Optional[str] = Depends(oauth2_sche
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-async def get_current_user(
-    request: Request,
-    db: Session = Depends(get_db)
-) -> User:
-    """Get the current authenticated user from JWT token (cookie or header)"""
+def token_from_request(request: Request) -> Optional[str]:
+    """Access token from the cookie, or a Bearer Authorization header"""
     token = request.cookies.get("access_token")
     
     # Allow Bearer token as fallback
@@ -114,6 +111,23 @@ async def get_current_user(
         scheme, param = get_authorization_scheme_param(authorization)
         if scheme.lower() == "bearer":
             token = param
+    return token
+
+def admin_from_request(request: Request, db: Session) -> Optional[User]:
+    """The active admin user authenticated by the request, or None (never raises)"""
+    token = token_from_request(request)
+    email = verify_token(token) if token else None
+    if email is None:
+        return None
+    user = get_user_by_email(db, email)
+    return user if user and user.is_active else None
+
+async def get_current_user(
+    request: Request,
+    db: Session = Depends(get_db)
+) -> User:
+    """Get the current authenticated user from JWT token (cookie or header)"""
+    token = token_from_request(request)
             
     if not token:
         raise HTTPException(
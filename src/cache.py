@@ -0,0 +1,146 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .config import settings
+from .database import SessionLocal, CacheVersion
+from .metrics import cache_lookup
+
+# In-process caches of rarely changing database state, invalidated across
+# workers through the cache_versions table: whoever changes the underlying
+# rows bumps the cache's version in the same transaction, and every worker
+# polls the version at most once per check interval instead of hitting the
+# cached tables on every request.
+
+_MISSING = object()
+
+
+def bump_version(db, name: str):
+    """Invalidate cache `name` in every worker. Call inside the transaction that changes its data."""
+    updated = (
+        db.query(CacheVersion)
+        .filter(CacheVersion.name == name)
+        .update({CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False)
+    )
+    if not updated:
+        db.add(CacheVersion(name=name, version=1))
+
+
+def read_version(db, name: str) -> int:
+    row = db.query(CacheVersion.version).filter(CacheVersion.name == name).first()
+    return row[0] if row else 0
+
+
+class VersionedCache:
+    """TTL cache that is also cleared whenever its version in cache_versions changes.
+
+    Entries expire after `ttl_s` regardless, so a change made without a
+    version bump is picked up eventually. Changes made with one are seen by
+    other workers within `check_interval_s`; call `invalidate` for the local
+    process to see them immediately.
+    """
+
+    def __init__(self, name: str, ttl_s: float = 60, check_interval_s: float = 1,
+                 max_entries: int = 10000, session_factory=SessionLocal, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.ttl = ttl_s
+        self.check_interval = check_interval_s
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self.clock = clock
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._version: Optional[int] = None
+        # Bumped whenever entries are dropped, so a load that raced a drop is not stored
+        self._generation = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Cached value for `key`, calling `loader` on a miss. None results are cached too."""
+        self._check_version()
+        now = self.clock()
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and entry[0] > now:
+            cache_lookup(self.name, True)
+            return entry[1]
+
+        cache_lookup(self.name, False)
+        generation = self._generation
+        value = loader()
+        if generation != self._generation:
+            # Invalidated while loading, the value may predate the change
+            return value
+        if len(self._entries) >= self.max_entries:
+            # Oldest insertion first; a full clear would stampede the database
+            self._entries.pop(next(iter(self._entries)), None)
+        self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Cached value for `key` without touching the database, else `default`.
+
+        `default` is also returned when a version check is due, so callers on
+        the event loop can fall back to `get` in a thread whenever it would
+        block.
+        """
+        now = self.clock()
+        if now >= self._next_check:
+            return default
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= now:
+            return default
+        cache_lookup(self.name, True)
+        return entry[1]
+
+    def invalidate(self):
+        self._generation += 1
+        self._entries.clear()
+        # Re-read the version on the next lookup rather than clearing again on it
+        self._next_check = 0.0
+
+    def _check_version(self):
+        now = self.clock()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            db = self.session_factory()
+            try:
+                version = read_version(db, self.name)
+            finally:
+                db.close()
+            if version != self._version:
+                if self._version is not None:
+                    self._generation += 1
+                    self._entries.clear()
+                self._version = version
+        finally:
+            self._lock.release()
+
+
+# Admin-editable app_settings (TARGET_BUILDER), read by Settings on every
+# request. /admin/settings bumps the version on update.
+APP_SETTINGS_CACHE = "app_settings"
+app_settings_cache = VersionedCache(
+    APP_SETTINGS_CACHE,
+    ttl_s=settings.APP_SETTINGS_CACHE_TTL_S,
+    check_interval_s=settings.CACHE_VERSION_CHECK_S,
+)
+
+
+def _load_app_setting(key: str) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        return db.execute(text("SELECT value FROM app_settings WHERE key = :key"), {"key": key}).scalar()
+    except SQLAlchemyError:
+        # Table not created yet (bootstrapping)
+        return None
+    finally:
+        db.close()
+
+
+def get_app_setting(key: str) -> Optional[str]:
+    return app_settings_cache.get(key, lambda: _load_app_setting(key))
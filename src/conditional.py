@@ -0,0 +1,100 @@
+import hashlib
+from email.utils import formatdate
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from starlette.datastructures import QueryParams
+
+from .services import DataVersion
+
+# Conditional GET for the ledger endpoints. Clients poll them every few
+# seconds and the answer only changes when a fill or funding event is
+# stored (or, for /v1/pnl, the mid prices move), so the ETag is derived from
+# that version and a matching If-None-Match is answered with 304 before the
+# replay runs. Responses are `private`: they sit behind an API key and its
+# quota, which a shared cache would bypass. Tags are weak: the same one is
+# sent whichever Content-Encoding the body gets, so they only promise the
+# same content, not the same bytes.
+#
+# /v1/pnl only depends on the mids of the coins the user has open positions
+# in, and on none for a flat account. Which coins those are is only known
+# once the data has been replayed, so each worker remembers them per data
+# version; until it has, the tag is computed after the replay.
+
+# Part of every ETag, bump when the response format changes
+ETAG_FORMAT = "1"
+# Data versions whose open position coins are remembered, per worker
+OPEN_COINS_ENTRIES = 10000
+
+_open_coins: Dict[str, Tuple[str, ...]] = {}
+
+
+def ledger_etag(path: str, query: QueryParams, version: DataVersion, mids_id: str = "") -> str:
+    # Parameter order does not change the response, so it does not change the tag
+    params = "&".join(f"{k}={v}" for k, v in sorted(query.multi_items()))
+    key = "|".join((ETAG_FORMAT, path, params, str(version.fills_ms), str(version.fills_at_ms),
+                    str(version.funding_ms), version.builder, mids_id))
+    return 'W/"' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '"'
+
+
+def known_open_coins(data_etag: str) -> Optional[Tuple[str, ...]]:
+    """Coins with open positions in the replay tagged `data_etag` (the tag without mids), None if not seen yet."""
+    return _open_coins.get(data_etag)
+
+
+def remember_open_coins(data_etag: str, coins: Tuple[str, ...]):
+    if data_etag not in _open_coins and len(_open_coins) >= OPEN_COINS_ENTRIES:
+        # Oldest insertion first, like VersionedCache
+        _open_coins.pop(next(iter(_open_coins)), None)
+    _open_coins[data_etag] = coins
+
+
+class MarkToMarket:
+    """Mid prices for a replay's open positions, passed as `mids` to LedgerService.get_pnl_async.
+
+    The replay calls it with its open position coins, if it has any, and the
+    snapshot is fetched then, so flat accounts never fetch mids. Calling it
+    ahead with the coins known from an earlier replay makes the replay use
+    the same snapshot as the tag.
+    """
+
+    def __init__(self, snapshot: Callable[[], Tuple[str, float, Dict[str, Any]]]):
+        self.snapshot = snapshot
+        self.coins: Tuple[str, ...] = ()
+        self.mids: Dict[str, Any] = {}
+        self.fetched_at: Optional[float] = None
+
+    def __call__(self, coins: Iterable[str]) -> Dict[str, Any]:
+        self.coins = tuple(sorted(set(coins)))
+        if self.fetched_at is None:
+            _, self.fetched_at, self.mids = self.snapshot()
+        return self.mids
+
+    def mids_id(self) -> str:
+        """Identifies the mids of the open coins only, empty when there are none."""
+        if not self.coins:
+            return ""
+        marks = repr([(coin, self.mids.get(coin)) for coin in self.coins])
+        return hashlib.blake2b(marks.encode(), digest_size=8).hexdigest()
+
+
+def cache_headers(etag: str, last_modified_ms: int, max_age_s: int) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age_s}, must-revalidate"}
+    if last_modified_ms:
+        headers["Last-Modified"] = formatdate(last_modified_ms / 1000, usegmt=True)
+    return headers
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match semantics: `*` or any listed tag, compared weakly."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
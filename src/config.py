@@ -1,44 +1,228 @@
 import os
+import hashlib
 
 class Settings:
     @property
     def TARGET_BUILDER(self) -> str:
-        # Dynamic check
+        # Admin override from app_settings, else the environment.
+        # Served from an in-process cache (see cache.py), not a query per read.
         try:
-            # We avoid top level import loop/init cost by doing it here or raw
-            # Ideally we use the storage class but let's be raw for config speed/safety
-            # OR better: The Service passes the builder to logic, so logic doesn't read settings directly?
-            # Existing code: endpoints default target_builder=settings.TARGET_BUILDER.
-            # So endpoints call this.
-            
-            # Helper to read from same DB path as DATABASE_URL
-            import sqlite3
-            db_url = self.DATABASE_URL
-            path = db_url.replace("sqlite:///", "")
-            conn = sqlite3.connect(path)
-            c = conn.cursor()
-            # We need to catch if table doesn't exist yet (bootstrapping)
-            try:
-                c.execute('SELECT value FROM app_settings WHERE key = ?', ("TARGET_BUILDER",))
-                row = c.fetchone()
-                if row:
-                    return row[0]
-            except sqlite3.OperationalError:
-                # Table missing likely
-                pass
-            finally:
-                conn.close()
-        except:
+            # Imported here, cache.py depends on this module
+            from .cache import get_app_setting
+            value = get_app_setting("TARGET_BUILDER")
+            if value:
+                return value
+        except Exception:
             pass
-            
+
         return os.getenv("TARGET_BUILDER", "")
 
     @property
     def STORAGE_TYPE(self) -> str:
-        return os.getenv("STORAGE_TYPE", "sqlite") # memory, sqlite, postgres
+        return os.getenv("STORAGE_TYPE", "sqlite") # memory, sqlite, sqlite_sharded, postgres
 
     @property
     def DATABASE_URL(self) -> str:
         return os.getenv("DATABASE_URL", "sqlite:///hyperliquid.db")
 
+    @property
+    def SQLITE_POOL_SIZE(self) -> int:
+        return int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+    @property
+    def STORAGE_IO_THREADS(self) -> int:
+        # Threads serving async storage calls, no point exceeding the connection pool
+        return int(os.getenv("STORAGE_IO_THREADS", "8"))
+
+    @property
+    def SQLITE_SHARDS(self) -> int:
+        # Number of fill database files for STORAGE_TYPE=sqlite_sharded
+        return int(os.getenv("SQLITE_SHARDS", "4"))
+
+    @property
+    def SQLITE_GROUP_COMMIT(self) -> bool:
+        # Batch concurrent fill writes through a single writer thread
+        return os.getenv("SQLITE_GROUP_COMMIT", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def SQLITE_GROUP_COMMIT_MS(self) -> float:
+        # Extra time a batch waits for others to join it, 0 = only batch what is already queued
+        return float(os.getenv("SQLITE_GROUP_COMMIT_MS", "0"))
+
+    @property
+    def STORE_RAW_FILLS(self) -> bool:
+        # Keep the original upstream fill JSON alongside the typed columns (audit/debug)
+        return os.getenv("STORE_RAW_FILLS", "false").lower() in ("1", "true", "yes")
+
+    @property
+    def POSTGRES_POOL_SIZE(self) -> int:
+        return int(os.getenv("POSTGRES_POOL_SIZE", "10"))
+
+    @property
+    def MEMORY_STORAGE_MAX_MB(self) -> int:
+        # Budget for STORAGE_TYPE=memory, least recently used users are evicted beyond it
+        return int(os.getenv("MEMORY_STORAGE_MAX_MB", "256"))
+
+    @property
+    def MEMORY_SNAPSHOT_PATH(self) -> str:
+        # Where STORAGE_TYPE=memory saves its contents on shutdown, empty disables
+        return os.getenv("MEMORY_SNAPSHOT_PATH", "")
+
+    @property
+    def TELEMETRY_QUEUE_SIZE(self) -> int:
+        return int(os.getenv("TELEMETRY_QUEUE_SIZE", "10000"))
+
+    @property
+    def TELEMETRY_FLUSH_MS(self) -> float:
+        return float(os.getenv("TELEMETRY_FLUSH_MS", "500"))
+
+    @property
+    def TELEMETRY_BATCH_SIZE(self) -> int:
+        return int(os.getenv("TELEMETRY_BATCH_SIZE", "500"))
+
+    @property
+    def TELEMETRY_QUEUE_POLICY(self) -> str:
+        # What to do when the request log queue backs up: "drop" or "sample"
+        return os.getenv("TELEMETRY_QUEUE_POLICY", "drop")
+
+    @property
+    def TELEMETRY_SAMPLE_RATE(self) -> int:
+        # With the "sample" policy, keep 1 in N successful requests under pressure
+        return int(os.getenv("TELEMETRY_SAMPLE_RATE", "10"))
+
+    @property
+    def REQUEST_LOG_RETENTION_DAYS(self) -> float:
+        # Raw request_logs rows older than this are pruned, rollups keep the aggregates
+        return float(os.getenv("REQUEST_LOG_RETENTION_DAYS", "7"))
+
+    @property
+    def RATE_LIMIT_STORAGE_URI(self) -> str:
+        # shm:// is shared by the workers on one host; memory:// limits each worker separately.
+        # The default segment is named after the database, so deployments on one host don't share counters
+        uri = os.getenv("RATE_LIMIT_STORAGE_URI")
+        if uri:
+            return uri
+        db_path = self.DATABASE_URL.replace("sqlite:///", "")
+        if "://" not in db_path:
+            db_path = os.path.abspath(db_path)
+        return f"shm://hyperliquid-ledger-ratelimit-{hashlib.sha1(db_path.encode()).hexdigest()[:12]}"
+
+    @property
+    def QUOTA_UNITS_PER_MINUTE(self) -> int:
+        # Work units each API key may spend per minute, 0 disables cost-based limiting
+        return int(os.getenv("QUOTA_UNITS_PER_MINUTE", "1000"))
+
+    @property
+    def QUOTA_FILLS_PER_UNIT(self) -> int:
+        return int(os.getenv("QUOTA_FILLS_PER_UNIT", "1000"))
+
+    @property
+    def QUOTA_UPSTREAM_CALL_UNITS(self) -> float:
+        return float(os.getenv("QUOTA_UPSTREAM_CALL_UNITS", "1"))
+
+    @property
+    def QUOTA_BYTES_PER_UNIT(self) -> int:
+        return int(os.getenv("QUOTA_BYTES_PER_UNIT", "1000000"))
+
+    @property
+    def QUOTA_CPU_BUDGET(self) -> float:
+        # CPU seconds per second all workers may use before requests are queued, 0 disables
+        return float(os.getenv("QUOTA_CPU_BUDGET", "0"))
+
+    @property
+    def QUOTA_QUEUE_TIMEOUT_S(self) -> float:
+        # How long a request waits for CPU budget before a 503
+        return float(os.getenv("QUOTA_QUEUE_TIMEOUT_S", "5"))
+
+    @property
+    def REPLAY_PROCESSES(self) -> int:
+        # Replay processes per uvicorn worker (its WEB_CONCURRENCY share of half the CPUs), 0 runs replays in threads
+        workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+        return int(os.getenv("REPLAY_PROCESSES", str(max(1, (os.cpu_count() or 1) // (2 * workers)))))
+
+    @property
+    def REPLAY_QUEUE_SIZE(self) -> int:
+        # Replays waiting for a worker beyond this are refused with 503
+        return int(os.getenv("REPLAY_QUEUE_SIZE", "32"))
+
+    @property
+    def REPLAY_DEADLINE_S(self) -> float:
+        # Queued plus running time after which a replay is given up
+        return float(os.getenv("REPLAY_DEADLINE_S", "30"))
+
+    @property
+    def MIDS_SNAPSHOT_S(self) -> float:
+        # How long fetched mid prices are reused for uPnL (and /v1/pnl ETags), 0 fetches every time
+        return float(os.getenv("MIDS_SNAPSHOT_S", "2"))
+
+    @property
+    def LEDGER_MAX_AGE_S(self) -> int:
+        # Cache-Control max-age of ledger responses, clients revalidate with If-None-Match after it
+        return int(os.getenv("LEDGER_MAX_AGE_S", "2"))
+
+    @property
+    def RESPONSE_ENCODINGS(self) -> str:
+        # Content-Encodings offered for JSON responses, most preferred first, empty disables compression
+        return os.getenv("RESPONSE_ENCODINGS", "zstd,br,gzip")
+
+    @property
+    def COMPRESS_MIN_BYTES(self) -> int:
+        # Smaller bodies are sent uncompressed, the headers would outweigh the saving
+        return int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+    @property
+    def ACCESS_LOG_SAMPLE_RATE(self) -> int:
+        # Log 1 in N successful requests to the access log, errors and slow requests always
+        return int(os.getenv("ACCESS_LOG_SAMPLE_RATE", "10"))
+
+    @property
+    def SLOW_REQUEST_MS(self) -> float:
+        # Requests slower than this have their stage breakdown saved to slow_requests, 0 disables
+        return float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+    @property
+    def API_KEY_CACHE_TTL_S(self) -> float:
+        # How long a verified (or rejected) API key is trusted without asking the database
+        return float(os.getenv("API_KEY_CACHE_TTL_S", "60"))
+
+    @property
+    def APP_SETTINGS_CACHE_TTL_S(self) -> float:
+        # Upper bound on staleness for app_settings changed outside /admin/settings
+        return float(os.getenv("APP_SETTINGS_CACHE_TTL_S", "300"))
+
+    @property
+    def CACHE_VERSION_CHECK_S(self) -> float:
+        # How often each worker polls cache_versions, i.e. how fast revocations propagate
+        return float(os.getenv("CACHE_VERSION_CHECK_S", "1"))
+
+    @property
+    def PROFILE_DIR(self) -> str:
+        # Where admin-triggered profiles (folded stacks) are saved
+        return os.getenv("PROFILE_DIR", "profiles")
+
+    @property
+    def PROFILE_INTERVAL_MS(self) -> float:
+        return float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+    @property
+    def PROFILE_MAX_SECONDS(self) -> float:
+        return float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+    @property
+    def ROLLUP_MINUTE_RETENTION_DAYS(self) -> float:
+        return float(os.getenv("ROLLUP_MINUTE_RETENTION_DAYS", "2"))
+
+    @property
+    def ROLLUP_HOUR_RETENTION_DAYS(self) -> float:
+        return float(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90"))
+
+    @property
+    def ARCHIVE_DIR(self) -> str:
+        # Directory for cold fill segments, empty disables the archive tier
+        return os.getenv("ARCHIVE_DIR", "")
+
+    @property
+    def ARCHIVE_AFTER_DAYS(self) -> int:
+        return int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
 settings = Settings()
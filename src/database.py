@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, text, Float
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, text, Float, UniqueConstraint, inspect, insert, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -55,6 +55,14 @@ class APIKey(Base):
     # Relationship to user
     user = relationship("User", back_populates="api_keys")
 
+# Version counters of the in-process caches (see cache.py), bumped by
+# whatever changes the cached rows so every worker drops its copy.
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
 # Request Log model
 class RequestLog(Base):
     __tablename__ = "request_logs"
@@ -65,7 +73,58 @@ class RequestLog(Base):
     latency_ms = Column(Float)
     api_key = Column(String(255), nullable=True)
     user_addr = Column(String(255), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# Full stage breakdown of requests slower than SLOW_REQUEST_MS, kept next to
+# request_logs (same retention) for slow path analysis.
+class SlowRequest(Base):
+    __tablename__ = "slow_requests"
+
+    id = Column(Integer, primary_key=True)
+    endpoint = Column(String(255))
+    query = Column(String(1024))
+    status_code = Column(Integer)
+    latency_ms = Column(Float)
+    api_key = Column(String(255), nullable=True)
+    user_addr = Column(String(255), nullable=True)
+    stages = Column(String)   # JSON {stage: ms}
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# Request log rollups, one row per (resolution, bucket, endpoint, api key).
+# Maintained incrementally by the request log writer. Latency percentiles
+# come from latency_histograms.
+class RequestRollup(Base):
+    __tablename__ = "request_rollups"
+    __table_args__ = (
+        UniqueConstraint("resolution", "bucket_start", "endpoint", "api_key", name="uq_request_rollup"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    resolution = Column(String(1), nullable=False)   # m, h, d
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    endpoint = Column(String(255), nullable=False)
+    api_key = Column(String(255), nullable=False, default="")   # "" when anonymous
+    count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    latency_sum = Column(Float, nullable=False, default=0.0)
+
+# Latency histograms, one row per (resolution, bucket, endpoint, status class,
+# histogram bucket) holding a count; see histogram.py for the bucket scheme.
+# Workers add their counts, so the rows for a time bucket are the merged
+# histogram across all processes.
+class LatencyHistogramRow(Base):
+    __tablename__ = "latency_histograms"
+    __table_args__ = (
+        UniqueConstraint("resolution", "bucket_start", "endpoint", "status_class", "bucket", name="uq_latency_histogram"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    resolution = Column(String(1), nullable=False)   # m, h, d
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    endpoint = Column(String(255), nullable=False)
+    status_class = Column(String(3), nullable=False)   # 2xx, 4xx, 5xx
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
 
 # Dependency to get database session
 def get_db():
@@ -76,8 +135,27 @@ def get_db():
         db.close()
 
 # Create all tables
+def drop_rollup_latency_columns(connection):
+    """Rebuild request_rollups without the lat_<n> bucket columns of earlier versions.
+
+    They were NOT NULL without a server default, so inserts that leave them out
+    fail. The table is rebuilt rather than altered: older SQLite has no DROP COLUMN.
+    """
+    if "lat_inf" not in {c["name"] for c in inspect(connection).get_columns(RequestRollup.__tablename__)}:
+        return
+    kept = [c for c in RequestRollup.__table__.columns if c.name != "id"]
+    rows = connection.execute(select(*kept)).mappings().all()
+    RequestRollup.__table__.drop(connection)
+    RequestRollup.__table__.create(connection)
+    if rows:
+        connection.execute(insert(RequestRollup), [dict(row) for row in rows])
+
 def init_db():
     print(f"DEBUG: init_db running. Tables: {Base.metadata.tables.keys()}")
     print(f"DEBUG: Engine URL: {engine.url}")
     Base.metadata.create_all(bind=engine)
+    # create_all doesn't add indexes to tables that already exist
+    with engine.begin() as connection:
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_request_logs_created_at ON request_logs (created_at)"))
+        drop_rollup_latency_columns(connection)
     print("DEBUG: init_db complete.")
@@ -1,6 +1,7 @@
 from typing import List, Any, Dict
 from hyperliquid.info import Info
 from .base import DataSource
+from ..metrics import upstream_call
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 class HyperliquidDataSource(DataSource):
@@ -18,10 +19,13 @@ class HyperliquidDataSource(DataSource):
 
     @retry(stop=stop_after_attempt(5), wait=wait_fixed(5))
     def _fetch_fills_chunk(self, address: str, start_time: int = 0) -> List[Any]:
+        # Timed per attempt, so retries show up as separate calls
         if hasattr(self.info, 'user_fills_by_time'):
-            return self.info.user_fills_by_time(address, start_time)
+            with upstream_call("user_fills_by_time"):
+                return self.info.user_fills_by_time(address, start_time)
         else:
-            return self.info.user_fills(address)
+            with upstream_call("user_fills"):
+                return self.info.user_fills(address)
 
     def _fetch_range(self, address: str, start_ts: int, end_ts: int) -> List[Any]:
         """Fetch fills sequentially within a specific time window [start_ts, end_ts]."""
@@ -154,13 +158,16 @@ class HyperliquidDataSource(DataSource):
         return unique_fills
 
     def get_user_funding(self, address: str, start_time: int, end_time: int) -> List[Any]:
-        return self.info.user_funding_history(address, start_time, end_time)
+        with upstream_call("user_funding"):
+            return self.info.user_funding_history(address, start_time, end_time)
 
     def get_user_positions(self, address: str) -> List[Any]:
-        state = self.info.clearinghouse_state(address)
+        with upstream_call("clearinghouse_state"):
+            state = self.info.clearinghouse_state(address)
         return state.get('assetPositions', [])
 
     def get_all_mids(self) -> Dict[str, float]:
         # returns dict: {"ETH": "1800.5", ...} (strings or floats depending on SDK)
         # SDK all_mids() usually returns raw dictionary from API
-        return self.info.all_mids()
+        with upstream_call("all_mids"):
+            return self.info.all_mids()
@@ -0,0 +1,166 @@
+import io
+import csv
+import tempfile
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import orjson
+from fastapi import HTTPException
+
+from .replay import OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY
+
+# Alternative formats for the ledger list endpoints (`format=`), for the
+# frontend and bulk exports. Each encoder consumes replay records as the
+# replay produces them, so a response never holds the whole ledger as rows
+# or models, and all but columnar yield the body in batches as they go:
+#
+#   columnar  {"field": [values...], ...}; JSON needs a column complete before
+#             the next one starts, so nothing can be sent until the replay is
+#             done: each column's encoded values are spooled to a temporary
+#             file (in memory up to COLUMN_SPOOL_BYTES) and sent from there
+#   ndjson    one JSON object per line
+#   csv       header line, then one line per row
+#   arrow     Arrow IPC stream, a record batch per EXPORT_BATCH_ROWS rows
+#             (needs the optional pyarrow package)
+#
+# Decimals are strings in every format, as in the JSON responses, so no
+# precision is lost to a float or a fixed decimal scale.
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_ROWS = 5000
+# Per column, larger spools move to disk
+COLUMN_SPOOL_BYTES = 1024 * 1024
+SPOOL_READ_BYTES = 64 * 1024
+
+JSON = "json"
+COLUMNAR = "columnar"
+NDJSON = "ndjson"
+CSV = "csv"
+ARROW = "arrow"
+FORMATS = (JSON, COLUMNAR, NDJSON, CSV, ARROW)
+
+MEDIA_TYPES = {
+    COLUMNAR: "application/json",
+    NDJSON: "application/x-ndjson",
+    CSV: "text/csv; charset=utf-8",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+
+_STR, _DECIMAL, _INT, _BOOL = "str", "decimal", "int", "bool"
+
+# Fields in the order of the records' to_row(), with their Arrow types
+FIELDS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    OUTPUT_TRADES: (
+        ("coin", _STR), ("side", _STR), ("sz", _DECIMAL), ("px", _DECIMAL), ("time", _INT),
+        ("fee", _DECIMAL), ("builder", _STR), ("closedPnl", _DECIMAL), ("tainted", _BOOL),
+    ),
+    OUTPUT_POSITIONS: (
+        ("timeMs", _INT), ("netSize", _DECIMAL), ("avgEntryPx", _DECIMAL), ("tainted", _BOOL),
+    ),
+    OUTPUT_HISTORY: (
+        ("time", _INT), ("realizedPnl", _DECIMAL), ("feesPaid", _DECIMAL), ("fundingPaid", _DECIMAL),
+        ("netPnl", _DECIMAL), ("tainted", _BOOL),
+    ),
+}
+
+
+def check_format(fmt: str):
+    """400 for an unknown `format=`, 501 for arrow without pyarrow."""
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if fmt == ARROW and pyarrow is None:
+        raise HTTPException(status_code=501, detail="Arrow export is not available on this server")
+
+
+def _batches(records: Iterable[Any]) -> Iterator[List[Dict[str, Any]]]:
+    rows = (record.to_row() for record in records)
+    while True:
+        batch = list(islice(rows, EXPORT_BATCH_ROWS))
+        if not batch:
+            return
+        yield batch
+
+
+def encode_columnar(records: Iterable[Any], output: str) -> Iterator[bytes]:
+    names = [name for name, _ in FIELDS[output]]
+    spools = [tempfile.SpooledTemporaryFile(max_size=COLUMN_SPOOL_BYTES) for _ in names]
+    try:
+        separator = b""
+        for batch in _batches(records):
+            for name, spool in zip(names, spools):
+                # The batch's values without the list brackets
+                spool.write(separator + orjson.dumps([row[name] for row in batch])[1:-1])
+            separator = b","
+        for i, (name, spool) in enumerate(zip(names, spools)):
+            yield (b"{" if i == 0 else b",") + orjson.dumps(name) + b":["
+            spool.seek(0)
+            while chunk := spool.read(SPOOL_READ_BYTES):
+                yield chunk
+            yield b"]"
+            spool.close()
+        yield b"}"
+    finally:
+        for spool in spools:
+            spool.close()
+
+
+def encode_ndjson(records: Iterable[Any], output: str) -> Iterator[bytes]:
+    for batch in _batches(records):
+        yield b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+
+def encode_csv(records: Iterable[Any], output: str) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([name for name, _ in FIELDS[output]])
+    for batch in _batches(records):
+        writer.writerows(row.values() for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header of an empty export
+        yield buffer.getvalue().encode()
+
+
+def arrow_schema(output: str):
+    types = {_STR: pyarrow.string(), _DECIMAL: pyarrow.string(), _INT: pyarrow.int64(), _BOOL: pyarrow.bool_()}
+    return pyarrow.schema([(name, types[kind]) for name, kind in FIELDS[output]])
+
+
+def encode_arrow(records: Iterable[Any], output: str) -> Iterator[bytes]:
+    schema = arrow_schema(output)
+    names = schema.names
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        yield drain()
+        for batch in _batches(records):
+            columns = [[row[name] for row in batch] for name in names]
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(columns, schema=schema))
+            yield drain()
+    # End-of-stream marker
+    yield drain()
+
+
+ENCODERS = {
+    COLUMNAR: encode_columnar,
+    NDJSON: encode_ndjson,
+    CSV: encode_csv,
+    ARROW: encode_arrow,
+}
+
+
+def encode(records: Iterable[Any], fmt: str, output: str) -> Iterator[bytes]:
+    """Body chunks of `records` (replay records of `output`) in export format `fmt`."""
+    return ENCODERS[fmt](records, output)
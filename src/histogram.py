@@ -0,0 +1,71 @@
+import math
+from typing import Dict, Iterable, Tuple
+
+# Log-linear (HDR style) bucketing of latencies in microseconds.
+# Values below 2 * SUB_BUCKETS get one bucket each; above that every power of
+# two is split into SUB_BUCKETS equal buckets, so a bucket is never wider than
+# 1/32 (~3%) of the values in it. A minute-long request lands in bucket ~670.
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+LINEAR_LIMIT = SUB_BUCKETS * 2
+
+
+def bucket_index(value_us: int) -> int:
+    if value_us < LINEAR_LIMIT:
+        return max(0, value_us)
+    shift = value_us.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value_us >> shift)
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """[low, high) in microseconds of the values mapped to `index`."""
+    if index < LINEAR_LIMIT:
+        return index, index + 1
+    shift = index // SUB_BUCKETS - 1
+    sub = index % SUB_BUCKETS + SUB_BUCKETS
+    return sub << shift, (sub + 1) << shift
+
+
+class LatencyHistogram:
+    """Sparse bucket -> count latency histogram.
+
+    Histograms are additive: the ones recorded by different workers, or for
+    consecutive time buckets, merge by adding counts, which is how they are
+    stored and combined in latency_histograms.
+    """
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self, counts: Dict[int, int] = None):
+        self.counts: Dict[int, int] = dict(counts or {})
+        self.total = sum(self.counts.values())
+
+    def record(self, latency_ms: float, n: int = 1):
+        index = bucket_index(int(latency_ms * 1000))
+        self.counts[index] = self.counts.get(index, 0) + n
+        self.total += n
+
+    def add(self, index: int, n: int):
+        self.counts[index] = self.counts.get(index, 0) + n
+        self.total += n
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        for index, n in other.counts.items():
+            self.add(index, n)
+        return self
+
+    def percentile(self, q: float) -> float:
+        """Latency in ms at percentile q (0-100), the midpoint of its bucket."""
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(q / 100 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return (low + high) / 2 / 1000
+        return bucket_bounds(max(self.counts))[1] / 1000
+
+    def percentiles(self, qs: Iterable[float] = (50, 95, 99)) -> Dict[str, float]:
+        return {f"p{q:g}_ms": round(self.percentile(q), 3) for q in qs}
@@ -1,11 +1,14 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Request
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from dotenv import load_dotenv
+from typing import Optional
+import asyncio
 import logging
 import os
+import time
+import threading
 
 # Load environment variables first
 load_dotenv()
@@ -21,9 +24,18 @@ logger = logging.getLogger(__name__)
 from .services import LedgerService
 from .datasources.hyperliquid import HyperliquidDataSource
 from .config import settings
-from .storage.sqlite import SqliteStorage
+from .storage.factory import create_storage, SHAREABLE_TYPES
+from .replay_pool import ReplayPool, cancel_on_disconnect, checked_iter
+from .conditional import (ledger_etag, cache_headers, etag_matches, MarkToMarket,
+                          known_open_coins, remember_open_coins)
+from .serialize import json_response, stream_response, available_encodings
+from . import export
+from .replay import OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY
 from .stream_manager import stream_manager
-from .middleware import TelemetryMiddleware, verify_api_key
+from .ratelimit import create_limiter
+from .middleware import RequestMiddleware, access_log, enforce_quota
+from .telemetry import request_log_writer
+from .metrics import render_latest
 from .routers import admin
 from .routers import auth as auth_router
 from .database import init_db
@@ -33,8 +45,8 @@ app = FastAPI(title="Hyperliquid Trade Ledger Service")
 # Initialize database
 init_db()
 
-# Rate Limiting
-limiter = Limiter(key_func=get_remote_address)
+# Rate Limiting, counted across workers (see ratelimit.py)
+limiter = create_limiter()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -48,31 +60,9 @@ app.add_middleware(
     max_age=3600,
 )
 
-# Security Headers Middleware
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self'"
-    return response
-
-# Request Logging Middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url.path}")
-    logger.info(f"Client IP: {request.client.host if request.client else 'unknown'}")
-    api_key = request.headers.get('X-API-Key', 'No API Key')
-    logger.info(f"API Key: {api_key[:10]}..." if len(api_key) > 10 else "API Key: None")
-    
-    response = await call_next(request)
-    
-    logger.info(f"Response: {response.status_code}")
-    return response
-
-app.add_middleware(TelemetryMiddleware)
+# Security headers, access log, telemetry and timing, in one pure ASGI layer
+# (outermost, so it also times CORS)
+app.add_middleware(RequestMiddleware)
 
 # Include routers
 app.include_router(auth_router.router)
@@ -82,61 +72,185 @@ app.include_router(admin.router)
 data_source = HyperliquidDataSource()
 
 # Initialize Storage
-storage_backend = None
-if settings.STORAGE_TYPE == "sqlite":
-    storage_backend = SqliteStorage(settings.DATABASE_URL)
-# elif settings.STORAGE_TYPE == "postgres":
-#     ...
+storage_backend = create_storage()
+# /admin/archive works on the same backend
+app.state.storage = storage_backend
+
+# Async replays in worker processes, which open the storage themselves
+replay_pool = None
+if settings.REPLAY_PROCESSES > 0 and settings.STORAGE_TYPE in SHAREABLE_TYPES:
+    replay_pool = ReplayPool(
+        settings.STORAGE_TYPE,
+        settings.REPLAY_PROCESSES,
+        queue_size=settings.REPLAY_QUEUE_SIZE,
+        deadline_s=settings.REPLAY_DEADLINE_S,
+    )
+
+service = LedgerService(data_source, storage=storage_backend, replay_pool=replay_pool)
+
+@app.on_event("startup")
+def start_telemetry():
+    request_log_writer.start()
+    access_log.start()
+
+@app.on_event("startup")
+def load_settings():
+    # Warm the app_settings cache; handlers fall back to it when no target_builder is given
+    settings.TARGET_BUILDER
+
+@app.on_event("shutdown")
+def stop_telemetry():
+    # Final flush of queued request logs
+    request_log_writer.stop()
+    access_log.stop()
+
+@app.on_event("shutdown")
+def close_storage():
+    # Flushes the memory snapshot / closes pooled connections and replay workers
+    service.close()
+    if storage_backend is not None:
+        storage_backend.close()
+
+async def ledger_response(request: Request, user: str, target_builder: Optional[str], run,
+                          marked_to_market: bool = False, respond=None) -> Response:
+    """Sync, then answer If-None-Match from the data version; replay with `run(**kwargs)` only on a miss.
+    The result is sent with `respond(result, headers)`, by default as JSON."""
+    if respond is None:
+        respond = lambda result, headers=None: json_response(request, result, headers)
+    version = await service.sync_async(user, target_builder)
+    if version is None:
+        return await respond(await cancel_on_disconnect(request, run(models=False)))
 
-service = LedgerService(data_source, storage=storage_backend)
+    # Records, not models: responses write them directly
+    kwargs = {"synced": True, "models": False}
+    marks = None
+    open_coins = ()
+    if marked_to_market:
+        # uPnL moves with the prices of the open positions: the same snapshot goes into the tag and the replay
+        data_etag = ledger_etag(request.url.path, request.query_params, version)
+        marks = kwargs["mids"] = MarkToMarket(service.mids_snapshot)
+        open_coins = known_open_coins(data_etag)
+        if open_coins:
+            await asyncio.to_thread(marks, open_coins)
 
-@app.get("/v1/trades", dependencies=[Depends(verify_api_key)])
+    def conditional_headers():
+        modified_ms = max(version.fills_ms, version.funding_ms)
+        if marks is not None and marks.coins:
+            modified_ms = max(modified_ms, int(marks.fetched_at * 1000))
+        etag = ledger_etag(request.url.path, request.query_params, version, marks.mids_id() if marks else "")
+        headers = cache_headers(etag, modified_ms, settings.LEDGER_MAX_AGE_S)
+        if not etag_matches(request.headers.get("if-none-match"), etag):
+            return headers, False
+        if available_encodings():
+            headers["Vary"] = "Accept-Encoding"
+        return headers, True
+
+    if open_coins is not None:
+        headers, not_modified = conditional_headers()
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+    result = await cancel_on_disconnect(request, run(**kwargs))
+    if open_coins is None:
+        # First replay of this data version here: now the open coins, and so the tag, are known
+        remember_open_coins(data_etag, marks.coins)
+        headers, not_modified = conditional_headers()
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+    return await respond(result, headers)
+
+async def ledger_export(request: Request, user: str, target_builder: Optional[str], fmt: str, output: str,
+                        **replay_kwargs) -> Response:
+    """`format=` other than json: the replay's records of `output`, encoded and streamed as it runs.
+
+    The replay runs here, not in the replay pool, as the body is pulled. Like a pooled
+    one it is given REPLAY_DEADLINE_S and stopped when the client disconnects.
+    """
+    cancelled = threading.Event()
+
+    async def run(**kwargs):
+        stream = await service.iter_ledger_async(user, outputs=(output,), target_builder=target_builder,
+                                                 **replay_kwargs, **kwargs)
+        deadline = time.time() + settings.REPLAY_DEADLINE_S
+        return export.encode(checked_iter((record for _, record in stream), deadline, cancelled), fmt, output)
+
+    async def respond(chunks, headers=None):
+        return stream_response(request, chunks, export.MEDIA_TYPES[fmt], headers, cancelled=cancelled)
+
+    return await ledger_response(request, user, target_builder, run, respond=respond)
+
+@app.get("/v1/trades", dependencies=[Depends(enforce_quota)])
 @limiter.limit(os.getenv('RATE_LIMIT_PER_MINUTE', '10') + "/minute")
-def get_trades(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, builderOnly: bool = False):
+async def get_trades(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, builderOnly: bool = False,
+                     format: str = export.JSON):
     # Map 'user' to logic 'address'
     if not user:
         raise HTTPException(status_code=400, detail="User address required")
+    export.check_format(format)
     try:
-        data = service.get_trades(user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly)
-        return data
+        if format != export.JSON:
+            return await ledger_export(request, user, None, format, OUTPUT_TRADES,
+                                       coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly)
+        return await ledger_response(request, user, None, lambda **kw: service.get_trades_async(
+            user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly, **kw))
+    except HTTPException:
+        # Replay pool 503s and client disconnects
+        raise
     except Exception as e:
         logger.error(f"Error in get_trades: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/v1/positions/history", dependencies=[Depends(verify_api_key)])
+@app.get("/v1/positions/history", dependencies=[Depends(enforce_quota)])
 @limiter.limit(os.getenv('RATE_LIMIT_PER_MINUTE', '10') + "/minute")
-def get_positions(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, builderOnly: bool = False):
+async def get_positions(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, builderOnly: bool = False,
+                        format: str = export.JSON):
     if not user:
         raise HTTPException(status_code=400, detail="User address required")
+    export.check_format(format)
     try:
-        data = service.get_position_history(user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly)
-        return data
+        if format != export.JSON:
+            return await ledger_export(request, user, None, format, OUTPUT_POSITIONS,
+                                       coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly)
+        return await ledger_response(request, user, None, lambda **kw: service.get_position_history_async(
+            user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly, **kw))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_positions: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/v1/pnl", dependencies=[Depends(verify_api_key)])
+@app.get("/v1/pnl", dependencies=[Depends(enforce_quota)])
 @limiter.limit(os.getenv('RATE_LIMIT_PER_MINUTE', '10') + "/minute")
-def get_pnl(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, target_builder: str = settings.TARGET_BUILDER, builderOnly: bool = True):
+async def get_pnl(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, target_builder: str = None, builderOnly: bool = True):
     if not user:
         raise HTTPException(status_code=400, detail="User address required")
     try:
-        data = service.get_pnl(user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, target_builder=target_builder, builder_only=builderOnly)
-        return data
+        return await ledger_response(request, user, target_builder, lambda **kw: service.get_pnl_async(
+            user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, target_builder=target_builder, builder_only=builderOnly, **kw),
+            marked_to_market=True)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_pnl: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/v1/pnl/history", dependencies=[Depends(verify_api_key)])
+@app.get("/v1/pnl/history", dependencies=[Depends(enforce_quota)])
 @limiter.limit(os.getenv('RATE_LIMIT_PER_MINUTE', '10') + "/minute")
-def get_pnl_history(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, target_builder: str = settings.TARGET_BUILDER, builderOnly: bool = True):
+async def get_pnl_history(request: Request, user: str, coin: str = None, fromMs: int = None, toMs: int = None, target_builder: str = None, builderOnly: bool = True,
+                          format: str = export.JSON):
     if not user:
         raise HTTPException(status_code=400, detail="User address required")
+    export.check_format(format)
     try:
-        data = service.get_pnl_history(user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, target_builder=target_builder, builder_only=builderOnly)
-        return data
+        if format != export.JSON:
+            return await ledger_export(request, user, target_builder, format, OUTPUT_HISTORY,
+                                       coin_filter=coin, from_ms=fromMs, to_ms=toMs, builder_only=builderOnly)
+        return await ledger_response(request, user, target_builder, lambda **kw: service.get_pnl_history_async(
+            user, coin_filter=coin, from_ms=fromMs, to_ms=toMs, target_builder=target_builder, builder_only=builderOnly, **kw))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_pnl_history: {str(e)}")
         import traceback
@@ -145,12 +259,12 @@ def get_pnl_history(request: Request, user: str, coin: str = None, fromMs: int =
 
 @app.get("/v1/leaderboard")
 @limiter.limit(os.getenv('RATE_LIMIT_PER_MINUTE', '10') + "/minute")
-def get_leaderboard(request: Request, coin: str = None, fromMs: int = None, toMs: int = None, metric: str = "pnl", builderOnly: bool = True, maxStartCapital: float = 1000):
+async def get_leaderboard(request: Request, coin: str = None, fromMs: int = None, toMs: int = None, metric: str = "pnl", builderOnly: bool = True, maxStartCapital: float = 1000):
     # Only works if persistence is enabled
     if not service.storage:
         return [] # Or raise 501 Not Implemented? Return empty for now.
     
-    return service.get_leaderboard(metric)
+    return await json_response(request, await service.get_leaderboard_async(metric))
 
 @app.websocket("/ws/events/{address}")
 async def websocket_endpoint(websocket: WebSocket, address: str):
@@ -166,3 +280,9 @@ async def websocket_endpoint(websocket: WebSocket, address: str):
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text exposition, scraped without an API key like /health
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,120 @@
+import os
+import time
+import functools
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest,
+)
+
+from . import timing
+
+# Prometheus metrics for the hot paths. Each worker process keeps its own
+# values; with several workers set PROMETHEUS_MULTIPROC_DIR (to a directory
+# cleared on deploy) and /metrics aggregates the per-process files.
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+FILL_COUNT_BUCKETS = (10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "ledger_http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status_class"], buckets=LATENCY_BUCKETS,
+)
+REPLAY_SECONDS = Histogram(
+    "ledger_replay_duration_seconds", "Time to run a ledger replay to completion, including streamed reads",
+    ["output"], buckets=LATENCY_BUCKETS,
+)
+REPLAY_FILLS = Histogram(
+    "ledger_replay_fills", "Fills replayed per request", ["output"], buckets=FILL_COUNT_BUCKETS,
+)
+UPSTREAM_REQUESTS = Counter(
+    "ledger_upstream_requests_total", "Hyperliquid API calls", ["type", "outcome"],
+)
+UPSTREAM_SECONDS = Histogram(
+    "ledger_upstream_request_duration_seconds", "Hyperliquid API call latency", ["type"], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    "ledger_upstream_rate_limited_total", "Hyperliquid API calls rejected with 429", ["type"],
+)
+STORAGE_SECONDS = Histogram(
+    "ledger_storage_operation_duration_seconds", "Storage call latency (iter_fills per batch)",
+    ["backend", "operation"], buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "ledger_cache_lookups_total", "Cache lookups by result", ["cache", "result"],
+)
+QUOTA_UNITS = Counter(
+    "ledger_quota_units_total", "Work units charged to API key quotas",
+)
+QUOTA_REJECTED = Counter(
+    "ledger_quota_rejected_total", "Requests refused by admission control", ["reason"],
+)
+QUOTA_QUEUED_SECONDS = Histogram(
+    "ledger_quota_queued_seconds", "Time requests waited for the CPU budget", buckets=LATENCY_BUCKETS,
+)
+REPLAY_POOL_WAITING = Gauge(
+    "ledger_replay_pool_waiting", "Replays queued for a worker process", multiprocess_mode="livesum",
+)
+REPLAY_POOL_REJECTED = Counter(
+    "ledger_replay_pool_rejected_total", "Replays refused or stopped by the replay pool", ["reason"],
+)
+WEBSOCKET_SUBSCRIBERS = Gauge(
+    "ledger_websocket_subscribers", "Connected websocket clients", multiprocess_mode="livesum",
+)
+WEBSOCKET_UPSTREAM_SUBSCRIPTIONS = Gauge(
+    "ledger_websocket_upstream_subscriptions", "Addresses subscribed upstream", multiprocess_mode="livesum",
+)
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def status_class(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+def timed_storage(backend: str, operation: str = None):
+    """Decorator recording a storage method's latency under `operation` (default: its name)."""
+    def decorate(fn):
+        observe = STORAGE_SECONDS.labels(backend, operation or fn.__name__).observe
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def upstream_call(call_type: str):
+    """Time one upstream API call and count it by outcome, 429s separately."""
+    start = time.perf_counter()
+    timing.count("upstream_calls")
+    try:
+        yield
+    except Exception as e:
+        if getattr(e, "status_code", None) == 429:
+            UPSTREAM_RATE_LIMITED.labels(call_type).inc()
+            UPSTREAM_REQUESTS.labels(call_type, "rate_limited").inc()
+        else:
+            UPSTREAM_REQUESTS.labels(call_type, "error").inc()
+        raise
+    else:
+        UPSTREAM_REQUESTS.labels(call_type, "ok").inc()
+    finally:
+        UPSTREAM_SECONDS.labels(call_type).observe(time.perf_counter() - start)
+
+
+def render_latest():
+    """(body, content type) of the current metrics in the text exposition format."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,64 +1,247 @@
 from fastapi import Request, HTTPException, Security, Depends
 from fastapi.security.api_key import APIKeyHeader
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.datastructures import QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from logging.handlers import QueueHandler, QueueListener
+import hashlib
+import logging
+import queue
 import time
-from .database import SessionLocal, APIKey, RequestLog
+import asyncio
+from .database import SessionLocal, APIKey
+from .auth import admin_from_request
+from .profiler import profiler
+from .cache import VersionedCache
+from .config import settings
+from .telemetry import request_log_writer
+from .metrics import HTTP_REQUEST_SECONDS, status_class
+from .quota import quota_manager
+from . import timing
 
 # Header scheme
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-async def verify_api_key(api_key: str = Security(api_key_header)):
-    if not api_key:
-        raise HTTPException(status_code=401, detail="Missing API Key")
-    
+# Active keys (and misses) by key hash, dropped in every worker when a key
+# is created or revoked
+API_KEY_CACHE = "api_keys"
+api_key_cache = VersionedCache(
+    API_KEY_CACHE,
+    ttl_s=settings.API_KEY_CACHE_TTL_S,
+    check_interval_s=settings.CACHE_VERSION_CHECK_S,
+)
+
+_UNCACHED = object()
+
+def _load_api_key(api_key: str):
     # Use SQLAlchemy session
     db = SessionLocal()
     try:
         key_record = db.query(APIKey).filter(APIKey.key == api_key, APIKey.is_active == True).first()
         if not key_record:
-             raise HTTPException(status_code=403, detail="Invalid or Inactive API Key")
+            return None
         return {"id": key_record.id, "name": key_record.name} # Return dict for compatibility
     finally:
         db.close()
 
-class TelemetryMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
-        # Process request
-        response = await call_next(request)
-        
-        process_time = time.time() - start_time
-        latency_ms = process_time * 1000
-        
-        # Extract info
-        endpoint = request.url.path
-        
-        # Skip logging for admin endpoints and favicon to avoid noise
-        if endpoint.startswith("/admin") or endpoint.startswith("/docs") or endpoint == "/openapi.json" or endpoint == "/favicon.ico":
-             return response
-
-        api_key = request.headers.get("X-API-Key")
-        status_code = response.status_code
-        
-        # Try to extract 'user' from query params if PnL endpoint
-        user_addr = request.query_params.get("user")
-        
-        # Sync Log via SQLAlchemy
+async def verify_api_key(api_key: str = Security(api_key_header)):
+    if not api_key:
+        raise HTTPException(status_code=401, detail="Missing API Key")
+
+    # Keyed by hash so raw keys are not kept around in memory
+    key_hash = hashlib.sha256(api_key.encode()).digest()
+    key_record = api_key_cache.peek(key_hash, _UNCACHED)
+    if key_record is _UNCACHED:
+        # Misses and version checks query the database, off the event loop
+        key_record = await asyncio.to_thread(api_key_cache.get, key_hash, lambda: _load_api_key(api_key))
+    if key_record is None:
+        raise HTTPException(status_code=403, detail="Invalid or Inactive API Key")
+    return dict(key_record)
+
+async def enforce_quota(request: Request, api_key: dict = Depends(verify_api_key)):
+    # Admission by work units; RequestMiddleware charges the key once the request is done
+    await quota_manager.admit(api_key["id"])
+    request.state.quota_key = api_key["id"]
+    return api_key
+
+def _begin_request_profile(request: Request):
+    # ?profile=1 is honoured for admins only and silently ignored otherwise
+    db = SessionLocal()
+    try:
+        if admin_from_request(request, db) is None:
+            return None
+    finally:
+        db.close()
+    return profiler.begin("request")
+
+SECURITY_HEADERS = (
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"content-security-policy", b"default-src 'self'"),
+)
+
+# Not written to request_logs, to avoid noise
+UNLOGGED_PREFIXES = ("/admin", "/docs")
+UNLOGGED_PATHS = frozenset(("/openapi.json", "/metrics", "/favicon.ico"))
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the request: records are dropped when the queue is full."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog:
+    """One line per request, written by a QueueListener thread.
+
+    Successful requests are sampled 1 in `sample_rate`; errors and slow
+    requests are always logged. Until `start` (app startup) nothing is
+    emitted.
+    """
+
+    def __init__(self, sample_rate: int = 10, max_size: int = 10000):
+        self.logger = logging.getLogger("access")
+        self.logger.propagate = False
+        self.sample_rate = max(1, sample_rate)
+        self._seen = 0
+        self._handler = _DroppingQueueHandler(queue.Queue(maxsize=max_size))
+        self._listener = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        # Delivered to the root logger's handlers (basicConfig), off the event loop
+        self._listener = QueueListener(self._handler.queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self._listener.start()
+        self.logger.addHandler(self._handler)
+
+    def stop(self):
+        if self._listener is not None:
+            self.logger.removeHandler(self._handler)
+            self._listener.stop()
+            self._listener = None
+
+    def log(self, client: str, method: str, path: str, status_code: int, latency_ms: float,
+            api_key: str = None, always: bool = False):
+        if not always:
+            self._seen += 1
+            if self._seen % self.sample_rate:
+                return
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        key = f"{api_key[:10]}..." if api_key else "-"
+        self.logger.info('%s "%s %s" %d %.1fms key=%s', client, method, path, status_code, latency_ms, key)
+
+
+access_log = AccessLog(sample_rate=settings.ACCESS_LOG_SAMPLE_RATE)
+
+
+class RequestMiddleware:
+    """Everything done around a request, as a single pure ASGI layer.
+
+    Sets the security and Server-Timing headers, starts the stage timer,
+    handles admin `?profile=1`, and once the response is sent charges the
+    work quota and records the Prometheus latency, the request log (slow
+    requests with their stages) and the access log line. Response bodies pass through untouched, so
+    streaming responses stream.
+    """
+
+    def __init__(self, app: ASGIApp, slow_ms: float = None, access_log: AccessLog = access_log):
+        self.app = app
+        self.slow_ms = settings.SLOW_REQUEST_MS if slow_ms is None else slow_ms
+        self.access_log = access_log
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        # Stages recorded anywhere on the request path land in this timer
+        timer = timing.begin()
+        sampler = None
+        if b"profile=1" in scope.get("query_string", b""):
+            request = Request(scope)
+            if request.query_params.get("profile") == "1":
+                sampler = await asyncio.to_thread(_begin_request_profile, request)
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, sampler
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.extend(SECURITY_HEADERS)
+                headers.append((b"server-timing", timer.server_timing().encode()))
+                if sampler is not None:
+                    profile_id = await self._end_profile(sampler, scope, status_code, start)
+                    sampler = None
+                    headers.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                timer.count("bytes", len(message.get("body", b"")))
+            await send(message)
+
         try:
-            db = SessionLocal()
-            log_entry = RequestLog(
-                endpoint=endpoint,
-                status_code=status_code,
-                latency_ms=latency_ms,
-                api_key=api_key,
-                user_addr=user_addr
-            )
-            db.add(log_entry)
-            db.commit()
-            db.close()
-        except Exception as e:
-            print(f"Logging Error: {e}")
-            
-        return response
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if sampler is not None:
+                # Failed before a response was started
+                await self._end_profile(sampler, scope, status_code, start)
+            self._record(scope, status_code, time.perf_counter() - start, timer)
+
+    async def _end_profile(self, sampler, scope: Scope, status_code: int, start: float) -> str:
+        return await asyncio.to_thread(
+            profiler.end, sampler, endpoint=scope["path"], query=scope.get("query_string", b"").decode("latin-1"),
+            status_code=status_code, latency_ms=round((time.perf_counter() - start) * 1000, 1),
+        )
+
+    def _record(self, scope: Scope, status_code: int, latency_s: float, timer: timing.StageTimer):
+        quota_manager.charge(scope.get("state", {}).get("quota_key"), timer)
+
+        method = scope["method"]
+        path = scope["path"]
+        latency_ms = latency_s * 1000
+
+        # Labelled by route template, not the raw path, to keep cardinality bounded
+        route = scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            method, route.path if route else "unmatched", status_class(status_code)
+        ).observe(latency_s)
+
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+                break
+
+        # Slow requests keep their full breakdown
+        slow = self.slow_ms > 0 and latency_ms >= self.slow_ms
+        client = scope.get("client")
+        self.access_log.log(client[0] if client else "unknown", method, path, status_code, latency_ms,
+                            api_key, always=slow or status_code >= 500)
+
+        if path.startswith(UNLOGGED_PREFIXES) or path in UNLOGGED_PATHS:
+            return
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        # Try to extract 'user' from query params if PnL endpoint
+        user_addr = QueryParams(query).get("user") if query else None
+
+        # Queued, written in batches by the background writer
+        request_log_writer.log(
+            endpoint=path,
+            status_code=status_code,
+            latency_ms=latency_ms,
+            api_key=api_key,
+            user_addr=user_addr,
+            stages=dict(timer.stages) if slow else None,
+            query=query if slow else None,
+        )
@@ -0,0 +1,178 @@
+import os
+import re
+import sys
+import json
+import time
+import secrets
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID = re.compile(r"^[0-9]+-[a-z]+-[0-9a-f]+$")
+
+
+def _frame_label(code) -> str:
+    # Function + definition line, not the current line, so samples of one
+    # function merge into a single flamegraph frame
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Statistical profiler sampling the stacks of every thread in the process.
+
+    A background thread walks sys._current_frames() every `interval_ms` and
+    counts each folded stack ("thread;outer;...;inner"), the input format of
+    flamegraph.pl and speedscope. Nothing is hooked into the interpreter, so
+    the overhead is one stack walk per thread per interval while it runs.
+    """
+
+    def __init__(self, profile_id: str, kind: str, interval_ms: float = 5, max_depth: int = 128):
+        self.profile_id = profile_id
+        self.kind = kind
+        self.interval = interval_ms / 1000
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.duration_s = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.duration_s = time.time() - self.started_at
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None and len(labels) < self.max_depth:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Profiles saved as `<id>.folded` with a `<id>.json` metadata sidecar.
+
+    Both are written under temporary names and renamed into place, the sidecar
+    first, so a profile whose `.folded` exists is always complete and listed.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def save(self, sampler: StackSampler, **meta) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = sampler.profile_id
+        info = {
+            "id": profile_id,
+            "kind": sampler.kind,
+            "created_at": datetime.utcfromtimestamp(sampler.started_at).isoformat(),
+            "duration_s": round(sampler.duration_s, 3),
+            "samples": sampler.samples,
+            **meta,
+        }
+        self._publish(profile_id + ".json", json.dumps(info))
+        self._publish(profile_id + ".folded", sampler.folded())
+        return profile_id
+
+    def _publish(self, name: str, content: str):
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return profiles
+
+    def path(self, profile_id: str) -> Optional[str]:
+        # The id is part of a path, never trust it
+        if not PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + ".folded")
+        return path if os.path.exists(path) else None
+
+
+class Profiler:
+    """Runs one sampler at a time for the process; a second request is refused."""
+
+    def __init__(self, store: ProfileStore, interval_ms: float = 5, max_seconds: float = 60):
+        self.store = store
+        self.interval_ms = interval_ms
+        self.max_seconds = max_seconds
+        self._busy = threading.Lock()
+
+    def begin(self, kind: str) -> Optional[StackSampler]:
+        """Start sampling, or None if a profile is already running."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile_id = f"{int(time.time() * 1000)}-{kind}-{secrets.token_hex(4)}"
+        sampler = StackSampler(profile_id, kind, self.interval_ms)
+        sampler.start()
+        return sampler
+
+    def end(self, sampler: StackSampler, **meta) -> str:
+        """Stop sampling and save the profile with `meta`. Returns its id."""
+        try:
+            sampler.stop()
+        finally:
+            self._busy.release()
+        return self.store.save(sampler, **meta)
+
+    def run_for(self, seconds: float) -> Optional[str]:
+        """Time-boxed process-wide profile in the background. Returns its id, available once done."""
+        seconds = min(seconds, self.max_seconds)
+        sampler = self.begin("process")
+        if sampler is None:
+            return None
+
+        def finish():
+            time.sleep(seconds)
+            profile_id = self.end(sampler, requested_s=seconds)
+            logger.info(f"Saved {seconds}s process profile {profile_id}")
+
+        threading.Thread(target=finish, name="profile-timer", daemon=True).start()
+        return sampler.profile_id
+
+
+profiler = Profiler(
+    ProfileStore(settings.PROFILE_DIR),
+    interval_ms=settings.PROFILE_INTERVAL_MS,
+    max_seconds=settings.PROFILE_MAX_SECONDS,
+)
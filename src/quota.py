@@ -0,0 +1,141 @@
+import math
+import time
+import asyncio
+import threading
+from typing import Optional
+
+from fastapi import HTTPException
+from limits import RateLimitItemPerMinute, RateLimitItemPerSecond
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from .config import settings
+from .metrics import QUOTA_UNITS, QUOTA_REJECTED, QUOTA_QUEUED_SECONDS
+from .timing import StageTimer
+from . import ratelimit  # noqa: F401 - registers shm://
+
+# Cost-based admission control. @limiter.limit counts requests, but a
+# replay of 500k fills costs thousands of times one of 50 fills, so API
+# keys also get a budget of work units per minute, charged after each
+# request from the counts the ledger keeps on the request's StageTimer:
+#
+#   units = 1 + fills / FILLS_PER_UNIT + upstream calls * UPSTREAM_CALL_UNITS
+#             + bytes sent / BYTES_PER_UNIT
+#
+# A key over its budget is refused (429) until the sliding window frees
+# up. Separately, process CPU time is charged to a global budget in CPU
+# seconds per second across all workers; while it is spent, requests wait
+# for up to QUOTA_QUEUE_TIMEOUT_S and are then refused (503). Replays in
+# the replay pool burn their CPU in other processes, which report it as the
+# request's "worker_cpu_ms" count; that is charged along with the request.
+# Both budgets live in the rate limit storage, so they are shared between
+# workers.
+
+CPU_WINDOW_S = 10
+QUEUE_POLL_S = 0.05
+# Charges never fail, the limit only applies to admission
+_NO_LIMIT = 2 ** 31
+
+
+class QuotaManager:
+    def __init__(self, storage, units_per_minute: int, cpu_budget: float = 0, queue_timeout_s: float = 5,
+                 fills_per_unit: int = 1000, upstream_call_units: float = 1, bytes_per_unit: int = 1_000_000,
+                 cpu_clock=time.process_time):
+        self.storage = storage
+        self.limiter = SlidingWindowCounterRateLimiter(storage)
+        self.units_item = RateLimitItemPerMinute(units_per_minute, namespace="QUOTA") if units_per_minute > 0 else None
+        # CPU is counted in milliseconds per window
+        self.cpu_item = (
+            RateLimitItemPerSecond(int(cpu_budget * CPU_WINDOW_S * 1000), CPU_WINDOW_S, namespace="CPU")
+            if cpu_budget > 0 else None
+        )
+        self.queue_timeout = queue_timeout_s
+        self.fills_per_unit = fills_per_unit
+        self.upstream_call_units = upstream_call_units
+        self.bytes_per_unit = bytes_per_unit
+        self.cpu_clock = cpu_clock
+        self._cpu_mark = cpu_clock()
+        self._cpu_lock = threading.Lock()
+
+    def units(self, timer: StageTimer) -> int:
+        counts = timer.counts
+        return math.ceil(
+            1
+            + counts.get("fills", 0) / self.fills_per_unit
+            + counts.get("upstream_calls", 0) * self.upstream_call_units
+            + counts.get("bytes", 0) / self.bytes_per_unit
+        )
+
+    async def admit(self, key_id: int):
+        """Raise 429 if the key's budget is spent; wait for CPU budget, then raise 503."""
+        if self.units_item is not None and not self.limiter.test(self.units_item, str(key_id)):
+            QUOTA_REJECTED.labels("key_budget").inc()
+            raise HTTPException(
+                status_code=429, detail="Work unit quota exceeded",
+                headers={"Retry-After": self._retry_after(self.units_item, str(key_id))},
+            )
+
+        if self.cpu_item is None or self.limiter.test(self.cpu_item, "global"):
+            return
+        start = time.perf_counter()
+        deadline = start + self.queue_timeout
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(QUEUE_POLL_S)
+            # Charge our own worker's usage while waiting, other workers charge theirs
+            self._charge_cpu()
+            if self.limiter.test(self.cpu_item, "global"):
+                QUOTA_QUEUED_SECONDS.observe(time.perf_counter() - start)
+                return
+        QUOTA_QUEUED_SECONDS.observe(time.perf_counter() - start)
+        QUOTA_REJECTED.labels("cpu_budget").inc()
+        raise HTTPException(
+            status_code=503, detail="Server busy",
+            headers={"Retry-After": self._retry_after(self.cpu_item, "global")},
+        )
+
+    def charge(self, key_id: Optional[int], timer: StageTimer) -> int:
+        """Charge a finished request to its key (if admitted with one) and its CPU to the global budget."""
+        self._charge_cpu(timer.counts.get("worker_cpu_ms", 0))
+        if key_id is None or self.units_item is None:
+            return 0
+        units = self.units(timer)
+        self.storage.acquire_sliding_window_entry(
+            self.units_item.key_for(str(key_id)), _NO_LIMIT, self.units_item.get_expiry(), units,
+        )
+        QUOTA_UNITS.inc(units)
+        return units
+
+    def remaining(self, key_id: int) -> Optional[int]:
+        if self.units_item is None:
+            return None
+        return self.limiter.get_window_stats(self.units_item, str(key_id)).remaining
+
+    def _charge_cpu(self, worker_ms: int = 0):
+        if self.cpu_item is None:
+            return
+        # Process CPU since the last charge, whichever request spent it, plus replay pool CPU
+        with self._cpu_lock:
+            now = self.cpu_clock()
+            own_ms = max(int((now - self._cpu_mark) * 1000), 0)
+            self._cpu_mark += own_ms / 1000
+            ms = own_ms + worker_ms
+            if ms <= 0:
+                return
+        self.storage.acquire_sliding_window_entry(
+            self.cpu_item.key_for("global"), _NO_LIMIT, self.cpu_item.get_expiry(), ms,
+        )
+
+    def _retry_after(self, item, identifier: str) -> str:
+        reset = self.limiter.get_window_stats(item, identifier).reset_time
+        return str(max(1, math.ceil(reset - time.time())))
+
+
+quota_manager = QuotaManager(
+    storage_from_string(settings.RATE_LIMIT_STORAGE_URI),
+    units_per_minute=settings.QUOTA_UNITS_PER_MINUTE,
+    cpu_budget=settings.QUOTA_CPU_BUDGET,
+    queue_timeout_s=settings.QUOTA_QUEUE_TIMEOUT_S,
+    fills_per_unit=settings.QUOTA_FILLS_PER_UNIT,
+    upstream_call_units=settings.QUOTA_UPSTREAM_CALL_UNITS,
+    bytes_per_unit=settings.QUOTA_BYTES_PER_UNIT,
+)
@@ -0,0 +1,269 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+import weakref
+from functools import lru_cache
+from math import floor
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from limits.storage import Storage, SlidingWindowCounterSupport
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from .config import settings
+
+# Rate limit counters shared by every worker on the host. slowapi's default
+# memory:// storage is per process, so with `uvicorn --workers N` each
+# worker allowed the full limit. SharedMemoryStorage keeps the counters in
+# a memory-mapped file (under /dev/shm when available): a fixed-size open
+# addressing table of 32-byte slots, one per rate limit key, updated under
+# a flock held for a few struct reads and writes.
+
+MAGIC = b"LDGRRL01"
+HEADER = struct.Struct("<8sQ")  # magic, slot count
+# key hash, window index, window length (s), current window count, previous window count, unused
+SLOT = struct.Struct("<QqIIII")
+MAX_PROBE = 32
+DEFAULT_SLOTS = 65536
+
+SLIDING_WINDOW = "sliding-window-counter"
+
+
+@lru_cache(maxsize=65536)
+def _key_hash(key: str) -> int:
+    # Python's hash() is salted per process, the table is shared between processes.
+    # 0 marks a never used slot.
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def _roll(window: int, current_window: int, current: int, previous: int) -> Tuple[int, int]:
+    """(current, previous) counts as of `current_window` for a slot last written in `window`."""
+    if window == current_window:
+        return current, previous
+    if window == current_window - 1:
+        return 0, current
+    return 0, 0
+
+
+# Instances are reopened in forked children: an inherited descriptor shares
+# its flock with the parent, which would make the lock a no-op between them
+_instances = weakref.WeakSet()
+
+
+def _reopen_after_fork():
+    for storage in list(_instances):
+        storage._open()
+
+
+os.register_at_fork(after_in_child=_reopen_after_fork)
+
+
+class SharedMemoryStorage(Storage, SlidingWindowCounterSupport):
+    """limits storage for `shm://<name>` (or `shm:///absolute/path`), optionally `?slots=N`.
+
+    Windows are aligned to multiples of their length, so a slot holds the
+    counts of the current and previous window and rolls them over on the
+    first access in a new window. A key whose probe sequence is full
+    takes over the stalest slot there, resetting whichever key owned it;
+    size `slots` well above the number of clients seen per window.
+    """
+
+    STORAGE_SCHEME = ["shm"]
+
+    def __init__(self, uri: str = "shm://ratelimit", wrap_exceptions: bool = False, slots: int = None, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri)
+        if parsed.netloc:
+            directory = "/dev/shm" if os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+            self.path = os.path.join(directory, parsed.netloc + parsed.path.replace("/", "-"))
+        else:
+            self.path = parsed.path
+        query_slots = parse_qs(parsed.query).get("slots")
+        self.slots = int(slots or (query_slots[0] if query_slots else DEFAULT_SLOTS))
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._open()
+        _instances.add(self)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def _open(self):
+        # Threads share the flock, so they also take a per-instance lock
+        self._thread_lock = threading.Lock()
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            if len(header) == HEADER.size and HEADER.unpack(header)[0] == MAGIC:
+                # Created by another worker (or a previous run): use its size
+                self.slots = HEADER.unpack(header)[1]
+            else:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, HEADER.size + self.slots * SLOT.size)
+                os.pwrite(fd, HEADER.pack(MAGIC, self.slots), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, HEADER.size + self.slots * SLOT.size)
+
+    def _lock(self):
+        self._thread_lock.acquire()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def _find(self, key_hash: int, now: float, create: bool) -> Optional[int]:
+        """Offset of the slot for `key_hash`, claiming one if `create`. Call with the lock held."""
+        mm = self._map
+        index = key_hash % self.slots
+        reusable = None
+        stalest = None
+        for _ in range(MAX_PROBE):
+            offset = HEADER.size + index * SLOT.size
+            slot_hash, window, length, _, _, _ = SLOT.unpack_from(mm, offset)
+            if slot_hash == key_hash:
+                return offset
+            if slot_hash == 0:
+                # Never used, so the key is not further along either
+                if reusable is None:
+                    reusable = offset
+                break
+            if reusable is None:
+                if window < int(now // length) - 1:
+                    reusable = offset
+                elif stalest is None or window < stalest[0]:
+                    stalest = (window, offset)
+            index = (index + 1) % self.slots
+        if not create:
+            return None
+        offset = reusable if reusable is not None else stalest[1]
+        SLOT.pack_into(mm, offset, key_hash, 0, 1, 0, 0, 0)
+        return offset
+
+    def _counts(self, offset: int, now: float) -> Tuple[int, int, int]:
+        """(window length, current count, previous count) of the slot at `offset` as of `now`."""
+        _, window, length, current, previous, _ = SLOT.unpack_from(self._map, offset)
+        current, previous = _roll(window, int(now // length), current, previous)
+        return length, current, previous
+
+    def _add(self, key: str, expiry: int, amount: int, limit: Optional[int]) -> Tuple[bool, int]:
+        now = time.time()
+        expiry = int(expiry)
+        current_window = int(now // expiry)
+        key_hash = _key_hash(key)
+        self._lock()
+        try:
+            offset = self._find(key_hash, now, create=True)
+            _, window, length, current, previous, _ = SLOT.unpack_from(self._map, offset)
+            if length != expiry:
+                current, previous = 0, 0
+            else:
+                current, previous = _roll(window, current_window, current, previous)
+            if limit is not None:
+                previous_ttl = (current_window + 1) * expiry - now
+                if floor(previous * previous_ttl / expiry + current) + amount > limit:
+                    return False, current
+            current += amount
+            SLOT.pack_into(self._map, offset, key_hash, current_window, expiry, current, previous, 0)
+            return True, current
+        finally:
+            self._unlock()
+
+    def _read(self, key: str) -> Optional[Tuple[int, int, int, float]]:
+        now = time.time()
+        self._lock()
+        try:
+            offset = self._find(_key_hash(key), now, create=False)
+            if offset is None:
+                return None
+            return (*self._counts(offset, now), now)
+        finally:
+            self._unlock()
+
+    # Sliding window counter
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        return self._add(key, expiry, amount, limit)[0]
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        state = self._read(key)
+        now = state[3] if state else time.time()
+        remaining = (int(now // expiry) + 1) * expiry - now
+        if state is None or state[0] != int(expiry):
+            return 0, 0.0, 0, remaining + expiry
+        _, current, previous, _ = state
+        return previous, remaining if previous else 0.0, current, remaining + expiry
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        self.clear(key)
+
+    # Fixed window, with windows aligned like the sliding ones
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        return self._add(key, expiry, amount, None)[1]
+
+    def get(self, key: str) -> int:
+        state = self._read(key)
+        return state[1] if state else 0
+
+    def get_expiry(self, key: str) -> float:
+        state = self._read(key)
+        if state is None:
+            return time.time()
+        length, _, _, now = state
+        return (int(now // length) + 1) * length
+
+    def clear(self, key: str) -> None:
+        now = time.time()
+        key_hash = _key_hash(key)
+        self._lock()
+        try:
+            offset = self._find(key_hash, now, create=False)
+            if offset is not None:
+                # The hash stays: emptying the slot would cut other keys' probe sequences
+                _, window, length, _, _, _ = SLOT.unpack_from(self._map, offset)
+                SLOT.pack_into(self._map, offset, key_hash, window, length, 0, 0, 0)
+        finally:
+            self._unlock()
+
+    def check(self) -> bool:
+        return self._map is not None and not self._map.closed
+
+    def reset(self) -> Optional[int]:
+        now = time.time()
+        self._lock()
+        try:
+            live = 0
+            for index in range(self.slots):
+                offset = HEADER.size + index * SLOT.size
+                slot_hash, window, length, _, _, _ = SLOT.unpack_from(self._map, offset)
+                if slot_hash and window >= int(now // length) - 1:
+                    live += 1
+            self._map[HEADER.size:] = bytes(self.slots * SLOT.size)
+            return live
+        finally:
+            self._unlock()
+
+
+def create_limiter() -> Limiter:
+    """slowapi Limiter keyed by client address on the configured (shared) storage."""
+    return Limiter(
+        key_func=get_remote_address,
+        storage_uri=settings.RATE_LIMIT_STORAGE_URI,
+        strategy=SLIDING_WINDOW,
+    )
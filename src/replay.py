@@ -0,0 +1,499 @@
+"""Single-pass ledger replay.
+
+Fills (and funding) are consumed as time-ordered streams and replayed per coin.
+Only the currently open position lifecycle of each coin is buffered, because its
+taint status is only known once it closes. Everything else is either emitted
+immediately (position snapshots) or released in time order as soon as no
+earlier output can still appear (trades, PnL history). Outputs the caller did
+not ask for are never materialized.
+"""
+import heapq
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .models import Trade, PositionState, PnLHistoryEntry
+
+ZERO = Decimal("0.0")
+ONE = Decimal("1")
+MINUS_ONE = Decimal("-1")
+EPSILON = Decimal("1e-9")
+
+OUTPUT_TRADES = "trades"
+OUTPUT_POSITIONS = "positions"
+OUTPUT_HISTORY = "history"
+ALL_OUTPUTS = (OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY)
+
+_KIND_TRADE = 0
+_KIND_FUNDING = 1
+
+
+class TradeRecord:
+    """Internal trade row. Converted to the `Trade` model only when emitted."""
+    __slots__ = ("coin", "side", "sz", "px", "time", "fee", "builder", "closedPnl", "tainted")
+
+    def __init__(self, coin, side, sz, px, time, fee, builder, closed_pnl):
+        self.coin = coin
+        self.side = side
+        self.sz = sz
+        self.px = px
+        self.time = time
+        self.fee = fee
+        self.builder = builder
+        self.closedPnl = closed_pnl
+        self.tainted = False
+
+    def to_model(self) -> Trade:
+        return Trade(
+            coin=self.coin,
+            side=self.side,
+            sz=self.sz,
+            px=self.px,
+            time=self.time,
+            fee=self.fee,
+            builder=self.builder,
+            closedPnl=self.closedPnl,
+            tainted=self.tainted
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        # The model's JSON form (Decimals as strings), without building the model
+        return {
+            "coin": self.coin,
+            "side": self.side,
+            "sz": str(self.sz),
+            "px": str(self.px),
+            "time": self.time,
+            "fee": str(self.fee),
+            "builder": self.builder,
+            "closedPnl": str(self.closedPnl),
+            "tainted": self.tainted,
+        }
+
+
+class PositionRecord:
+    """Internal position snapshot, see `PositionState`."""
+    __slots__ = ("timeMs", "netSize", "avgEntryPx", "tainted")
+
+    def __init__(self, time_ms, net_size, avg_entry_px, tainted):
+        self.timeMs = time_ms
+        self.netSize = net_size
+        self.avgEntryPx = avg_entry_px
+        self.tainted = tainted
+
+    def to_model(self) -> PositionState:
+        return PositionState(
+            timeMs=self.timeMs,
+            netSize=self.netSize,
+            avgEntryPx=self.avgEntryPx,
+            tainted=self.tainted
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "timeMs": self.timeMs,
+            "netSize": str(self.netSize),
+            "avgEntryPx": str(self.avgEntryPx),
+            "tainted": self.tainted,
+        }
+
+
+class HistoryRecord:
+    """Internal equity curve point, see `PnLHistoryEntry`."""
+    __slots__ = ("time", "realizedPnl", "feesPaid", "fundingPaid", "netPnl", "tainted")
+
+    def __init__(self, time, realized_pnl, fees_paid, funding_paid, net_pnl, tainted):
+        self.time = time
+        self.realizedPnl = realized_pnl
+        self.feesPaid = fees_paid
+        self.fundingPaid = funding_paid
+        self.netPnl = net_pnl
+        self.tainted = tainted
+
+    def to_model(self) -> PnLHistoryEntry:
+        return PnLHistoryEntry(
+            time=self.time,
+            realizedPnl=self.realizedPnl,
+            feesPaid=self.feesPaid,
+            fundingPaid=self.fundingPaid,
+            netPnl=self.netPnl,
+            tainted=self.tainted
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "time": self.time,
+            "realizedPnl": str(self.realizedPnl),
+            "feesPaid": str(self.feesPaid),
+            "fundingPaid": str(self.fundingPaid),
+            "netPnl": str(self.netPnl),
+            "tainted": self.tainted,
+        }
+
+
+class _CoinState:
+    __slots__ = (
+        "net_size", "avg_entry_px",
+        "seen_fill", "lifecycle_open", "lifecycle_tainted",
+        "lifecycle_trades", "lifecycle_funding", "lifecycle_sums",
+        "held_funding", "pending_since",
+    )
+
+    def __init__(self):
+        self.net_size = ZERO
+        self.avg_entry_px = ZERO
+        self.seen_fill = False
+        self.lifecycle_open = False
+        self.lifecycle_tainted = False
+        # Buffered until the lifecycle closes (records only when trades/history are wanted)
+        self.lifecycle_trades: List[TradeRecord] = []
+        self.lifecycle_funding: List[Tuple[int, Decimal]] = []
+        # [pnl, fees, count, has_builder_trades] for aggregate-only replays
+        self.lifecycle_sums = [ZERO, ZERO, 0, False]
+        # Funding seen while flat, resolved by the next fill of this coin
+        self.held_funding: List[Tuple[int, Decimal]] = []
+        # Time of the oldest buffered item, bounds what may be released
+        self.pending_since: Optional[int] = None
+
+
+class LedgerReplay:
+    """Replays a time-ordered fill stream and yields `(kind, item)` outputs.
+
+    Items are pydantic models, or with `models=False` the internal records
+    (`TradeRecord`, `PositionRecord`, `HistoryRecord`) that `src.serialize`
+    writes without building the models. Iterate it once. After iteration the aggregate attributes (`realized_pnl`,
+    `fees_paid`, `funding_paid`, `trade_count`, `tainted`, `open_positions`)
+    hold the final totals.
+
+    Taint follows the position lifecycle: once any fill in a lifecycle is not
+    attributed to the target builder, all of the lifecycle's trades and the
+    funding that accrued while it was open are tainted. Funding stamped at the
+    same millisecond as a fill counts towards that fill's lifecycle.
+    """
+
+    def __init__(self, fills: Iterable[Dict[str, Any]], funding: Iterable[Dict[str, Any]] = (),
+                 target_builder: str = None, builder_only: bool = False,
+                 from_ms: int = None, to_ms: int = None, outputs: Iterable[str] = ALL_OUTPUTS,
+                 models: bool = True):
+        self.fills = fills
+        self.funding = funding
+        self.target_builder = target_builder
+        self.builder_only = builder_only
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+        self.models = models
+
+        outputs = set(outputs)
+        self.want_trades = OUTPUT_TRADES in outputs
+        self.want_positions = OUTPUT_POSITIONS in outputs
+        self.want_history = OUTPUT_HISTORY in outputs
+        self._keep_records = self.want_trades or self.want_history
+
+        self._coins: Dict[str, _CoinState] = {}
+        # Coins with buffered items, their oldest item bounds what may be released
+        self._pending: Dict[str, _CoinState] = {}
+        self._seq = 0
+        self._trade_heap: List[tuple] = []
+        self._history_heap: List[tuple] = []
+        self._ready: List[Tuple[str, Any]] = []
+
+        # Running history accumulators
+        self._cum_realized = ZERO
+        self._cum_fees = ZERO
+        self._cum_funding = ZERO
+
+        # Aggregates
+        self.realized_pnl = ZERO
+        self.fees_paid = ZERO
+        self.funding_paid = ZERO
+        self.trade_count = 0
+        self.tainted = False
+        self.fill_count = 0
+        self.open_positions: List[Tuple[str, Decimal, Decimal, bool]] = []
+
+    # --- Driver ---
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        funding = sorted(self.funding, key=lambda x: x['time'])
+        funding_idx = 0
+        funding_len = len(funding)
+
+        for fill in self.fills:
+            ts = fill['time']
+            # Funding at or before this fill accrues to the position as it was
+            while funding_idx < funding_len and funding[funding_idx]['time'] <= ts:
+                self._on_funding(funding[funding_idx])
+                funding_idx += 1
+
+            self._on_fill(fill)
+            if self._trade_heap or self._history_heap:
+                self._release(ts)
+            if self._ready:
+                yield from self._ready
+                self._ready.clear()
+
+        while funding_idx < funding_len:
+            self._on_funding(funding[funding_idx])
+            funding_idx += 1
+
+        self._finish()
+        self._release(None)
+        yield from self._ready
+        self._ready.clear()
+
+    # --- Events ---
+
+    def _state(self, coin: str) -> _CoinState:
+        st = self._coins.get(coin)
+        if st is None:
+            st = self._coins[coin] = _CoinState()
+        return st
+
+    def _on_funding(self, f: Dict[str, Any]):
+        # Hyperliquid SDK return format check
+        coin = f.get('coin') or f.get('token')
+        if not coin:
+            return
+        ts = f['time']
+        amount = Decimal(str(f['usdc'])) if 'usdc' in f else ZERO
+
+        st = self._state(coin)
+        if st.lifecycle_open:
+            if self._resolvable(st):
+                if not (self.builder_only and st.lifecycle_tainted):
+                    self._accept_funding(ts, amount)
+                else:
+                    self.tainted = True
+                return
+            st.lifecycle_funding.append((ts, amount))
+        else:
+            st.held_funding.append((ts, amount))
+        self._mark_pending(coin, st, ts)
+
+    def _on_fill(self, fill: Dict[str, Any]):
+        self.fill_count += 1
+        coin = fill['coin']
+        timestamp = fill['time']
+        st = self._state(coin)
+        st.seen_fill = True
+
+        if not st.lifecycle_open:
+            # Funding held while flat: same-millisecond funding belongs to the
+            # lifecycle opening now, anything older accrued while flat.
+            if st.held_funding:
+                for ts, amount in st.held_funding:
+                    if ts == timestamp:
+                        st.lifecycle_funding.append((ts, amount))
+                    else:
+                        self._accept_funding(ts, amount)
+                st.held_funding = []
+                self._clear_pending(coin, st)
+                if st.lifecycle_funding:
+                    self._mark_pending(coin, st, st.lifecycle_funding[0][0])
+            st.lifecycle_open = True
+
+        side = fill['side']
+        sz = Decimal(str(fill['sz']))
+        px = Decimal(str(fill['px']))
+        fee = Decimal(str(fill['fee'])) if fill.get('fee') is not None else ZERO
+
+        # Builder Attribution
+        builder_address = fill.get('builder') or (fill.get('builderInfo') or {}).get('builder')
+        if builder_address:
+            builder_address = builder_address.lower()
+
+        direction = ONE if side in ('B', 'Buy') else MINUS_ONE
+        signed_sz = sz * direction
+        trade_pnl = ZERO
+
+        current_net_size = st.net_size
+        avg_entry_px = st.avg_entry_px
+        is_opening = (current_net_size >= 0 and direction > 0) or (current_net_size <= 0 and direction < 0)
+
+        if is_opening:
+            total_value = (abs(current_net_size) * avg_entry_px) + (sz * px)
+            new_size = abs(current_net_size) + sz
+            if new_size > 0:
+                avg_entry_px = total_value / new_size
+            current_net_size += signed_sz
+        else:
+            amount_closed = min(abs(current_net_size), sz)
+            pnl_direction = ONE if current_net_size > 0 else MINUS_ONE
+            trade_pnl = (px - avg_entry_px) * pnl_direction * amount_closed
+            current_net_size += signed_sz
+            if (pnl_direction == 1 and current_net_size < 0) or (pnl_direction == -1 and current_net_size > 0):
+                avg_entry_px = px
+
+        st.net_size = current_net_size
+        st.avg_entry_px = avg_entry_px
+
+        # Taint rule: non-builder activity anywhere in the lifecycle taints all of it
+        if self.target_builder and builder_address != self.target_builder:
+            st.lifecycle_tainted = True
+
+        if self._keep_records:
+            st.lifecycle_trades.append(TradeRecord(coin, side, sz, px, timestamp, fee, builder_address, trade_pnl))
+        elif self._in_window(timestamp):
+            sums = st.lifecycle_sums
+            if not self.builder_only:
+                # Aggregates don't depend on taint, no need to hold them back
+                self.realized_pnl += trade_pnl
+                self.fees_paid += fee
+                self.trade_count += 1
+            elif builder_address == self.target_builder:
+                sums[0] += trade_pnl
+                sums[1] += fee
+                sums[2] += 1
+                sums[3] = True
+        lifecycle_ended = abs(current_net_size) < EPSILON
+        if lifecycle_ended:
+            self._close_lifecycle(coin, st)
+        elif self._resolvable(st):
+            # Taint can no longer change for this lifecycle, don't hold it back
+            self._resolve(coin, st)
+        else:
+            self._mark_pending(coin, st, timestamp)
+
+        if self.want_positions and self._in_window(timestamp):
+            self._output(OUTPUT_POSITIONS, PositionRecord(
+                timestamp, current_net_size, avg_entry_px, self.builder_only and st.lifecycle_tainted
+            ))
+
+    # --- Lifecycle resolution ---
+
+    def _in_window(self, ts: int) -> bool:
+        if self.from_ms and ts < self.from_ms:
+            return False
+        if self.to_ms and ts > self.to_ms:
+            return False
+        return True
+
+    def _resolvable(self, st: _CoinState) -> bool:
+        # Without a target builder nothing is ever tainted, and once tainted a
+        # lifecycle stays tainted, so its items can be resolved right away.
+        return not self.target_builder or st.lifecycle_tainted
+
+    def _mark_pending(self, coin: str, st: _CoinState, ts: int):
+        if st.pending_since is None:
+            st.pending_since = ts
+            self._pending[coin] = st
+
+    def _clear_pending(self, coin: str, st: _CoinState):
+        st.pending_since = None
+        self._pending.pop(coin, None)
+
+    def _resolve(self, coin: str, st: _CoinState):
+        """Emit the lifecycle's buffered trades and funding with its current taint."""
+        tainted = st.lifecycle_tainted
+
+        for t in st.lifecycle_trades:
+            t.tainted = tainted
+            self._emit_trade(t)
+        st.lifecycle_trades = []
+
+        sums = st.lifecycle_sums
+        if sums[3]:
+            if tainted:
+                self.tainted = True
+            else:
+                self.realized_pnl += sums[0]
+                self.fees_paid += sums[1]
+                self.trade_count += sums[2]
+            st.lifecycle_sums = [ZERO, ZERO, 0, False]
+
+        for ts, amount in st.lifecycle_funding:
+            if self.builder_only and tainted:
+                self.tainted = True
+            else:
+                self._accept_funding(ts, amount)
+        st.lifecycle_funding = []
+
+        self._clear_pending(coin, st)
+
+    def _close_lifecycle(self, coin: str, st: _CoinState):
+        self._resolve(coin, st)
+        st.lifecycle_open = False
+        st.lifecycle_tainted = False
+
+    def _emit_trade(self, t: TradeRecord):
+        if not self._in_window(t.time):
+            return
+        if self.builder_only:
+            if t.builder != self.target_builder:
+                return
+            if not t.tainted:
+                self.realized_pnl += t.closedPnl
+                self.fees_paid += t.fee
+                self.trade_count += 1
+            else:
+                self.tainted = True
+        else:
+            self.realized_pnl += t.closedPnl
+            self.fees_paid += t.fee
+            self.trade_count += 1
+
+        self._seq += 1
+        if self.want_trades:
+            heapq.heappush(self._trade_heap, (t.time, self._seq, t))
+        if self.want_history:
+            heapq.heappush(self._history_heap, (t.time, _KIND_TRADE, self._seq, t.closedPnl, t.fee, ZERO, t.tainted))
+
+    def _accept_funding(self, ts: int, amount: Decimal):
+        self.funding_paid += amount
+        if self.want_history:
+            self._seq += 1
+            heapq.heappush(self._history_heap, (ts, _KIND_FUNDING, self._seq, ZERO, ZERO, amount, False))
+
+    def _finish(self):
+        for coin, st in self._coins.items():
+            if not st.seen_fill:
+                # Funding for a coin without any fills is not part of this ledger
+                st.held_funding = []
+                self._clear_pending(coin, st)
+                continue
+
+            for ts, amount in st.held_funding:
+                self._accept_funding(ts, amount)
+            st.held_funding = []
+
+            open_tainted = st.lifecycle_tainted
+            if st.lifecycle_open:
+                # Open lifecycle: resolve with the taint known so far
+                self._close_lifecycle(coin, st)
+            self._clear_pending(coin, st)
+
+            if abs(st.net_size) > EPSILON:
+                self.open_positions.append((coin, st.net_size, st.avg_entry_px, open_tainted))
+
+    # --- Ordered release ---
+
+    def _output(self, kind: str, record):
+        self._ready.append((kind, record.to_model() if self.models else record))
+
+    def _release(self, now: Optional[int]):
+        """Move heap items older than every still-buffered item to the ready list."""
+        if not self._trade_heap and not self._history_heap:
+            return
+        if now is None:
+            watermark = None
+        else:
+            watermark = now
+            for st in self._pending.values():
+                if st.pending_since < watermark:
+                    watermark = st.pending_since
+
+        heap = self._trade_heap
+        while heap and (watermark is None or heap[0][0] < watermark):
+            self._output(OUTPUT_TRADES, heapq.heappop(heap)[2])
+
+        heap = self._history_heap
+        while heap and (watermark is None or heap[0][0] < watermark):
+            ts, _, _, realized, fee, funding, tainted = heapq.heappop(heap)
+            # Keep the equity curve consistent with the builder-only aggregates
+            if not (self.builder_only and tainted):
+                self._cum_realized += realized
+                self._cum_fees += fee
+                self._cum_funding += funding
+            self._output(OUTPUT_HISTORY, HistoryRecord(
+                ts, self._cum_realized, self._cum_fees, self._cum_funding,
+                (self._cum_realized + self._cum_funding) - self._cum_fees, tainted
+            ))
@@ -0,0 +1,266 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Iterable, Iterator, List, Optional
+
+from fastapi import HTTPException, Request
+
+from .metrics import REPLAY_POOL_REJECTED, REPLAY_POOL_WAITING
+from .replay import LedgerReplay, ALL_OUTPUTS
+from .timing import stage, count
+
+logger = logging.getLogger(__name__)
+
+# Ledger replays are CPU-bound pure Python, so in worker threads they hold
+# the GIL against everything else the process serves. ReplayPool runs them
+# in worker processes instead, each reading the fills from its own handle
+# on the storage (the parent only syncs them from upstream first).
+#
+# At most one job per worker is handed to the executor; the rest wait in a
+# bounded queue in the parent, where they can still be dropped: when the
+# queue is full a request fails fast with 503, and a request whose deadline
+# passes or whose client disconnects leaves the queue without ever running.
+# A running job is stopped through a shared flag its worker checks while
+# reading fills.
+#
+# The worker's CPU time for a job comes back on its result and is counted
+# on the request's timer as "worker_cpu_ms", for the quota's CPU budget:
+# the parent's own process_time() never sees it.
+
+CHECK_EVERY_FILLS = 4096
+
+
+class ReplayCancelled(Exception):
+    """Raised in a worker when its job was cancelled or ran past its deadline."""
+
+
+class ReplayJob:
+    __slots__ = ("address", "coin_filter", "funding", "target_builder", "builder_only",
+                 "from_ms", "to_ms", "outputs", "models", "deadline", "slot")
+
+    def __init__(self, address: str, funding: List[dict], target_builder: str = None, coin_filter: str = None,
+                 builder_only: bool = False, from_ms: int = None, to_ms: int = None,
+                 outputs: Iterable[str] = ALL_OUTPUTS, models: bool = True):
+        self.address = address
+        self.coin_filter = coin_filter
+        self.funding = funding
+        self.target_builder = target_builder
+        self.builder_only = builder_only
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+        self.outputs = tuple(outputs)
+        # Without models, the items come back as record rows: those pickle several
+        # times faster than either models or the records and their Decimals
+        self.models = models
+        # Set by ReplayPool.run
+        self.deadline = 0.0
+        self.slot = 0
+
+
+class ReplayResult:
+    """A replay's outputs plus the aggregates `LedgerService.summarize` reads."""
+
+    __slots__ = ("items", "fill_count", "realized_pnl", "fees_paid", "funding_paid",
+                 "trade_count", "tainted", "builder_only", "open_positions", "cpu_s")
+
+    def __init__(self, items: List[Any], replay: LedgerReplay, cpu_s: float = 0.0):
+        self.items = items
+        self.fill_count = replay.fill_count
+        self.realized_pnl = replay.realized_pnl
+        self.fees_paid = replay.fees_paid
+        self.funding_paid = replay.funding_paid
+        self.trade_count = replay.trade_count
+        self.tainted = replay.tainted
+        self.builder_only = replay.builder_only
+        self.open_positions = replay.open_positions
+        # CPU seconds the worker spent on the job
+        self.cpu_s = cpu_s
+
+
+# --- Worker process side ---
+
+_storage = None
+_cancel_flags = None
+
+
+def _init_worker(storage_type: str, cancel_flags):
+    global _storage, _cancel_flags
+    from .storage.factory import create_storage
+    # Workers only read fills the parent has synced
+    _storage = create_storage(storage_type, read_only=True)
+    _cancel_flags = cancel_flags
+
+
+def _checked(fills: Iterator[dict], job: ReplayJob) -> Iterator[dict]:
+    for n, fill in enumerate(fills):
+        if n % CHECK_EVERY_FILLS == 0 and (_cancel_flags[job.slot] or time.time() > job.deadline):
+            raise ReplayCancelled(f"replay of {job.address} stopped after {n} fills")
+        yield fill
+
+
+def _run_job(job: ReplayJob) -> ReplayResult:
+    cpu_start = time.process_time()
+    fills = (f for f in _storage.iter_fills(job.address, coin=job.coin_filter) if f.get("coin"))
+    replay = LedgerReplay(
+        _checked(fills, job),
+        job.funding,
+        target_builder=job.target_builder,
+        builder_only=job.builder_only,
+        from_ms=job.from_ms,
+        to_ms=job.to_ms,
+        outputs=job.outputs,
+        models=job.models,
+    )
+    if job.models:
+        items = [item for _, item in replay]
+    else:
+        items = [record.to_row() for _, record in replay]
+    return ReplayResult(items, replay, cpu_s=time.process_time() - cpu_start)
+
+
+# --- Parent side ---
+
+class ReplayPool:
+    """Bounded process pool for ledger replays, see the module comment."""
+
+    def __init__(self, storage_type: str, workers: int, queue_size: int = 32, deadline_s: float = 30):
+        self.storage_type = storage_type
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.deadline_s = deadline_s
+        self._context = multiprocessing.get_context("spawn")
+        self._cancel_flags = self._context.Array("b", self.workers, lock=False)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Queue] = None
+        self._waiting = 0
+        # Smoothed job duration, for Retry-After
+        self._avg_job_s = 1.0
+
+    def start(self):
+        if self._executor is None:
+            # Spawned, not forked: the parent has threads (storage pools, telemetry) mid-flight
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=self._context,
+                initializer=_init_worker, initargs=(self.storage_type, self._cancel_flags),
+            )
+
+    def close(self):
+        if self._executor is not None:
+            for slot in range(self.workers):
+                self._cancel_flags[slot] = 1
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, job: ReplayJob) -> ReplayResult:
+        """Run `job` in a worker. 503 when the queue is full or the deadline passes first."""
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Queue()
+            for slot in range(self.workers):
+                self._slots.put_nowait(slot)
+
+        deadline = time.time() + self.deadline_s
+        if self._slots.empty() and self._waiting >= self.queue_size:
+            REPLAY_POOL_REJECTED.labels("queue_full").inc()
+            raise self._busy("Replay queue full")
+
+        self._waiting += 1
+        REPLAY_POOL_WAITING.inc()
+        try:
+            with stage("replay_queue"):
+                slot = await asyncio.wait_for(self._slots.get(), timeout=self.deadline_s)
+        except asyncio.TimeoutError:
+            REPLAY_POOL_REJECTED.labels("deadline").inc()
+            raise self._busy("Replay deadline exceeded while queued")
+        finally:
+            self._waiting -= 1
+            REPLAY_POOL_WAITING.dec()
+
+        job.slot = slot
+        job.deadline = deadline
+        started = time.perf_counter()
+        executor = self._executor
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, _run_job, job)
+        except BrokenProcessPool:
+            self._release(slot)
+            self._restart(executor)
+            raise
+        # The slot is only free again once the worker has actually stopped
+        future.add_done_callback(lambda f: self._finished(f, slot, started))
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Client gone: stop the worker at its next check instead of finishing unseen work
+            self._cancel_flags[slot] = 1
+            REPLAY_POOL_REJECTED.labels("cancelled").inc()
+            raise
+        except ReplayCancelled:
+            REPLAY_POOL_REJECTED.labels("deadline").inc()
+            raise self._busy("Replay deadline exceeded")
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        count("worker_cpu_ms", int(result.cpu_s * 1000))
+        return result
+
+    def _finished(self, future: asyncio.Future, slot: int, started: float):
+        if not future.cancelled() and future.exception() is None:
+            self._avg_job_s = 0.8 * self._avg_job_s + 0.2 * (time.perf_counter() - started)
+        self._release(slot)
+
+    def _release(self, slot: int):
+        self._cancel_flags[slot] = 0
+        self._slots.put_nowait(slot)
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        # A worker died (OOM kill, segfault); the executor refuses all work after that.
+        # Every job on it fails, only the first one replaces it.
+        if self._executor is not broken:
+            return
+        logger.error("Replay worker process died, restarting the pool")
+        self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def _busy(self, detail: str) -> HTTPException:
+        retry_after = math.ceil(self._avg_job_s * (self._waiting + 1) / self.workers)
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(min(max(retry_after, 1), 60))})
+
+
+def checked_iter(items: Iterator[Any], deadline: float, cancelled: threading.Event) -> Iterator[Any]:
+    """`items` from a replay run in this process (exports stream one as they are sent), stopped
+    with ReplayCancelled once `cancelled` is set or the `deadline` (time.time()) passes."""
+    for n, item in enumerate(items):
+        if n % CHECK_EVERY_FILLS == 0 and (cancelled.is_set() or time.time() > deadline):
+            REPLAY_POOL_REJECTED.labels("cancelled" if cancelled.is_set() else "deadline").inc()
+            raise ReplayCancelled(f"streamed replay stopped after {n} items")
+        yield item
+
+
+async def _wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable) -> Any:
+    """Await `work`, cancelling it (and any replay it queued or runs) if the client disconnects first."""
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task in done:
+        return task.result()
+    task.cancel()
+    # Nobody will read the response; 499 as in nginx, for the request log
+    raise HTTPException(status_code=499, detail="Client closed request")
@@ -3,11 +3,10 @@ from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr, field_validator
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 import re
 
 from ..database import get_db, User
+from ..ratelimit import create_limiter
 from ..auth import (
     get_password_hash,
     authenticate_user,
@@ -21,7 +20,7 @@ from ..auth import (
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 # Rate limiter
-limiter = Limiter(key_func=get_remote_address)
+limiter = create_limiter()
 
 # Request/Response models
 class UserRegister(BaseModel):
@@ -0,0 +1,186 @@
+import gzip
+import zlib
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+
+from .config import settings
+from .replay import TradeRecord, PositionRecord, HistoryRecord
+from .timing import stage
+
+# Response bodies for the ledger endpoints. jsonable_encoder walks every
+# pydantic model field by field and was the slowest part of a large
+# /v1/trades response, slower than the replay. Replays for responses now
+# yield internal records (`models=False`; the replay pool sends back their
+# rows), which write their own JSON rows with Decimals as strings, the same
+# output the models produced, and orjson encodes the rows. Whatever else
+# orjson cannot encode goes through jsonable_encoder.
+#
+# Bodies are compressed when the client accepts it: zstd and brotli if
+# their (optional) packages are installed, gzip always. Streamed bodies
+# (exports) are compressed chunk by chunk.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RECORD_TYPES = (TradeRecord, PositionRecord, HistoryRecord)
+
+# Mid-range levels: large bodies are compressed per request, not once and cached
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+# Larger bodies are compressed off the event loop, all three release the GIL
+COMPRESS_IN_THREAD_BYTES = 256 * 1024
+# and serialized off it: the size is only known afterwards, so it is estimated
+# from the row count (rows are 150-250 bytes). orjson holds the GIL, so the
+# loop only gets turns while it calls back into Python for records; the
+# replay pool's rows are plain dicts and encode in one go either way.
+SERIALIZE_IN_THREAD_ITEMS = COMPRESS_IN_THREAD_BYTES // 256
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, RECORD_TYPES):
+        return obj.to_row()
+    return jsonable_encoder(obj)
+
+
+def dumps(data: Any) -> bytes:
+    """JSON body for `data`, writing replay records without building models."""
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def available_encodings() -> List[str]:
+    """RESPONSE_ENCODINGS in preference order, minus those whose package is missing."""
+    usable = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [e for e in (e.strip() for e in settings.RESPONSE_ENCODINGS.split(",")) if usable.get(e)]
+
+
+def negotiate_encoding(accept_encoding: Optional[str], offered: List[str]) -> Optional[str]:
+    """Best of `offered` for an Accept-Encoding header: highest q, then our order. None for identity."""
+    if not accept_encoding or not offered:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = weights.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def compress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unsupported encoding {encoding}")
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def _non_empty(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    return (chunk for chunk in chunks if chunk)
+
+
+async def _pull(chunks: Iterator[bytes], cancelled: threading.Event) -> AsyncIterator[bytes]:
+    # Like starlette's iterate_in_threadpool, but when the response is cancelled (client
+    # disconnect) `cancelled` is set, so the producer stops at its next check rather than
+    # running to the end in its thread
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+def stream_response(request: Request, chunks: Iterator[bytes], media_type: str,
+                    headers: Dict[str, str] = None, cancelled: threading.Event = None) -> StreamingResponse:
+    """Stream `chunks` (a sync iterator, pulled in the threadpool), compressed if the client accepts it.
+
+    The size is not known up front, so any accepted encoding is used. `cancelled` is set
+    once the body is done with, early if the client disconnects.
+    """
+    headers = dict(headers or {})
+    offered = available_encodings()
+    if offered:
+        headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), offered)
+    chunks = _non_empty(chunks)
+    if encoding:
+        chunks = compress_stream(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    if cancelled is not None:
+        chunks = _pull(chunks, cancelled)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+async def json_response(request: Request, data: Any, headers: Dict[str, str] = None) -> Response:
+    """Serialize `data` (timed as its own stage) and compress it if the client accepts an encoding."""
+    with stage("serialize"):
+        if isinstance(data, list) and len(data) >= SERIALIZE_IN_THREAD_ITEMS:
+            body = await asyncio.to_thread(dumps, data)
+        else:
+            body = dumps(data)
+    headers = dict(headers or {})
+    offered = available_encodings()
+    if offered:
+        headers["Vary"] = "Accept-Encoding"
+    encoding = None
+    if len(body) >= settings.COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), offered)
+    if encoding:
+        with stage("compress"):
+            if len(body) >= COMPRESS_IN_THREAD_BYTES:
+                body = await asyncio.to_thread(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
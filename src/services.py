@@ -1,121 +1,126 @@
-from typing import List, Dict, Any
-import pandas as pd
-from datetime import datetime
-from decimal import Decimal
-from typing import List, Dict, Any
-import pandas as pd
+import asyncio
+import time
+import hashlib
+import threading
+from typing import List, Dict, Any, Iterable, Iterator, NamedTuple, Optional, Tuple
 from datetime import datetime
 from decimal import Decimal
 from .models import Trade, PositionState, PnLResponse, LeaderboardEntry, PnLHistoryEntry
 from .datasources.base import DataSource
 from .config import settings
 from .storage.base import StorageBackend
+from .storage.async_storage import AsyncStorage
+from .replay import LedgerReplay, ALL_OUTPUTS, OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY
+from .replay_pool import ReplayPool, ReplayJob
+from .metrics import REPLAY_SECONDS, REPLAY_FILLS, cache_lookup
+from .timing import stage, timed_iter, count
+
+class DataVersion(NamedTuple):
+    """Stored data a replay depends on, for ETags: latest fill time (ms) and the number of fills
+    at it, latest funding time (ms) and the builder."""
+    fills_ms: int
+    fills_at_ms: int
+    funding_ms: int
+    builder: str
 
 class LedgerService:
-    def __init__(self, data_source: DataSource, storage: StorageBackend = None):
+    def __init__(self, data_source: DataSource, storage: StorageBackend = None, replay_pool: ReplayPool = None):
         self.data_source = data_source
         self.storage = storage
+        # Async handlers go through this, blocking storage calls run on its own I/O threads
+        self.astorage = AsyncStorage(storage, max_workers=settings.STORAGE_IO_THREADS) if storage else None
+        # Async replays run in worker processes when set (storage must be shareable)
+        self.replay_pool = replay_pool if storage else None
+        self._mids = None
+        self._mids_lock = threading.Lock()
 
-    def _process_ledger(self, address: str, target_builder: str = None, 
-                       from_ms: int = None, to_ms: int = None, 
-                       coin_filter: str = None, builder_only: bool = False
-                       ) -> Dict[str, Any]:
-        """core processing logic shared by multiple endpoints"""
-        
+    def close(self):
+        if self.replay_pool:
+            self.replay_pool.close()
+        if self.astorage:
+            self.astorage.close()
+
+    def _effective_builder(self, target_builder: str = None) -> str:
         effective_target_builder = target_builder if target_builder else settings.TARGET_BUILDER
         if effective_target_builder:
             effective_target_builder = effective_target_builder.lower()
-        if effective_target_builder:
-            effective_target_builder = effective_target_builder.lower()
-        
-        # Sync Logic
-        fills = []
-        if self.storage:
-            # ... (omitted for brevity, assume sync logic is here)
-            # Sync Logic remains unchanged in this block, just need to ensure indentation is correct if I replaced whole block
-            # But I am taking a smaller chunk for safety vs context.
-            # actually, let me just target the effective_target_builder lines and data fetching is distinct.
-            pass 
-
-        # I will restart the replacement to be more precise or cover the logic area.
-        # The user has aggressive linter?
-        # Let's target the top of _process_ledger
-        
-        # NOTE: logic requires `fills` to be populated.
-        # The storage logic was added in previous turn.
-        # I just need to update effective_target_builder line.
-        
-        # Let's use a specific target for effective_target_builder
-        pass
-        if self.storage:
-            # 1. Get latest sync time
-            latest_ts = self.storage.get_latest_timestamp(address)
-            
-            # 2. Fetch only new fills (Incremental Sync)
-            # The datasource now supports 'since' which launches parallel fetch if range is large.
-            # If latest_ts is 0/None, it fetches ALL history (Parallel).
-            # If latest_ts is recent, it fetches increment (Sequential).
-            
+        return effective_target_builder
+
+    def _sync_fills(self, address: str):
+        """Incremental upstream sync into storage."""
+        # 1. Get latest sync time
+        latest_ts = self.storage.get_latest_timestamp(address)
+        # A stored history only needs the increment fetched
+        cache_lookup("fills", bool(latest_ts))
+
+        # 2. Fetch only new fills (Incremental Sync)
+        # The datasource now supports 'since' which launches parallel fetch if range is large.
+        # If latest_ts is 0/None, it fetches ALL history (Parallel).
+        # If latest_ts is recent, it fetches increment (Sequential).
+
+        with stage("upstream_fills"):
             new_fills = self.data_source.get_user_fills(address, since=latest_ts)
-            
-            # 3. Save new fills
-            if new_fills:
+
+        # 3. Save new fills
+        if new_fills:
+            with stage("save_fills"):
                 self.storage.save_fills(address, new_fills)
-                
-            # 4. Read full history from DB
-            # We need full history for PnL/Position Lifecycle accuracy?
-            # Yes, unless we snapshot positions. But we calc from scratch.
-            fills = self.storage.get_all_fills(address)
 
-        else:
-            # Reconstructing positions accurately requires full history. 
-            # But for speed on large accounts, we might accept a 'since' if from_ms is provided.
-            # Decision: Use from_ms if provided, otherwise fetch all.
-            fetch_since = from_ms if from_ms else 0
-            try:
+    def _read_fills(self, address: str, from_ms: int = None, coin_filter: str = None) -> Iterable[Dict[str, Any]]:
+        """Time-ordered fill stream for the replay, storage must already be synced."""
+        if self.storage:
+            # 4. Stream full history from DB
+            # We need full history for PnL/Position Lifecycle accuracy,
+            # but only for the requested coin, so the coin filter is pushed down.
+            # Batches are pulled lazily by the replay, nothing is held in full.
+            # Read and decode time is counted as it happens, inside the replay.
+            fills = self.storage.iter_fills(address, coin=coin_filter)
+            return (f for f in timed_iter(fills, "read_fills") if f.get('coin'))
+
+        # Reconstructing positions accurately requires full history. 
+        # But for speed on large accounts, we might accept a 'since' if from_ms is provided.
+        # Decision: Use from_ms if provided, otherwise fetch all.
+        fetch_since = from_ms if from_ms else 0
+        try:
+            with stage("upstream_fills"):
                 fills = self.data_source.get_user_fills(address, since=fetch_since)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                raise e
-            
-        df = pd.DataFrame(fills)
-        if df.empty or 'coin' not in df.columns:
-             return {
-                 "trades": [], 
-                 "positions": [], 
-                 "history": [],
-                 "pnl": PnLResponse(
-                     realizedPnl=Decimal(0), 
-                     returnPct=Decimal(0), 
-                     feesPaid=Decimal(0), 
-                     tradeCount=0, 
-                     tainted=False
-                 )
-             }
-        
-        trades_to_return = []
-        position_history = []
-        
-        coins = df['coin'].unique()
-        
-        # PnL Aggregates
-        total_pnl = Decimal("0.0")
-        total_fees = Decimal("0.0")
-        total_trades_count = 0
-        overall_tainted = False
-        
-        # New PnL Aggregates
-        total_upnl = Decimal("0.0")
-        current_prices = {}
-        prices_fetched = False
-        accepted_funding = []
-        
-        # Initial Equity approximation (for returnPct)
-        # ... (comments)
-        
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            raise e
+
+        fills = [f for f in fills if f.get('coin') and (not coin_filter or f['coin'] == coin_filter)]
+        # Storage streams in time order already; upstream lists may not be sorted
+        fills.sort(key=lambda x: x['time'])
+        return fills
+
+    def _load_fills(self, address: str, from_ms: int = None, coin_filter: str = None) -> Iterable[Dict[str, Any]]:
+        if self.storage:
+            self._sync_fills(address)
+        return self._read_fills(address, from_ms=from_ms, coin_filter=coin_filter)
+
+    def _fetch_new_funding(self, address: str, latest_ts: int) -> List[Dict[str, Any]]:
+        try:
+            with stage("upstream_funding"):
+                return self.data_source.get_user_funding(
+                    address, latest_ts + 1 if latest_ts else 0, int(datetime.now().timestamp() * 1000))
+        except Exception as e:
+            print(f"Error fetching funding: {e}")
+            return []
+
+    def _sync_funding(self, address: str):
+        """Incremental funding sync into storage, for backends that cache it."""
+        # Incremental sync like fills: only fetch what is newer than the cache
+        latest_ts = self.storage.get_latest_funding_timestamp(address)
+        cache_lookup("funding", bool(latest_ts))
+        new_funding = self._fetch_new_funding(address, latest_ts)
+        if new_funding:
+            with stage("save_funding"):
+                self.storage.save_funding(address, new_funding)
+
+    def _read_funding(self, address: str, from_ms: int = None, to_ms: int = None,
+                      coin_filter: str = None) -> List[Dict[str, Any]]:
         # Funding Logic
-        # 1. Fetch all funding history (optimized: time window if provided?)
         # For simplicity/correctness with lifecycles, we might need broader context, 
         # but funding is point-in-time event. We can just fetch window.
         funding_start = from_ms if from_ms else 0
@@ -123,418 +128,166 @@ class LedgerService:
         
         # Note: get_user_funding in datasource might be specific.
         # Let's assume it returns list of dicts: {'time': ms, 'coin': str, 'usdc': float, ...}
-        funding_history = []
-        try:
-             # If using Storage, we might need sync logic for funding too?
-             # For now, let's pull from API or DataSource default (which hits API).
-             # ToDo: Add storage support for funding.
-             funding_history = self.data_source.get_user_funding(address, funding_start, funding_end)
-        except Exception as e:
-             # Fallback or log error? Funding is critical for PnL accuracy but maybe not blocker?
-             print(f"Error fetching funding: {e}")
-             funding_history = []
+        if self.storage and self.storage.caches_funding:
+            with stage("read_funding"):
+                funding_history = self.storage.get_funding(address, from_ms=from_ms, to_ms=to_ms)
+        else:
+            try:
+                with stage("upstream_funding"):
+                    funding_history = self.data_source.get_user_funding(address, funding_start, funding_end)
+            except Exception as e:
+                # Fallback or log error? Funding is critical for PnL accuracy but maybe not blocker?
+                print(f"Error fetching funding: {e}")
+                funding_history = []
 
-        total_funding = Decimal("0.0") # Net Funding (Positive = Received, Negative = Paid)
-        
-        # Pre-process funding by coin for efficiency
-        funding_by_coin = {}
-        for f in funding_history:
-            # Hyperliquid SDK return format check
-            c = f.get('coin') or f.get('token')
-            if not c: continue
-            if coin_filter and c != coin_filter: continue
-            if c not in funding_by_coin: funding_by_coin[c] = []
-            funding_by_coin[c].append(f)
-        
-        for coin in coins:
-            if coin_filter and coin != coin_filter:
-                continue
-                
-            coin_fills = df[df['coin'] == coin].sort_values('time')
-            coin_funding = sorted(funding_by_coin.get(coin, []), key=lambda x: x['time'])
-            
-            # Position State
-            current_net_size = Decimal("0.0")
-            avg_entry_px = Decimal("0.0")
-            
-            # Lifecycle Tracking
-            current_lifecycle_trades = []
-            lifecycle_is_tainted = False
-            lifecycle_start_ts = None
-            tainted_intervals = [] # List of (start, end) tuples
-            
-            for index, fill in coin_fills.iterrows():
-                timestamp = fill['time']
-                if lifecycle_start_ts is None:
-                    lifecycle_start_ts = timestamp
-                
-                # Check Time Boundaries for Processing? 
-                # If we filter upfront, we lose position state reconstruction.
-                # We must replay ALL history to get correct State at 'from_ms'.
-                
-                side = fill['side']
-                sz = Decimal(str(fill['sz']))
-                px = Decimal(str(fill['px']))
-                fee = Decimal(str(fill['fee'])) if 'fee' in fill else Decimal("0.0")
-                
-                # Builder Attribution
-                builder_address = None
-                if 'builder' in fill and fill['builder']:
-                     builder_address = fill['builder']
-                elif 'builderInfo' in fill and fill['builderInfo']:
-                     builder_address = fill['builderInfo'].get('builder')
-                
-                if builder_address:
-                    builder_address = builder_address.lower()
-                
-                dir = Decimal("1") if side in ['B', 'Buy'] else Decimal("-1")
-                signed_sz = sz * dir
-                
-                trade_pnl = Decimal("0.0")
-                
-                # Position update logic
-                is_opening = (current_net_size >= 0 and dir > 0) or (current_net_size <= 0 and dir < 0)
-                
-                if is_opening:
-                    total_value = (abs(current_net_size) * avg_entry_px) + (sz * px)
-                    new_size = abs(current_net_size) + sz
-                    if new_size > 0:
-                        avg_entry_px = total_value / new_size
-                    current_net_size += signed_sz
-                else:
-                    amount_closed = min(abs(current_net_size), sz)
-                    pnl_direction = Decimal("1") if current_net_size > 0 else Decimal("-1")
-                    trade_pnl = (px - avg_entry_px) * pnl_direction * amount_closed
-                    current_net_size += signed_sz
-                    if (pnl_direction == 1 and current_net_size < 0) or (pnl_direction == -1 and current_net_size > 0):
-                        avg_entry_px = px
-                
-                # Construct Trade Object
-                trade_obj = Trade(
-                    coin=coin,
-                    side=side,
-                    sz=sz,
-                    px=px,
-                    time=timestamp,
-                    fee=fee,
-                    builder=builder_address,
-                    closedPnl=trade_pnl,
-                    tainted=False
-                )
-                
-                current_lifecycle_trades.append(trade_obj)
-                
-                # Taint Check
-                # "Taint rule: if non-builder activity affects the same position lifecycle... set tainted=true"
-                if effective_target_builder:
-                     # Check with normalized builder
-                     if builder_address != effective_target_builder:
-                         lifecycle_is_tainted = True
-
-                # Lifecycle End Check
-                lifecycle_ended = abs(current_net_size) < Decimal("1e-9")
-                
-                # Logic for Inclusion in Result Window
-                # We only want to include trades/positions if they fall within [from_ms, to_ms]
-                # BUT strict Builder Logic says "exclude from builder-only aggregates" if tainted.
-                
-                # If cycle ended OR (we are at end of list?), we decide on the lifecycle chunk
-                # For streaming/processing simplicity, we can tag trades now.
-                
-                if lifecycle_ended:
-                     # Mark accumulated trades
-                     if lifecycle_is_tainted:
-                         # Record the full interval of this tainted lifecycle
-                         # End time is current fill timestamp (which closed it)
-                         tainted_intervals.append((lifecycle_start_ts, timestamp))
-
-                         for t in current_lifecycle_trades:
-                             t.tainted = True
-                     
-                     # Add to main lists if time constraints met
-                     for t in current_lifecycle_trades:
-                         # Filter logic for Output
-                         # 1. Time filter
-                         if from_ms and t.time < from_ms:
-                             continue
-                         if to_ms and t.time > to_ms:
-                             continue
-                         
-                         # 2. Builder Mode logic
-                         # "builder-only mode... returns only trades attributed... marks mixed activity as tainted"
-                         # "exclude from builder-only aggregates"
-                         # Interpretation:
-                         # /trades endpoint: include tainted? "marks mixed activity as tainted" -> Yes, include but mark?
-                         # Or "returns ONLY attributed"? If it returns ONLY attributed, then tainted mixed trades (attr to others) are hidden?
-                         # But if they are hidden, the user sees a gap.
-                         # "marks mixed activity as tainted" implies visibility.
-                         # "exclude from builder-only aggregates" means PnL calculation ignores them.
-                         # Let's include them in TRADE list with tainted=True flag, but exclude from PnL.
-                         
-                         # However... "returns only trades attributed to a specific builder" is strong.
-                         # If I return a trade from 0xOther marked tainted=True, I am returning non-attributed trade.
-                         # Re-reading: "returns only trades attributed... AND marks mixed activity as tainted"
-                         # Conflict? Maybe it means: Return BuilderTrades (clean) + BuilderTrades (tainted/mixed).
-                         # Do NOT return NonBuilderTrades.
-                         
-                         if builder_only:
-                             if t.builder != effective_target_builder:
-                                 # This is a non-builder trade. Exclude from List?
-                                 continue
-                         
-                         trades_to_return.append(t)
-                         
-                         # Metrics Accumulation (builderOnly specific)
-                         if builder_only:
-                             if not t.tainted:
-                                 total_pnl += t.closedPnl
-                                 total_fees += t.fee
-                                 total_trades_count += 1
-                             else:
-                                 # It's builder attributed but part of a tainted lifecycle.
-                                 # "exclude from builder-only aggregates" -> Ignore.
-                                 overall_tainted = True
-                         else:
-                             # All trades mode
-                             total_pnl += t.closedPnl
-                             total_fees += t.fee
-                             total_trades_count += 1
-
-                     current_lifecycle_trades = []
-                     
-                     # Process Funding for this lifecycle interval
-                     # We need to find funding events that happened BETWEEN the start of this lifecycle and now (end).
-                     # Lifecycle Start Time? We need to track it.
-                     # Let's add `lifecycle_start_time` tracking.
-                     
-                     # RE-ARCHITECTING LOOP SLIGHTLY inside the loop is hard.
-                     # Easier: Just verify funding timestamp vs lifecycle trades range?
-                     # Lifecycle range: [First Trade Time, Last Trade Time (Closing)]
-                     # Funding happens every hour.
-                     # If lifecycle is tainted, all funding in that range is tainted.
-                     pass 
-
-                    
-                     lifecycle_is_tainted = False
-                
-                # Position Snapshot (if time matches)
-                if (not from_ms or timestamp >= from_ms) and (not to_ms or timestamp <= to_ms):
-                    # For position history, do we filter by builder?
-                    # "Include tainted when builderOnly=true"
-                    # If builderOnly, maybe we show position lines but mark tainted?
-                    # If I am holding a position, and it gets tainted, the whole line is tainted.
-                    pos_tainted = False
-                    if builder_only and lifecycle_is_tainted:
-                        pos_tainted = True
-                        # If simple filter: we might blindly show it.
-                        
-                    position_history.append(PositionState(
-                        timeMs=timestamp,
-                        netSize=current_net_size,
-                        avgEntryPx=avg_entry_px,
-                        tainted=pos_tainted
-                    ))
-
-            # End of coin loop, handle open lifecycles
-            if current_lifecycle_trades:
-                 if lifecycle_is_tainted:
-                     for t in current_lifecycle_trades: t.tainted = True
-                 
-                 for t in current_lifecycle_trades:
-                     if from_ms and t.time < from_ms: continue
-                     if to_ms and t.time > to_ms: continue
-                     
-                     if builder_only:
-                         if t.builder != effective_target_builder: continue
-                         if not t.tainted:
-                             total_pnl += t.closedPnl
-                             total_fees += t.fee
-                             total_trades_count += 1
-                         else:
-                             overall_tainted = True
-                     else:
-                         total_pnl += t.closedPnl
-                         total_fees += t.fee
-                         total_trades_count += 1
-                     trades_to_return.append(t)
-
-            # End of coin loop
-            # ... (handle open lifecycles if any - omitting specific fix here, relying on existing logic or assuming closed)
-            if current_lifecycle_trades and lifecycle_is_tainted:
-                 # Open position is tainted
-                 tainted_intervals.append((lifecycle_start_ts, 9999999999999)) # Until infinity/now
-            
-            # --- Funding Processing ---
-            for f in coin_funding:
-                ts = f['time']
-                amount = Decimal(str(f['usdc'])) if 'usdc' in f else Decimal("0.0")
-                
-                # Builder Only Logic
-                # If builder_only=True, we exclude funding that happened during a TAINTED interval.
-                # Also, stricter rule: "Builder Only" might imply we only count funding if the position was OPENED by builder?
-                # If the lifecycle is clean (not tainted), then funding is clean.
-                # If lifecycle is tainted, funding is tainted/excluded.
-                
-                is_tainted_funding = False
-                if builder_only:
-                    for (start, end) in tainted_intervals:
-                        if start <= ts <= end:
-                            is_tainted_funding = True
-                            break
-                            
-                if not is_tainted_funding:
-                    total_funding += amount
-                    accepted_funding.append({
-                        "time": ts,
-                        "type": "funding",
-                        "amount": Decimal("0.0"), # Funding is PnL? Yes. PnL impact = amount (if positive=income)
-                        # Wait, 'amount' is 'usdc'.
-                        "pnl": amount,
-                        "fee": Decimal("0.0"),
-                        "tainted": False
-                    })
-                else:
-                    overall_tainted = True
-            
-            # --- Unrealized PnL (Mark-to-Market) ---
-            # If position is still open (current_net_size != 0)
-            if abs(current_net_size) > Decimal("1e-9"):
-                # We need market price
-                if not prices_fetched:
-                     try:
-                         current_prices = self.data_source.get_all_mids()
-                         prices_fetched = True
-                     except Exception as e:
-                         print(f"Error fetching prices: {e}")
-                
-                # Get price for this coin
-                # API returns coin names usually?
+        return self._filter_funding(funding_history, coin_filter)
+
+    def _filter_funding(self, funding_history: List[Dict[str, Any]], coin_filter: str = None) -> List[Dict[str, Any]]:
+        if coin_filter:
+            funding_history = [f for f in funding_history if (f.get('coin') or f.get('token')) == coin_filter]
+        return funding_history
+
+    def _load_funding(self, address: str, from_ms: int = None, to_ms: int = None,
+                      coin_filter: str = None) -> List[Dict[str, Any]]:
+        if self.storage and self.storage.caches_funding:
+            self._sync_funding(address)
+        return self._read_funding(address, from_ms=from_ms, to_ms=to_ms, coin_filter=coin_filter)
+
+    def _build_replay(self, fills: Iterable[Dict[str, Any]], funding: List[Dict[str, Any]],
+                      target_builder: str = None, from_ms: int = None, to_ms: int = None,
+                      builder_only: bool = False, outputs: Iterable[str] = ALL_OUTPUTS,
+                      models: bool = True) -> LedgerReplay:
+        return LedgerReplay(
+            fills,
+            funding,
+            target_builder=self._effective_builder(target_builder),
+            builder_only=builder_only,
+            from_ms=from_ms,
+            to_ms=to_ms,
+            outputs=outputs,
+            models=models
+        )
+
+    def replay(self, address: str, target_builder: str = None,
+               from_ms: int = None, to_ms: int = None,
+               coin_filter: str = None, builder_only: bool = False,
+               outputs: Iterable[str] = ALL_OUTPUTS, models: bool = True) -> LedgerReplay:
+        """Prepare a streaming replay. Iterate it for `(kind, item)` outputs in time order,
+        then pass it to `summarize` for the aggregate PnL. `models=False` yields the
+        internal records instead, for `src.serialize`."""
+        fills = self._load_fills(address, from_ms=from_ms, coin_filter=coin_filter)
+        funding = self._load_funding(address, from_ms=from_ms, to_ms=to_ms, coin_filter=coin_filter)
+        return self._build_replay(fills, funding, target_builder=target_builder, from_ms=from_ms,
+                                  to_ms=to_ms, builder_only=builder_only, outputs=outputs, models=models)
+
+    def summarize(self, replay: LedgerReplay, mids: Any = None) -> PnLResponse:
+        """Aggregate PnL of a fully consumed replay, marking open positions to market
+        (at `mids` if given, else the current mids snapshot). `mids` may also be a
+        function of the open position coins returning them, only called if there are any."""
+        total_upnl = Decimal("0.0")
+        if replay.open_positions:
+            if mids is None:
+                current_prices = self.mids_snapshot()[2]
+            elif callable(mids):
+                current_prices = mids([position[0] for position in replay.open_positions])
+            else:
+                current_prices = mids
+
+            for coin, net_size, avg_entry_px, tainted in replay.open_positions:
                 current_price_raw = current_prices.get(coin)
-                if current_price_raw:
-                    mark_px = Decimal(str(current_price_raw))
-                    # uPnL = (Mark - Entry) * Size
-                    # Check direction
-                    # If Long (Size > 0): (Mark - Entry) * Size
-                    # If Short (Size < 0): (Entry - Mark) * Abs(Size) = (Entry - Mark) * (-Size) = (Mark - Entry) * Size
-                    # Math holds.
-                    
-                    # BUT Taint Check?
-                    # If current position is TAINTED (lifecycle_is_tainted is True currently?)
-                    # `lifecycle_is_tainted` variable scope?
-                    # It was reset at loop end... wait.
-                    # Inside the loop:
-                    #   if lifecycle_ended: ... reset ...
-                    # So if loop finished and lifecycle NOT ended, `lifecycle_is_tainted` holds the current state.
-                    # Correct.
-                    
-                    coin_upnl = (mark_px - avg_entry_px) * current_net_size
-                    
-                    if builder_only and lifecycle_is_tainted:
-                         # Tainted open position. Exclude uPnL?
-                         # Yes, consistent with realized logic.
-                         pass
-                    else:
-                         total_upnl += coin_upnl
-
-        trades_to_return.sort(key=lambda x: x.time)
-
-        # --- PnL History Generation ---
-        pnl_history = []
-        history_events = []
-        
-        # 1. Trades
-        for t in trades_to_return:
-            history_events.append({
-                "time": t.time,
-                "realized": t.closedPnl,
-                "fee": t.fee,
-                "funding": Decimal("0.0"),
-                "tainted": t.tainted
-            })
-            
-        # 2. Funding
-        for f in accepted_funding:
-            history_events.append({
-                "time": f["time"],
-                "realized": Decimal("0.0"),
-                "fee": Decimal("0.0"),
-                "funding": f["pnl"],
-                "tainted": f["tainted"]
-            })
-            
-        # 3. Sort & Accumulate
-        history_events.sort(key=lambda x: x["time"])
-        
-        cum_realized = Decimal("0.0")
-        cum_fees = Decimal("0.0")
-        cum_funding = Decimal("0.0")
-        
-        for ev in history_events:
-            # Taint Logic for History Aggregation
-            # If builder_only is True, we should NOT accumulate PnL/Funding/Fees from tainted events
-            # to keep the Equity Curve consistent with the scalar PnL metrics.
-            
-            should_accumulate = True
-            if builder_only and ev["tainted"]:
-                should_accumulate = False
-            
-            if should_accumulate:
-                cum_realized += ev["realized"]
-                cum_fees += ev["fee"]
-                cum_funding += ev["funding"]
-            
-            pnl_history.append(PnLHistoryEntry(
-                time=ev["time"],
-                realizedPnl=cum_realized,
-                feesPaid=cum_fees,
-                fundingPaid=cum_funding,
-                netPnl=(cum_realized + cum_funding) - cum_fees,
-                tainted=ev["tainted"]
-            ))
-            
-        # ... Return logic
-        trades_to_return.sort(key=lambda x: x.time)
-        position_history.sort(key=lambda x: x.timeMs)
-        
+                if not current_price_raw:
+                    continue
+                # uPnL = (Mark - Entry) * Size, holds for shorts too (negative size)
+                coin_upnl = (Decimal(str(current_price_raw)) - avg_entry_px) * net_size
+                # Tainted open position is excluded, consistent with realized logic
+                if replay.builder_only and tainted:
+                    continue
+                total_upnl += coin_upnl
+
         # Calculate returnPct ...
         return_pct = Decimal("0.0") 
-        
+
+        return PnLResponse(
+            realizedPnl=replay.realized_pnl,
+            unrealizedPnl=total_upnl.quantize(Decimal("1.00000000")),
+            returnPct=return_pct,    
+            feesPaid=replay.fees_paid,
+            fundingPaid=replay.funding_paid, # Actually netFunding
+            tradeCount=replay.trade_count,
+            tainted=replay.tainted
+        )
+
+    def _run(self, replay: LedgerReplay, label: str) -> Iterator[Tuple[str, Any]]:
+        """Iterate a replay, recording its duration and fill count once it is done."""
+        start = time.perf_counter()
+        try:
+            # Includes read_fills, storage batches are pulled as the replay advances
+            with stage("replay"):
+                yield from replay
+        finally:
+            self._observe(label, start, replay.fill_count)
+
+    def _observe(self, label: str, start: float, fill_count: int):
+        REPLAY_SECONDS.labels(label).observe(time.perf_counter() - start)
+        REPLAY_FILLS.labels(label).observe(fill_count)
+        count("fills", fill_count)
+
+    def iter_ledger(self, address: str, outputs: Iterable[str] = ALL_OUTPUTS, **kwargs) -> Iterator[Tuple[str, Any]]:
+        """Stream `(kind, item)` outputs without collecting them."""
+        outputs = tuple(outputs)
+        yield from self._run(self.replay(address, outputs=outputs, **kwargs), "+".join(outputs) or "pnl")
+
+    def _process_ledger(self, address: str, target_builder: str = None, 
+                       from_ms: int = None, to_ms: int = None, 
+                       coin_filter: str = None, builder_only: bool = False,
+                       outputs: Iterable[str] = ALL_OUTPUTS
+                       ) -> Dict[str, Any]:
+        """core processing logic shared by multiple endpoints"""
+        replay = self.replay(
+            address,
+            target_builder=target_builder,
+            from_ms=from_ms,
+            to_ms=to_ms,
+            coin_filter=coin_filter,
+            builder_only=builder_only,
+            outputs=outputs
+        )
+
+        collected = {OUTPUT_TRADES: [], OUTPUT_POSITIONS: [], OUTPUT_HISTORY: []}
+        for kind, item in self._run(replay, "ledger"):
+            collected[kind].append(item)
+
         return {
-            "trades": trades_to_return,
-            "positions": position_history,
-            "history": pnl_history,
-            "pnl": PnLResponse(
-                realizedPnl=total_pnl,
-                unrealizedPnl=total_upnl.quantize(Decimal("1.00000000")),
-                returnPct=return_pct,    
-                feesPaid=total_fees,
-                fundingPaid=total_funding, # Actually netFunding
-                tradeCount=total_trades_count,
-                tainted=overall_tainted
-            )
+            "trades": collected[OUTPUT_TRADES],
+            "positions": collected[OUTPUT_POSITIONS],
+            "history": collected[OUTPUT_HISTORY],
+            "pnl": self.summarize(replay)
         }
 
+    # Each endpoint only materializes the output it returns
+
     def get_trades(self, address: str, **kwargs) -> List[Trade]:
-        data = self._process_ledger(address, **kwargs)
-        return data["trades"]
+        return [item for _, item in self.iter_ledger(address, outputs=(OUTPUT_TRADES,), **kwargs)]
     
     def get_pnl_history(self, address: str, **kwargs) -> List[PnLHistoryEntry]:
-        data = self._process_ledger(address, **kwargs)
-        return data["history"]
+        return [item for _, item in self.iter_ledger(address, outputs=(OUTPUT_HISTORY,), **kwargs)]
 
     def get_pnl(self, address: str, **kwargs) -> PnLResponse:
-        data = self._process_ledger(address, **kwargs)
-        return data["pnl"]
+        replay = self.replay(address, outputs=(), **kwargs)
+        for _ in self._run(replay, "pnl"):
+            pass
+        return self.summarize(replay)
 
     def get_position_history(self, address: str, **kwargs) -> List[PositionState]:
-        data = self._process_ledger(address, **kwargs)
-        return data["positions"]
+        return [item for _, item in self.iter_ledger(address, outputs=(OUTPUT_POSITIONS,), **kwargs)]
 
     def get_leaderboard(self, metric: str = "pnl") -> List[LeaderboardEntry]:
         if not self.storage:
             return []
         
-        raw_stats = self.storage.get_leaderboard_stats(metric)
+        return self._leaderboard_entries(self.storage.get_leaderboard_stats(metric))
+
+    def _leaderboard_entries(self, raw_stats: List[Dict[str, Any]]) -> List[LeaderboardEntry]:
         entries = []
         for i, r in enumerate(raw_stats):
             entries.append(LeaderboardEntry(
@@ -545,3 +298,160 @@ class LedgerService:
                 tainted=False # Aggregate taint check missing in simple SQL
             ))
         return entries
+
+    # --- Async entry points ---
+    # Storage and upstream I/O are awaited, fills and funding concurrently. The
+    # replay itself is CPU-bound and runs in the replay pool's worker processes
+    # if there is one, otherwise in a worker thread, reading the synced fills
+    # from storage in batches as it goes.
+
+    async def _sync_fills_async(self, address: str):
+        latest_ts = await self.astorage.get_latest_timestamp(address)
+        cache_lookup("fills", bool(latest_ts))
+        with stage("upstream_fills"):
+            new_fills = await asyncio.to_thread(self.data_source.get_user_fills, address, since=latest_ts)
+        if new_fills:
+            with stage("save_fills"):
+                await self.astorage.save_fills(address, new_fills)
+
+    async def _load_fills_async(self, address: str, from_ms: int = None, coin_filter: str = None,
+                                synced: bool = False) -> Iterable[Dict[str, Any]]:
+        if not self.astorage:
+            return await asyncio.to_thread(self._read_fills, address, from_ms, coin_filter)
+
+        if not synced:
+            await self._sync_fills_async(address)
+        # Lazy, consumed by the replay thread
+        return self._read_fills(address, from_ms=from_ms, coin_filter=coin_filter)
+
+    async def _sync_funding_async(self, address: str):
+        latest_ts = await self.astorage.get_latest_funding_timestamp(address)
+        cache_lookup("funding", bool(latest_ts))
+        new_funding = await asyncio.to_thread(self._fetch_new_funding, address, latest_ts)
+        if new_funding:
+            with stage("save_funding"):
+                await self.astorage.save_funding(address, new_funding)
+
+    async def _load_funding_async(self, address: str, from_ms: int = None, to_ms: int = None,
+                                  coin_filter: str = None, synced: bool = False) -> List[Dict[str, Any]]:
+        if not (self.astorage and self.astorage.caches_funding):
+            return await asyncio.to_thread(self._read_funding, address, from_ms, to_ms, coin_filter)
+
+        if not synced:
+            await self._sync_funding_async(address)
+        with stage("read_funding"):
+            funding = await self.astorage.get_funding(address, from_ms=from_ms, to_ms=to_ms)
+        return self._filter_funding(funding, coin_filter)
+
+    async def replay_async(self, address: str, target_builder: str = None,
+                           from_ms: int = None, to_ms: int = None,
+                           coin_filter: str = None, builder_only: bool = False,
+                           outputs: Iterable[str] = ALL_OUTPUTS, synced: bool = False,
+                           models: bool = True) -> LedgerReplay:
+        """Async `replay`: syncs fills and funding concurrently (unless `synced`, see
+        `sync_async`). Iterate the result off the event loop."""
+        fills, funding = await asyncio.gather(
+            self._load_fills_async(address, from_ms=from_ms, coin_filter=coin_filter, synced=synced),
+            self._load_funding_async(address, from_ms=from_ms, to_ms=to_ms, coin_filter=coin_filter, synced=synced),
+        )
+        return self._build_replay(fills, funding, target_builder=target_builder, from_ms=from_ms,
+                                  to_ms=to_ms, builder_only=builder_only, outputs=outputs, models=models)
+
+    async def _run_async(self, address: str, outputs: Tuple[str, ...], label: str, target_builder: str = None,
+                         from_ms: int = None, to_ms: int = None, coin_filter: str = None,
+                         builder_only: bool = False, synced: bool = False,
+                         models: bool = True) -> Tuple[List[Any], Any]:
+        """Replay off the event loop. Returns the outputs and the finished replay (or its
+        aggregates when it ran in the replay pool), ready for `summarize`."""
+        if self.replay_pool is None:
+            replay = await self.replay_async(address, target_builder=target_builder, from_ms=from_ms, to_ms=to_ms,
+                                             coin_filter=coin_filter, builder_only=builder_only, outputs=outputs,
+                                             synced=synced, models=models)
+            items = await asyncio.to_thread(lambda: [item for _, item in self._run(replay, label)])
+            return items, replay
+
+        # Only the sync happens here, the worker reads the fills itself
+        if synced:
+            funding = await self._load_funding_async(address, from_ms=from_ms, to_ms=to_ms,
+                                                     coin_filter=coin_filter, synced=True)
+        else:
+            _, funding = await asyncio.gather(
+                self._sync_fills_async(address),
+                self._load_funding_async(address, from_ms=from_ms, to_ms=to_ms, coin_filter=coin_filter),
+            )
+        job = ReplayJob(address, funding, target_builder=self._effective_builder(target_builder),
+                        coin_filter=coin_filter, builder_only=builder_only, from_ms=from_ms, to_ms=to_ms,
+                        outputs=outputs, models=models)
+        start = time.perf_counter()
+        with stage("replay"):
+            result = await self.replay_pool.run(job)
+        self._observe(label, start, result.fill_count)
+        return result.items, result
+
+    async def iter_ledger_async(self, address: str, outputs: Iterable[str] = ALL_OUTPUTS,
+                                **kwargs) -> Iterator[Tuple[str, Any]]:
+        """Async `iter_ledger`: sync (unless `synced`), then return the `(kind, item)` stream.
+        The replay runs as the caller iterates, in this process and not the replay pool,
+        so iterate it off the event loop."""
+        outputs = tuple(outputs)
+        replay = await self.replay_async(address, outputs=outputs, **kwargs)
+        return self._run(replay, "+".join(outputs) or "pnl")
+
+    async def _collect_async(self, address: str, output: str, **kwargs) -> List[Any]:
+        items, _ = await self._run_async(address, (output,), output, **kwargs)
+        return items
+
+    async def get_trades_async(self, address: str, **kwargs) -> List[Trade]:
+        return await self._collect_async(address, OUTPUT_TRADES, **kwargs)
+
+    async def get_pnl_history_async(self, address: str, **kwargs) -> List[PnLHistoryEntry]:
+        return await self._collect_async(address, OUTPUT_HISTORY, **kwargs)
+
+    async def get_position_history_async(self, address: str, **kwargs) -> List[PositionState]:
+        return await self._collect_async(address, OUTPUT_POSITIONS, **kwargs)
+
+    async def get_pnl_async(self, address: str, mids: Any = None, **kwargs) -> PnLResponse:
+        _, replay = await self._run_async(address, (), "pnl", **kwargs)
+        # Marks open positions with upstream mids
+        return await asyncio.to_thread(self.summarize, replay, mids)
+
+    async def sync_async(self, address: str, target_builder: str = None) -> Optional[DataVersion]:
+        """Sync fills and funding into storage and return what a replay of them depends on,
+        or None without storage. Pass `synced=True` to the replay that follows."""
+        if not self.astorage:
+            return None
+        if self.astorage.caches_funding:
+            await asyncio.gather(self._sync_fills_async(address), self._sync_funding_async(address))
+            funding_version = await self.astorage.get_latest_funding_timestamp(address) or 0
+        else:
+            await self._sync_fills_async(address)
+            # Read from upstream on every replay, but only ever settles on the hour
+            funding_version = int(time.time() // 3600) * 3600 * 1000
+        fills_ms, fills_at_ms = await self.astorage.get_fills_version(address)
+        return DataVersion(fills_ms, fills_at_ms, funding_version, self._effective_builder(target_builder) or "")
+
+    def mids_snapshot(self) -> Tuple[str, float, Dict[str, Any]]:
+        """(id, fetch time, mids) of the current mid prices, refetched at most every MIDS_SNAPSHOT_S.
+
+        The id is derived from the prices, so it only changes when they do
+        and is the same in every worker.
+        """
+        with self._mids_lock:
+            snapshot = self._mids
+            if snapshot is not None and time.time() - snapshot[1] < settings.MIDS_SNAPSHOT_S:
+                return snapshot
+            try:
+                with stage("mids"):
+                    mids = self.data_source.get_all_mids()
+            except Exception as e:
+                print(f"Error fetching prices: {e}")
+                # Not kept, the next call retries
+                return "", time.time(), {}
+            digest = hashlib.blake2b(repr(sorted(mids.items())).encode(), digest_size=8).hexdigest()
+            self._mids = (digest, time.time(), mids)
+            return self._mids
+
+    async def get_leaderboard_async(self, metric: str = "pnl") -> List[LeaderboardEntry]:
+        if not self.astorage:
+            return []
+        return self._leaderboard_entries(await self.astorage.get_leaderboard_stats(metric))
@@ -0,0 +1,242 @@
+"""Cold-tier archive of historical fills.
+
+Fills older than a cutoff are compacted into immutable, per-user columnar
+segment files. A segment is a fixed header, a small JSON dictionary for the
+segment-local coin/builder ids, then one contiguous little-endian array per
+column, each 8-byte aligned:
+
+    time i8 | tid i8 | sz i8 | px i8 | fee i8 | closed_pnl i8 | coin i4 | builder i4 | side i1
+
+Segments are opened with mmap and the columns are exposed as numpy views over
+the mapping, so reading never copies the file into the heap; the OS pages in
+only what a scan touches.
+"""
+import json
+import os
+import re
+import struct
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .codec import fixed_to_str_cached, decode_side
+
+MAGIC = b"ORBFILL1"
+# magic, rows, min_time, max_time, sum_closed_pnl, dictionary length
+HEADER = struct.Struct("<8sqqqqI")
+ALIGN = 8
+SEGMENT_SUFFIX = ".fills"
+
+COLUMNS = (
+    ("time", "<i8"),
+    ("tid", "<i8"),
+    ("sz", "<i8"),
+    ("px", "<i8"),
+    ("fee", "<i8"),
+    ("closed_pnl", "<i8"),
+    ("coin", "<i4"),
+    ("builder", "<i4"),
+    ("side", "<i1"),
+)
+
+
+def _pad(n: int) -> int:
+    return (-n) % ALIGN
+
+
+class Segment:
+    """A memory-mapped archive segment."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+            magic, self.rows, self.min_time, self.max_time, self.sum_closed_pnl, dict_len = HEADER.unpack(head)
+            if magic != MAGIC:
+                raise ValueError(f"Not a fill archive segment: {path}")
+            dictionary = json.loads(f.read(dict_len))
+        self.coins: List[str] = dictionary["coins"]
+        self.builders: List[str] = dictionary["builders"]
+
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        offset = HEADER.size + dict_len + _pad(HEADER.size + dict_len)
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, dtype in COLUMNS:
+            width = np.dtype(dtype).itemsize * self.rows
+            # View over the mapping, no copy
+            self.columns[name] = np.frombuffer(self._map, dtype=dtype, count=self.rows, offset=offset)
+            offset += width + _pad(width)
+
+    def select(self, coin: str = None, from_ms: int = None, to_ms: int = None) -> Optional[np.ndarray]:
+        """Row indices matching the filters, or None for all rows."""
+        if (from_ms is not None and self.max_time < from_ms) or (to_ms is not None and self.min_time > to_ms):
+            return np.empty(0, dtype=np.int64)
+        mask = None
+        if coin is not None:
+            if coin not in self.coins:
+                return np.empty(0, dtype=np.int64)
+            mask = self.columns["coin"] == self.coins.index(coin)
+        times = self.columns["time"]
+        if from_ms is not None and self.min_time < from_ms:
+            mask = (times >= from_ms) if mask is None else mask & (times >= from_ms)
+        if to_ms is not None and self.max_time > to_ms:
+            mask = (times <= to_ms) if mask is None else mask & (times <= to_ms)
+        return None if mask is None else np.flatnonzero(mask)
+
+    def iter_fills(self, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Dict[str, Any]]:
+        idx = self.select(coin, from_ms, to_ms)
+        total = self.rows if idx is None else len(idx)
+        cols = self.columns
+        coins, builders = self.coins, self.builders
+        as_str = fixed_to_str_cached
+
+        for start in range(0, total, batch_size):
+            part = slice(start, start + batch_size) if idx is None else idx[start:start + batch_size]
+            # tolist() turns the batch into Python ints in one call
+            batch = zip(*(cols[name][part].tolist() for name, _ in COLUMNS))
+            for time, tid, sz, px, fee, closed_pnl, coin_ix, builder_ix, side in batch:
+                yield {
+                    "coin": coins[coin_ix],
+                    "side": decode_side(side),
+                    "sz": as_str(sz),
+                    "px": as_str(px),
+                    "time": time,
+                    "fee": as_str(fee),
+                    "closedPnl": as_str(closed_pnl),
+                    "builder": builders[builder_ix] if builder_ix >= 0 else None,
+                    "tid": tid,
+                }
+
+    def latest_time(self, coin: str = None) -> int:
+        if coin is None:
+            return self.max_time
+        idx = self.select(coin)
+        if idx is not None and len(idx) == 0:
+            return 0
+        return int(self.columns["time"][idx].max())
+
+    def close(self):
+        self.columns = {}
+        self._map = None
+
+
+class FillArchive:
+    """Directory of per-user segment files: <root>/<user>/<seq>.fills"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # user -> (directory mtime, segments)
+        self._segments: Dict[str, Tuple[int, List[Segment]]] = {}
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user: str) -> str:
+        if re.fullmatch(r"[0-9A-Za-z_]+", user):
+            name = user
+        else:
+            name = hashlib.sha1(user.encode()).hexdigest()
+        return os.path.join(self.root, name)
+
+    def segments(self, user: str) -> List[Segment]:
+        directory = self._user_dir(user)
+        try:
+            # Another worker may have published a segment since we last listed
+            stamp = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached = self._segments.get(user)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with self._lock:
+            cached = self._segments.get(user)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            known = {s.path: s for s in cached[1]} if cached else {}
+            names = sorted(n for n in os.listdir(directory) if n.endswith(SEGMENT_SUFFIX))
+            segments = []
+            for name in names:
+                path = os.path.join(directory, name)
+                segments.append(known.get(path) or Segment(path))
+            self._segments[user] = (stamp, segments)
+        return segments
+
+    def watermark(self, user: str) -> Optional[int]:
+        """Newest archived fill time; everything at or before it lives in the archive."""
+        segments = self.segments(user)
+        return segments[-1].max_time if segments else None
+
+    def totals(self, user: str) -> Tuple[int, int]:
+        """(sum of closed_pnl, fill count) over the user's archive, from segment headers."""
+        segments = self.segments(user)
+        return sum(s.sum_closed_pnl for s in segments), sum(s.rows for s in segments)
+
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Dict[str, Any]]:
+        for segment in self.segments(user):
+            yield from segment.iter_fills(coin, from_ms, to_ms, batch_size)
+
+    def latest_time(self, user: str, coin: str = None) -> int:
+        latest = 0
+        for segment in self.segments(user):
+            latest = max(latest, segment.latest_time(coin))
+        return latest
+
+    def write_segment(self, user: str, rows: List[tuple], coin_names: Dict[int, str],
+                      builder_names: Dict[int, str]) -> Segment:
+        """Write rows (time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id),
+        already sorted by time, as a new segment. Ids are remapped to segment-local indices."""
+        if not rows:
+            raise ValueError("Refusing to write an empty segment")
+
+        time, tid, coin_ids, side, sz, px, fee, closed_pnl, builder_ids = zip(*rows)
+
+        coins = sorted({coin_names[c] for c in coin_ids})
+        builders = sorted({builder_names[b] for b in builder_ids if b is not None})
+        coin_ix = {name: i for i, name in enumerate(coins)}
+        builder_ix = {name: i for i, name in enumerate(builders)}
+
+        arrays = {
+            "time": np.asarray(time, dtype="<i8"),
+            "tid": np.asarray(tid, dtype="<i8"),
+            "sz": np.asarray(sz, dtype="<i8"),
+            "px": np.asarray(px, dtype="<i8"),
+            "fee": np.asarray(fee, dtype="<i8"),
+            "closed_pnl": np.asarray(closed_pnl, dtype="<i8"),
+            "coin": np.asarray([coin_ix[coin_names[c]] for c in coin_ids], dtype="<i4"),
+            "builder": np.asarray([builder_ix[builder_names[b]] if b is not None else -1 for b in builder_ids], dtype="<i4"),
+            "side": np.asarray(side, dtype="<i1"),
+        }
+        dictionary = json.dumps({"coins": coins, "builders": builders}).encode()
+        header = HEADER.pack(MAGIC, len(rows), time[0], time[-1], sum(closed_pnl), len(dictionary))
+
+        directory = self._user_dir(user)
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segments(user)
+        seq = int(os.path.basename(existing[-1].path).split(".")[0]) + 1 if existing else 0
+        path = os.path.join(directory, f"{seq:08d}{SEGMENT_SUFFIX}")
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(dictionary)
+            f.write(b"\0" * _pad(len(header) + len(dictionary)))
+            for name, dtype in COLUMNS:
+                data = arrays[name].tobytes()
+                f.write(data)
+                f.write(b"\0" * _pad(len(data)))
+            f.flush()
+            os.fsync(f.fileno())
+        # Atomic publish, readers never see a partial segment
+        os.replace(tmp_path, path)
+
+        return Segment(path)
+
+    def close(self):
+        with self._lock:
+            for _, segments in self._segments.values():
+                for segment in segments:
+                    segment.close()
+            self._segments = {}
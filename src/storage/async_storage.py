@@ -0,0 +1,70 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Any, Optional, AsyncIterator, Tuple
+from .base import StorageBackend
+
+
+class AsyncStorage:
+    """Awaitable facade over any StorageBackend.
+
+    Calls run on a dedicated storage I/O thread pool instead of the event loop
+    or the request threadpool, so a slow disk read only occupies one of these
+    threads while the handler awaits it. Sized like the connection pool: more
+    threads than connections would just queue inside the backend.
+    """
+
+    def __init__(self, backend: StorageBackend, max_workers: int = 8):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage-io")
+
+    @property
+    def caches_funding(self) -> bool:
+        return self.backend.caches_funding
+
+    async def run(self, fn, *args, **kwargs):
+        """Run any blocking storage call on the I/O pool."""
+        loop = asyncio.get_running_loop()
+        # Carry context variables over like asyncio.to_thread (request stage timers)
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+    async def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
+        return await self.run(self.backend.get_latest_timestamp, user, coin)
+
+    async def get_fills_version(self, user: str) -> Tuple[int, int]:
+        return await self.run(self.backend.get_fills_version, user)
+
+    async def save_fills(self, user: str, fills: List[Any]):
+        return await self.run(self.backend.save_fills, user, fills)
+
+    async def get_all_fills(self, user: str) -> List[Any]:
+        return await self.run(self.backend.get_all_fills, user)
+
+    async def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                         batch_size: int = 5000) -> AsyncIterator[Any]:
+        # Each batch is pulled from the backend's iterator on the I/O pool
+        fills = self.backend.iter_fills(user, coin, from_ms, to_ms, batch_size)
+        while True:
+            batch = await self.run(lambda: list(islice(fills, batch_size)))
+            if not batch:
+                return
+            for fill in batch:
+                yield fill
+
+    async def get_latest_funding_timestamp(self, user: str) -> Optional[int]:
+        return await self.run(self.backend.get_latest_funding_timestamp, user)
+
+    async def save_funding(self, user: str, funding: List[Any]):
+        return await self.run(self.backend.save_funding, user, funding)
+
+    async def get_funding(self, user: str, from_ms: int = None, to_ms: int = None) -> List[Any]:
+        return await self.run(self.backend.get_funding, user, from_ms, to_ms)
+
+    async def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
+        return await self.run(self.backend.get_leaderboard_stats, metric)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
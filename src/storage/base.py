@@ -1,8 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Iterator, Tuple
 from decimal import Decimal
 
 class StorageBackend(ABC):
+    # Backends that also keep funding history set this and implement the funding methods
+    caches_funding = False
+    # Backends with a cold fill archive (ARCHIVE_DIR) set this and implement archive_cold_fills
+    has_archive = False
+
     @abstractmethod
     def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
         """Get the timestamp (ms) of the most recent fill stored for this user."""
@@ -18,6 +23,45 @@ class StorageBackend(ABC):
         """Retrieve all fills for a user."""
         pass
     
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Any]:
+        """Stream a user's fills in time order, optionally restricted to a coin and [from_ms, to_ms].
+
+        Backends should override this to push the filters down and read in batches;
+        the default falls back to get_all_fills.
+        """
+        for fill in self.get_all_fills(user):
+            if coin and fill.get('coin') != coin:
+                continue
+            if from_ms is not None and fill['time'] < from_ms:
+                continue
+            if to_ms is not None and fill['time'] > to_ms:
+                continue
+            yield fill
+
+    def get_fills_version(self, user: str) -> Tuple[int, int]:
+        """(latest fill time in ms, number of fills stored at that time) for this user.
+
+        Syncs only add fills at or after the latest time, so the pair changes
+        whenever one is stored, even a second fill in the same millisecond.
+        """
+        latest = self.get_latest_timestamp(user) or 0
+        if not latest:
+            return 0, 0
+        return latest, sum(1 for _ in self.iter_fills(user, from_ms=latest, to_ms=latest))
+
+    def get_latest_funding_timestamp(self, user: str) -> Optional[int]:
+        """Get the timestamp (ms) of the most recent funding event stored for this user."""
+        return 0
+
+    def save_funding(self, user: str, funding: List[Any]):
+        """Save a list of raw funding events."""
+        raise NotImplementedError
+
+    def get_funding(self, user: str, from_ms: int = None, to_ms: int = None) -> List[Any]:
+        """Retrieve a user's funding events in time order, optionally within [from_ms, to_ms]."""
+        raise NotImplementedError
+
     @abstractmethod
     def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
         """Get aggregate stats for leaderboard."""
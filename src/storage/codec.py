@@ -0,0 +1,73 @@
+import hashlib
+from functools import lru_cache
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Any, Dict, Optional
+
+# Fixed-point encoding shared by the storage backends.
+# Prices, sizes, fees and PnL are stored as integers scaled by 1e8, which covers
+# Hyperliquid's maximum of 8 decimals (spot prices) and keeps int64 headroom
+# up to ~9.2e10 units.
+FIXED_DECIMALS = 8
+FIXED_SCALE = 10 ** FIXED_DECIMALS
+_QUANT = Decimal(1)
+
+SIDE_BUY = 1
+SIDE_SELL = -1
+SIDE_UNKNOWN = 0
+
+_SIDE_CODES = {'B': SIDE_BUY, 'Buy': SIDE_BUY, 'A': SIDE_SELL, 'Sell': SIDE_SELL}
+_SIDE_NAMES = {SIDE_BUY: 'B', SIDE_SELL: 'A', SIDE_UNKNOWN: None}
+
+def to_fixed(value: Any) -> int:
+    """Convert a decimal string/number to a 1e8-scaled integer."""
+    if value is None or value == "":
+        return 0
+    return int(Decimal(str(value)).scaleb(FIXED_DECIMALS).quantize(_QUANT, rounding=ROUND_HALF_EVEN))
+
+def fixed_to_str(value: int) -> str:
+    """Render a 1e8-scaled integer as a plain decimal string ("50000.0", "0.00012")."""
+    sign = "-" if value < 0 else ""
+    whole, frac = divmod(abs(value), FIXED_SCALE)
+    if not frac:
+        return f"{sign}{whole}.0"
+    return f"{sign}{whole}.{frac:0{FIXED_DECIMALS}d}".rstrip("0")
+
+# Prices and sizes sit on a tick grid and repeat heavily within a history,
+# so the string rendering is memoized for the bulk read paths.
+fixed_to_str_cached = lru_cache(maxsize=1 << 16)(fixed_to_str)
+
+def fixed_to_float(value: Optional[int]) -> float:
+    return (value or 0) / FIXED_SCALE
+
+def encode_side(side: Optional[str]) -> int:
+    return _SIDE_CODES.get(side, SIDE_UNKNOWN)
+
+def decode_side(code: int) -> Optional[str]:
+    return _SIDE_NAMES.get(code)
+
+def fill_builder(fill: Dict[str, Any]) -> Optional[str]:
+    builder = fill.get('builder') or (fill.get('builderInfo') or {}).get('builder')
+    return builder.lower() if builder else None
+
+def funding_key(event: Dict[str, Any]) -> str:
+    """Identity of a funding event within a user's history (alongside its time)."""
+    delta = event.get('delta') or {}
+    coin = event.get('coin') or event.get('token') or delta.get('coin') or ""
+    return f"{event.get('hash') or ''}|{coin}"
+
+def fill_tid(fill: Dict[str, Any]) -> int:
+    """Integer identity of a fill.
+
+    Upstream fills carry an integer `tid`. Fills without one (tests, legacy rows)
+    get a stable negative id hashed from their content so they never collide
+    with real trade ids.
+    """
+    tid = fill.get('tid')
+    if tid is not None and tid != "":
+        try:
+            return int(tid)
+        except (TypeError, ValueError):
+            pass
+    key = "|".join(str(fill.get(k, "")) for k in ('tid', 'oid', 'hash', 'time', 'coin', 'side', 'sz', 'px'))
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return -(int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF) - 1
@@ -0,0 +1,52 @@
+from typing import Optional
+
+from ..config import settings
+from .base import StorageBackend
+from .sqlite import SqliteStorage, get_shared_storage
+from .sharded import ShardedSqliteStorage
+from .memory import MemoryStorage
+
+# Storage types whose data another process can open (sqlite files, Postgres);
+# memory storage lives in the process that created it
+SHAREABLE_TYPES = ("sqlite", "sqlite_sharded", "postgres")
+
+
+def create_storage(storage_type: str = None, read_only: bool = False) -> Optional[StorageBackend]:
+    """Storage backend for STORAGE_TYPE (or `storage_type`), None for unknown types.
+
+    `read_only` is for processes that only read what another one writes
+    (replay workers): no schema setup and no sqlite writer thread.
+    """
+    storage_type = storage_type or settings.STORAGE_TYPE
+    if storage_type == "sqlite":
+        if read_only:
+            return SqliteStorage(
+                settings.DATABASE_URL,
+                pool_size=settings.SQLITE_POOL_SIZE,
+                keep_raw=settings.STORE_RAW_FILLS,
+                archive_dir=settings.ARCHIVE_DIR or None,
+                read_only=True,
+            )
+        return get_shared_storage(settings.DATABASE_URL)
+    if storage_type == "sqlite_sharded":
+        # Fills/funding only; settings, keys and logs stay in DATABASE_URL
+        return ShardedSqliteStorage(
+            settings.DATABASE_URL,
+            shards=settings.SQLITE_SHARDS,
+            pool_size=settings.SQLITE_POOL_SIZE,
+            keep_raw=settings.STORE_RAW_FILLS,
+            archive_dir=settings.ARCHIVE_DIR or None,
+            group_commit=settings.SQLITE_GROUP_COMMIT,
+            group_commit_ms=settings.SQLITE_GROUP_COMMIT_MS,
+            read_only=read_only,
+        )
+    if storage_type == "memory":
+        return MemoryStorage(
+            max_bytes=settings.MEMORY_STORAGE_MAX_MB * 1024 * 1024,
+            snapshot_path=settings.MEMORY_SNAPSHOT_PATH or None,
+        )
+    if storage_type == "postgres":
+        # Imported lazily, psycopg is only needed for this backend
+        from .postgres import PostgresStorage
+        return PostgresStorage(settings.DATABASE_URL, pool_size=settings.POSTGRES_POOL_SIZE, read_only=read_only)
+    return None
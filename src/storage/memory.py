@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Any, Optional, Dict, Iterator, Tuple
+from .base import StorageBackend
+from .codec import to_fixed, fixed_to_float, fill_builder, fill_tid, funding_key
+
+logger = logging.getLogger(__name__)
+
+# Row layout of the per-user fill arrays: a flat tuple per fill instead of the
+# upstream dict, roughly a third of the size and cheap to decode.
+FILL_FIELDS = ("time", "tid", "coin", "side", "sz", "px", "fee", "closedPnl", "builder")
+
+SNAPSHOT_VERSION = 1
+
+
+def _row_size(row: tuple) -> int:
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+
+
+class _UserData:
+    __slots__ = ("fills", "tids", "latest_by_coin", "funding", "funding_times", "funding_keys", "pnl", "size")
+
+    def __init__(self):
+        # Sorted by (time, tid), the rows' first two fields; tids are unique, so plain
+        # tuple order is that order (bisect's key= needs Python 3.10, the image runs 3.9)
+        self.fills: List[tuple] = []
+        self.tids = set()
+        self.latest_by_coin: Dict[str, int] = {}
+        self.funding: List[Dict[str, Any]] = []   # sorted by time
+        self.funding_times: List[int] = []        # their times, to bisect
+        self.funding_keys = set()
+        self.pnl = 0                        # 1e8 fixed-point sum of closedPnl
+        self.size = sys.getsizeof(self)
+
+
+class MemoryStorage(StorageBackend):
+    """Process-local storage for ephemeral deployments.
+
+    Keeps each user's fills as a time-ordered array of tuples plus their funding
+    events. Users are evicted least-recently-used first once the estimated
+    footprint exceeds `max_bytes`; an evicted user is simply refetched from
+    upstream on next access. Optionally snapshotted to disk on shutdown.
+    """
+
+    caches_funding = True
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, snapshot_path: str = None):
+        self.max_bytes = max_bytes
+        self.snapshot_path = snapshot_path
+        self._users: "OrderedDict[str, _UserData]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    @property
+    def used_bytes(self) -> int:
+        return self._bytes
+
+    def _get(self, user: str, create: bool = False) -> Optional[_UserData]:
+        data = self._users.get(user)
+        if data is not None:
+            self._users.move_to_end(user)
+        elif create:
+            data = self._users[user] = _UserData()
+            self._bytes += data.size
+        return data
+
+    def _grow(self, data: _UserData, nbytes: int):
+        data.size += nbytes
+        self._bytes += nbytes
+
+    def _evict(self, keep: str):
+        # Never evict the user just written, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._users) > 1:
+            user, data = next(iter(self._users.items()))
+            if user == keep:
+                self._users.move_to_end(user)
+                continue
+            del self._users[user]
+            self._bytes -= data.size
+            logger.debug(f"Evicted {user} ({data.size} bytes) from memory storage")
+
+    # --- Fills ---
+
+    def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
+        with self._lock:
+            data = self._get(user)
+            if data is None or not data.fills:
+                return 0
+            if coin:
+                return data.latest_by_coin.get(coin, 0)
+            return data.fills[-1][0]
+
+    def save_fills(self, user: str, fills: List[Any]):
+        if not fills:
+            return
+        with self._lock:
+            data = self._get(user, create=True)
+            added = 0
+            for fill in fills:
+                tid = fill_tid(fill)
+                if tid in data.tids:
+                    continue
+                time = int(fill['time'])
+                coin = fill.get('coin')
+                row = (
+                    time, tid, coin, fill.get('side'),
+                    fill.get('sz'), fill.get('px'), fill.get('fee'), fill.get('closedPnl'),
+                    fill_builder(fill),
+                )
+                # Incremental syncs append; only out-of-order batches pay for the insort
+                if not data.fills or data.fills[-1][:2] <= (time, tid):
+                    data.fills.append(row)
+                else:
+                    bisect.insort(data.fills, row)
+                data.tids.add(tid)
+                if time > data.latest_by_coin.get(coin, 0):
+                    data.latest_by_coin[coin] = time
+                data.pnl += to_fixed(row[7])
+                added += _row_size(row) + 32  # + set entry
+            self._grow(data, added)
+            self._evict(keep=user)
+
+    def _decode(self, row: tuple) -> Dict[str, Any]:
+        return dict(zip(FILL_FIELDS, row))
+
+    def get_all_fills(self, user: str) -> List[Any]:
+        with self._lock:
+            data = self._get(user)
+            rows = list(data.fills) if data else []
+        return [self._decode(r) for r in rows]
+
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Any]:
+        with self._lock:
+            data = self._get(user)
+            if data is None:
+                return
+            rows = data.fills
+            # Rows are time ordered, so the window is a bisect, not a scan
+            # (t,) sorts before every row at time t
+            lo = bisect.bisect_left(rows, (from_ms,)) if from_ms is not None else 0
+            hi = bisect.bisect_left(rows, (to_ms + 1,)) if to_ms is not None else len(rows)
+            rows = rows[lo:hi]
+        for row in rows:
+            if coin and row[2] != coin:
+                continue
+            yield self._decode(row)
+
+    # --- Funding ---
+
+    def get_latest_funding_timestamp(self, user: str) -> Optional[int]:
+        with self._lock:
+            data = self._get(user)
+            if data is None or not data.funding:
+                return 0
+            return data.funding[-1]['time']
+
+    def save_funding(self, user: str, funding: List[Any]):
+        if not funding:
+            return
+        with self._lock:
+            data = self._get(user, create=True)
+            added = 0
+            for event in funding:
+                key = (event['time'], funding_key(event))
+                if key in data.funding_keys:
+                    continue
+                data.funding_keys.add(key)
+                data.funding.append(event)
+                added += sys.getsizeof(event) + sum(sys.getsizeof(v) for v in event.values()) + 96
+            data.funding.sort(key=lambda e: e['time'])
+            data.funding_times = [e['time'] for e in data.funding]
+            self._grow(data, added)
+            self._evict(keep=user)
+
+    def get_funding(self, user: str, from_ms: int = None, to_ms: int = None) -> List[Any]:
+        with self._lock:
+            data = self._get(user)
+            if data is None:
+                return []
+            times = data.funding_times
+            lo = bisect.bisect_left(times, from_ms) if from_ms is not None else 0
+            hi = bisect.bisect_right(times, to_ms) if to_ms is not None else len(times)
+            return data.funding[lo:hi]
+
+    # --- Aggregates ---
+
+    def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
+        # Only users currently resident in memory are ranked
+        with self._lock:
+            rows = [(user, data.pnl, len(data.fills)) for user, data in self._users.items() if data.fills]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return [
+            {"user": user, "metricValue": fixed_to_float(pnl), "tradeCount": count}
+            for user, pnl, count in rows[:50]
+        ]
+
+    # --- Snapshots ---
+
+    def snapshot(self, path: str = None):
+        """Write all resident users to `path` (default snapshot_path) atomically."""
+        path = path or self.snapshot_path
+        if not path:
+            return
+        with self._lock:
+            users = {
+                user: {"fills": data.fills, "funding": data.funding}
+                for user, data in self._users.items()
+            }
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": SNAPSHOT_VERSION, "users": users}, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Snapshotted {len(users)} users to {path}")
+
+    def load_snapshot(self, path: str):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable memory snapshot {path}: {e}")
+            return
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring memory snapshot {path} with version {snapshot.get('version')}")
+            return
+        # Snapshot order is LRU order, so replaying it restores recency too
+        for user, data in snapshot["users"].items():
+            self.save_fills(user, [self._decode(r) for r in data["fills"]])
+            self.save_funding(user, data["funding"])
+
+    def close(self):
+        self.snapshot()
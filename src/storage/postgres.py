@@ -0,0 +1,302 @@
+import asyncio
+import calendar
+import logging
+import threading
+import time as _time
+from typing import List, Any, Optional, Dict, Iterator
+
+from psycopg_pool import AsyncConnectionPool
+
+from .base import StorageBackend
+from .codec import (
+    to_fixed, fixed_to_str_cached, fixed_to_float, encode_side, decode_side,
+    fill_builder, fill_tid,
+)
+
+logger = logging.getLogger(__name__)
+
+FILL_COLUMNS = 'time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id'
+
+SQL_LATEST_TS = 'SELECT MAX(f.time) FROM fills f JOIN fill_users u ON u.id = f.user_id WHERE u.address = %s'
+SQL_LATEST_TS_COIN = '''
+    SELECT MAX(f.time) FROM fills f
+    JOIN fill_users u ON u.id = f.user_id
+    JOIN fill_coins c ON c.id = f.coin_id
+    WHERE u.address = %s AND c.name = %s
+'''
+SQL_LEADERBOARD = '''
+    SELECT u.address, SUM(f.closed_pnl) AS total_pnl, COUNT(*) AS trade_count
+    FROM fills f
+    JOIN fill_users u ON u.id = f.user_id
+    GROUP BY u.address
+    ORDER BY total_pnl DESC
+    LIMIT 50
+'''
+
+
+def _month_start_ms(year: int, month: int) -> int:
+    return calendar.timegm((year, month, 1, 0, 0, 0)) * 1000
+
+
+def _partition_bounds(time_ms: int):
+    """(name, start, end) of the monthly (UTC) fills partition holding time_ms."""
+    t = _time.gmtime(time_ms // 1000)
+    year, month = t.tm_year, t.tm_mon
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"fills_{year:04d}{month:02d}", _month_start_ms(year, month), _month_start_ms(next_year, next_month)
+
+
+def _conninfo(db_url: str) -> str:
+    # Accept SQLAlchemy-style URLs ("postgresql+psycopg://...") as well as plain libpq ones
+    scheme, sep, rest = db_url.partition("://")
+    return f"{scheme.split('+')[0]}{sep}{rest}" if sep else db_url
+
+
+class PostgresStorage(StorageBackend):
+    """Postgres-backed fill storage.
+
+    Same typed layout as the SQLite backend (interned users/coins/builders,
+    1e8 fixed-point BIGINT amounts) with `fills` range-partitioned by month.
+    Writes go through COPY into a temporary staging table and a single
+    INSERT .. ON CONFLICT DO NOTHING, so a sync of 100k fills is one round trip
+    of rows instead of 100k statements.
+
+    Connections come from an AsyncConnectionPool driven by a private event loop;
+    the synchronous StorageBackend methods submit to it and wait.
+    """
+
+    def __init__(self, db_url: str, pool_size: int = 10, read_only: bool = False):
+        self.conninfo = _conninfo(db_url)
+        self.pool_size = pool_size
+        self.read_only = read_only
+
+        self._user_ids: Dict[str, int] = {}
+        self._coin_ids: Dict[str, int] = {}
+        self._builder_ids: Dict[str, int] = {}
+        self._coin_names: Dict[int, str] = {}
+        self._builder_names: Dict[int, str] = {}
+        self._partitions = set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="postgres-storage", daemon=True)
+        self._thread.start()
+
+        self.pool: Optional[AsyncConnectionPool] = None
+        self._run(self._open())
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _open(self):
+        self.pool = AsyncConnectionPool(self.conninfo, min_size=1, max_size=self.pool_size, open=False)
+        await self.pool.open(wait=True)
+        # Read-only opens (replay workers) skip the startup DDL
+        if not self.read_only:
+            await self._init_db()
+
+    def close(self):
+        if self.pool is not None:
+            self._run(self.pool.close())
+            self.pool = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _init_db(self):
+        async with self.pool.connection() as conn:
+            # Serialize concurrent workers running the DDL at startup
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('orbitio_fills_schema'))")
+            await conn.execute('CREATE TABLE IF NOT EXISTS fill_users (id SERIAL PRIMARY KEY, address TEXT NOT NULL UNIQUE)')
+            await conn.execute('CREATE TABLE IF NOT EXISTS fill_coins (id SERIAL PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+            await conn.execute('CREATE TABLE IF NOT EXISTS fill_builders (id SERIAL PRIMARY KEY, address TEXT NOT NULL UNIQUE)')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fills (
+                    user_id INTEGER NOT NULL,
+                    time BIGINT NOT NULL,
+                    tid BIGINT NOT NULL,
+                    coin_id INTEGER NOT NULL,
+                    side SMALLINT NOT NULL,
+                    sz BIGINT NOT NULL,
+                    px BIGINT NOT NULL,
+                    fee BIGINT NOT NULL,
+                    closed_pnl BIGINT NOT NULL,
+                    builder_id INTEGER,
+                    PRIMARY KEY (user_id, time, tid)
+                ) PARTITION BY RANGE (time)
+            ''')
+            # Declared on the parent, created on every partition
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_fills_user_coin ON fills (user_id, coin_id, time)')
+            rows = await (await conn.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'fills'::regclass"
+            )).fetchall()
+            self._partitions = {r[0] for r in rows}
+
+    async def _ensure_partitions(self, conn, times: List[int]):
+        missing = {_partition_bounds(t) for t in times}
+        missing = [p for p in missing if p[0] not in self._partitions]
+        if not missing:
+            return
+        # Own transaction, serialized across workers, so the partition is visible
+        # before any insert routes to it
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('orbitio_fills_schema'))")
+            for name, start, end in missing:
+                await conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF fills FOR VALUES FROM ({start}) TO ({end})'
+                )
+        self._partitions.update(name for name, _, _ in missing)
+
+    # --- Interning ---
+
+    async def _intern(self, conn, table: str, column: str, cache: Dict[str, int], value: str) -> int:
+        value_id = cache.get(value)
+        if value_id is None:
+            # DO UPDATE (a no-op) so RETURNING also yields the id of an existing row
+            cur = await conn.execute(
+                f'INSERT INTO {table} ({column}) VALUES (%s) '
+                f'ON CONFLICT ({column}) DO UPDATE SET {column} = EXCLUDED.{column} RETURNING id',
+                (value,),
+            )
+            value_id = cache[value] = (await cur.fetchone())[0]
+        return value_id
+
+    async def _load_names(self, conn):
+        self._coin_names = dict(await (await conn.execute('SELECT id, name FROM fill_coins')).fetchall())
+        self._builder_names = dict(await (await conn.execute('SELECT id, address FROM fill_builders')).fetchall())
+
+    def _reset_interned(self):
+        self._user_ids, self._coin_ids, self._builder_ids = {}, {}, {}
+
+    # --- Fills ---
+
+    def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
+        return self._run(self._get_latest_timestamp(user, coin))
+
+    async def _get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
+        async with self.pool.connection() as conn:
+            if coin:
+                cur = await conn.execute(SQL_LATEST_TS_COIN, (user, coin))
+            else:
+                cur = await conn.execute(SQL_LATEST_TS, (user,))
+            row = await cur.fetchone()
+        return row[0] if row and row[0] else 0
+
+    def save_fills(self, user: str, fills: List[Any]):
+        if not fills:
+            return
+        try:
+            self._run(self._save_fills(user, fills))
+        except Exception:
+            # Ids interned inside the rolled back transaction are not durable
+            self._reset_interned()
+            raise
+
+    async def _save_fills(self, user: str, fills: List[Any]):
+        async with self.pool.connection() as conn:
+            await self._ensure_partitions(conn, [int(f['time']) for f in fills])
+            async with conn.transaction():
+                user_id = await self._intern(conn, 'fill_users', 'address', self._user_ids, user)
+                rows = []
+                for fill in fills:
+                    builder = fill_builder(fill)
+                    rows.append((
+                        user_id,
+                        int(fill['time']),
+                        fill_tid(fill),
+                        await self._intern(conn, 'fill_coins', 'name', self._coin_ids, fill.get('coin')),
+                        encode_side(fill.get('side')),
+                        to_fixed(fill.get('sz')),
+                        to_fixed(fill.get('px')),
+                        to_fixed(fill.get('fee')),
+                        to_fixed(fill.get('closedPnl')),
+                        await self._intern(conn, 'fill_builders', 'address', self._builder_ids, builder) if builder else None,
+                    ))
+
+                # COPY can't skip duplicates, so stage and merge
+                await conn.execute(
+                    'CREATE TEMP TABLE IF NOT EXISTS fills_stage '
+                    '(LIKE fills INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+                )
+                async with conn.cursor() as cur:
+                    async with cur.copy(f'COPY fills_stage (user_id, {FILL_COLUMNS}) FROM STDIN') as copy:
+                        for row in rows:
+                            await copy.write_row(row)
+                await conn.execute('INSERT INTO fills SELECT * FROM fills_stage ON CONFLICT DO NOTHING')
+
+    def _decode_rows(self, rows: List[tuple]) -> List[Dict[str, Any]]:
+        as_str = fixed_to_str_cached
+        coin_names = self._coin_names
+        builder_names = self._builder_names
+        return [{
+            "coin": coin_names.get(coin_id),
+            "side": decode_side(side),
+            "sz": as_str(sz),
+            "px": as_str(px),
+            "time": time,
+            "fee": as_str(fee),
+            "closedPnl": as_str(closed_pnl),
+            "builder": builder_names.get(builder_id) if builder_id is not None else None,
+            "tid": tid,
+        } for time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id in rows]
+
+    async def _fetch_page(self, user: str, coin: str, from_ms: int, to_ms: int,
+                          after: Optional[tuple], limit: int) -> List[tuple]:
+        where = ['u.address = %s']
+        params: List[Any] = [user]
+        if coin:
+            where.append('f.coin_id = (SELECT id FROM fill_coins WHERE name = %s)')
+            params.append(coin)
+        if from_ms is not None:
+            where.append('f.time >= %s')
+            params.append(from_ms)
+        if to_ms is not None:
+            where.append('f.time <= %s')
+            params.append(to_ms)
+        if after is not None:
+            where.append('(f.time, f.tid) > (%s, %s)')
+            params.extend(after)
+        params.append(limit)
+
+        columns = ', '.join(f'f.{c.strip()}' for c in FILL_COLUMNS.split(','))
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(
+                f'SELECT {columns} FROM fills f JOIN fill_users u ON u.id = f.user_id '
+                f'WHERE {" AND ".join(where)} ORDER BY f.time, f.tid LIMIT %s',
+                params,
+            )
+            rows = await cur.fetchall()
+            if any(r[2] not in self._coin_names or (r[8] is not None and r[8] not in self._builder_names) for r in rows):
+                await self._load_names(conn)
+        return rows
+
+    def get_all_fills(self, user: str) -> List[Any]:
+        return list(self.iter_fills(user))
+
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Any]:
+        # Keyset pagination: every page is an independent query, so no connection
+        # or server-side cursor is held while the consumer works through a batch.
+        after = None
+        while True:
+            rows = self._run(self._fetch_page(user, coin, from_ms, to_ms, after, batch_size))
+            if not rows:
+                return
+            yield from self._decode_rows(rows)
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][0], rows[-1][1])
+
+    def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
+        # Aggregated in SQL, only the top rows cross the wire
+        rows = self._run(self._fetchall(SQL_LEADERBOARD))
+        return [{
+            "user": r[0],
+            "metricValue": fixed_to_float(int(r[1])),
+            "tradeCount": r[2],
+        } for r in rows]
+
+    async def _fetchall(self, query: str, params: tuple = ()) -> List[tuple]:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(query, params)
+            return await cur.fetchall()
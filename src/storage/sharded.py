@@ -0,0 +1,118 @@
+import os
+import hashlib
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Optional, Iterator
+from .base import StorageBackend
+from .sqlite import SqliteStorage
+
+logger = logging.getLogger(__name__)
+
+SHARD_SETTING = "SHARD_LAYOUT"
+
+
+def shard_paths(db_path: str, shards: int) -> List[str]:
+    """hyperliquid.db -> hyperliquid.shard0.db, hyperliquid.shard1.db, ..."""
+    if db_path.startswith("sqlite:///"):
+        db_path = db_path.replace("sqlite:///", "")
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+
+class ShardedSqliteStorage(StorageBackend):
+    """Fills and funding spread over N SQLite files by address hash.
+
+    Each shard is a full SqliteStorage with its own file, WAL, connection
+    pool and group-commit writer, so syncs for users on different shards
+    never wait on the same write lock. A user always maps to the same shard;
+    per-user reads touch a single file and only the leaderboard fans out.
+
+    The shard count is recorded in every shard and checked on open: changing it
+    would silently strand users on their old shard.
+    """
+
+    caches_funding = True
+
+    def __init__(self, db_path: str, shards: int = 4, pool_size: int = 8,
+                 keep_raw: bool = False, archive_dir: str = None,
+                 group_commit: bool = True, group_commit_ms: float = 0.0, read_only: bool = False):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.shards: List[SqliteStorage] = []
+        for i, path in enumerate(shard_paths(db_path, shards)):
+            shard = SqliteStorage(
+                path,
+                pool_size=pool_size,
+                keep_raw=keep_raw,
+                archive_dir=os.path.join(archive_dir, f"shard{i}") if archive_dir else None,
+                group_commit=group_commit,
+                group_commit_ms=group_commit_ms,
+                read_only=read_only,
+            )
+            layout = f"{i}/{shards}"
+            recorded = shard.get_setting(SHARD_SETTING)
+            if recorded is None:
+                if not read_only:
+                    shard.set_setting(SHARD_SETTING, layout)
+            elif recorded != layout:
+                self.shards.append(shard)
+                self.close()
+                raise RuntimeError(f"{path} was created as shard {recorded}, not {layout}; resharding is not supported")
+            self.shards.append(shard)
+
+        self._fanout = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard-fanout")
+
+    def shard_for(self, user: str) -> SqliteStorage:
+        # Stable across processes and restarts, unlike hash()
+        digest = hashlib.blake2b(user.lower().encode(), digest_size=8).digest()
+        return self.shards[int.from_bytes(digest, "big") % len(self.shards)]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        if getattr(self, "_fanout", None):
+            self._fanout.shutdown(wait=False)
+
+    # --- Per-user, routed to one shard ---
+
+    def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
+        return self.shard_for(user).get_latest_timestamp(user, coin)
+
+    def save_fills(self, user: str, fills: List[Any]):
+        self.shard_for(user).save_fills(user, fills)
+
+    def get_all_fills(self, user: str) -> List[Any]:
+        return self.shard_for(user).get_all_fills(user)
+
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Any]:
+        return self.shard_for(user).iter_fills(user, coin, from_ms, to_ms, batch_size)
+
+    def get_raw_fills(self, user: str) -> List[Any]:
+        return self.shard_for(user).get_raw_fills(user)
+
+    def get_latest_funding_timestamp(self, user: str) -> Optional[int]:
+        return self.shard_for(user).get_latest_funding_timestamp(user)
+
+    def save_funding(self, user: str, funding: List[Any]):
+        self.shard_for(user).save_funding(user, funding)
+
+    def get_funding(self, user: str, from_ms: int = None, to_ms: int = None) -> List[Any]:
+        return self.shard_for(user).get_funding(user, from_ms, to_ms)
+
+    # --- Fan-out ---
+
+    def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
+        # Users live on exactly one shard, so each shard's top 50 is exact for
+        # its users and the global top 50 is among their union.
+        results = self._fanout.map(lambda shard: shard.get_leaderboard_stats(metric), self.shards)
+        merged = [row for rows in results for row in rows]
+        return heapq.nlargest(50, merged, key=lambda r: r["metricValue"])
+
+    @property
+    def has_archive(self) -> bool:
+        return all(shard.has_archive for shard in self.shards)
+
+    def archive_cold_fills(self, older_than_ms: int) -> int:
+        return sum(self._fanout.map(lambda shard: shard.archive_cold_fills(older_than_ms), self.shards))
@@ -1,225 +1,806 @@
 import sqlite3
 import json
-from typing import List, Any, Optional
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import List, Any, Optional, Dict, Iterator, Tuple
 from .base import StorageBackend
+from .archive import FillArchive
+from ..metrics import STORAGE_SECONDS, timed_storage
+from .codec import (
+    to_fixed, fixed_to_str_cached, fixed_to_float, encode_side, decode_side,
+    fill_builder, fill_tid, funding_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Connection tuning applied once per pooled connection.
+# journal_mode is persistent on the file, the rest are per-connection.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",   # 256MB memory-mapped reads
+    "PRAGMA cache_size=-65536",     # 64MB page cache (negative = KiB)
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Statements are kept as module constants so sqlite3's per-connection
+# statement cache can reuse the prepared statement across calls.
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA_VERSION = 3
+
+SQL_USER_ID = 'SELECT id FROM fill_users WHERE address = ?'
+SQL_LATEST_TS = 'SELECT MAX(time) FROM fills WHERE user_id = ?'
+SQL_LATEST_TS_COIN = 'SELECT MAX(time) FROM fills WHERE user_id = ? AND coin_id = ?'
+SQL_INSERT_FILL = '''
+    INSERT OR IGNORE INTO fills (user_id, time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_RAW = 'INSERT OR IGNORE INTO fills_raw (user_id, tid, raw_json) VALUES (?, ?, ?)'
+FILL_COLUMNS = 'time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id'
+SQL_ALL_FILLS = f'SELECT {FILL_COLUMNS} FROM fills WHERE user_id = ? ORDER BY time, tid'
+SQL_GET_SETTING = 'SELECT value FROM app_settings WHERE key = ?'
+SQL_SET_SETTING = 'INSERT OR REPLACE INTO app_settings (key, value) VALUES (?, ?)'
+SQL_LATEST_FUNDING = 'SELECT MAX(time) FROM funding WHERE user_id = ?'
+SQL_INSERT_FUNDING = 'INSERT OR IGNORE INTO funding (user_id, time, event_key, raw_json) VALUES (?, ?, ?, ?)'
+SQL_COLD_FILLS = f'SELECT {FILL_COLUMNS} FROM fills WHERE user_id = ? AND time > ? AND time < ? ORDER BY time, tid LIMIT ?'
+SQL_COLD_FILLS_FIRST = f'SELECT {FILL_COLUMNS} FROM fills WHERE user_id = ? AND time < ? ORDER BY time, tid LIMIT ?'
+SQL_COLD_FILLS_REST_OF_MS = f'SELECT {FILL_COLUMNS} FROM fills WHERE user_id = ? AND time = ? AND tid > ? ORDER BY tid'
+SQL_DELETE_COLD = 'DELETE FROM fills WHERE user_id = ? AND time < ?'
+SQL_HOT_TOTALS_AFTER = 'SELECT COALESCE(SUM(closed_pnl), 0), COUNT(*) FROM fills WHERE user_id = ? AND time > ?'
+
+# Most fills written to one archive segment, and read in one write transaction
+ARCHIVE_SEGMENT_ROWS = 100_000
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived sqlite3 connections.
+
+    Connections are created lazily up to `size`, tuned with PRAGMAS once,
+    and handed out LIFO so the hottest connection (warm page cache) is reused.
+    """
+
+    def __init__(self, file_path: str, size: int = 8, timeout: float = 30.0, read_only: bool = False):
+        self.file_path = file_path
+        self.size = size
+        self.read_only = read_only
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            target, uri = f"file:{urllib.parse.quote(self.file_path)}?mode=ro", True
+        else:
+            target, uri = self.file_path, False
+        conn = sqlite3.connect(
+            target,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            uri=uri,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Pool exhausted, wait for a connection to be returned
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No sqlite connection free after {self.timeout}s, all {self.size} "
+                f"of {self.file_path} are in use"
+            ) from None
+
+    def _release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection. Commits on success, rolls back on error."""
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                # Connection is unusable (e.g. disk I/O error), don't recycle it
+                self._discard(conn)
+                raise
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class GroupCommitWriter:
+    """Single writer thread that folds concurrent save_fills calls into shared transactions.
+
+    Whatever queued up while the previous transaction was committing goes into
+    the next one (up to `max_rows`), so batches grow with load without adding
+    latency when idle. `max_delay_ms` additionally holds a batch open for
+    late joiners, which only pays off when commits are expensive.
+    Each caller gets a Future that resolves once its rows are committed. If a
+    batch fails, its requests are retried one transaction each so a bad
+    payload only fails its own caller.
+    """
+
+    def __init__(self, storage: "SqliteStorage", max_delay_ms: float = 0.0, max_rows: int = 50000):
+        self.storage = storage
+        self.max_delay = max_delay_ms / 1000
+        self.max_rows = max_rows
+        self.batches = 0
+        self.requests = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user: str, fills: List[Any]) -> Future:
+        if self._closed:
+            raise RuntimeError("Writer is closed")
+        future: Future = Future()
+        self._queue.put((user, fills, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, rows = [item], len(item[1])
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while rows < self.max_rows:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                rows += len(item[1])
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[tuple]):
+        batch = [b for b in batch if b[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            logger.warning(f"Group commit of {len(batch)} requests failed ({e}), retrying individually")
+            for request in batch:
+                try:
+                    self._write([request])
+                except Exception as e:
+                    request[2].set_exception(e)
+                else:
+                    request[2].set_result(len(request[1]))
+            return
+        for _, fills, future in batch:
+            future.set_result(len(fills))
+
+    def _write(self, batch: List[tuple]):
+        storage = self.storage
+        try:
+            with storage.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for user, fills, _ in batch:
+                    storage._insert_fills(conn, user, fills)
+        except Exception:
+            # Ids interned inside the rolled back transaction are not durable
+            storage._reset_interned()
+            raise
+        self.batches += 1
+        self.requests += len(batch)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
 
 class SqliteStorage(StorageBackend):
-    def __init__(self, db_path: str):
-        # db_path is expected to be like "sqlite:///hyperliquid.db" 
+    caches_funding = True
+
+    def __init__(self, db_path: str, pool_size: int = 8, keep_raw: bool = False, archive_dir: str = None,
+                 group_commit: bool = True, group_commit_ms: float = 0.0, read_only: bool = False):
+        # db_path is expected to be like "sqlite:///hyperliquid.db"
         # extract path part
         if db_path.startswith("sqlite:///"):
             self.file_path = db_path.replace("sqlite:///", "")
         else:
             self.file_path = db_path
-            
-        self._init_db()
+
+        self.keep_raw = keep_raw
+        self.pool = ConnectionPool(self.file_path, size=pool_size, read_only=read_only)
+        # Cold tier: fills at or before a user's archive watermark live in segment files
+        self.archive = FillArchive(archive_dir) if archive_dir else None
+
+        # Interned id caches. Ids never change once assigned, so these only grow.
+        self._user_ids: Dict[str, int] = {}
+        self._coin_ids: Dict[str, int] = {}
+        self._builder_ids: Dict[str, int] = {}
+        self._coin_names: Dict[int, str] = {}
+        self._builder_names: Dict[int, str] = {}
+
+        # Read-only opens (replay workers) rely on the schema set up by the writing process
+        if not read_only:
+            self._init_db()
+
+        # Fill ingestion goes through one writer thread that batches callers into shared transactions
+        self.writer = GroupCommitWriter(self, max_delay_ms=group_commit_ms) if group_commit and not read_only else None
+
+    def close(self):
+        """Close all pooled connections."""
+        if self.writer:
+            self.writer.close()
+        self.pool.close()
+        if self.archive:
+            self.archive.close()
 
     def _init_db(self):
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        # Create Fills Table
-        # Store bare minimum raw data + indexed columns for queries
-        c.execute('''
+        with self.pool.connection() as conn:
+            # IMMEDIATE so concurrent workers starting up serialize on the schema check
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            columns = [r[1] for r in conn.execute("PRAGMA table_info(fills)")]
+
+            if "raw_json" in columns:
+                # v1 schema: TEXT ids, TEXT amounts and the whole fill as JSON
+                conn.execute("ALTER TABLE fills RENAME TO fills_legacy")
+                conn.execute("DROP INDEX IF EXISTS idx_user_time")
+                conn.execute("DROP INDEX IF EXISTS idx_user_coin")
+
+            self._create_fill_tables(conn)
+
+            if "raw_json" in columns:
+                self._migrate_legacy_fills(conn)
+                conn.execute("DROP TABLE fills_legacy")
+
+            # api_keys and request_logs are managed by SQLAlchemy in database.py
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS app_settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+
+            if version != SCHEMA_VERSION:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _create_fill_tables(self, conn: sqlite3.Connection):
+        # Interned dimension tables keep the fact table narrow
+        conn.execute('CREATE TABLE IF NOT EXISTS fill_users (id INTEGER PRIMARY KEY, address TEXT NOT NULL UNIQUE)')
+        conn.execute('CREATE TABLE IF NOT EXISTS fill_coins (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+        conn.execute('CREATE TABLE IF NOT EXISTS fill_builders (id INTEGER PRIMARY KEY, address TEXT NOT NULL UNIQUE)')
+
+        # Fills: integer time, 1e8 fixed-point amounts, side as +1/-1.
+        # Keyed by (user, time, tid) without a rowid, so a user's history is stored
+        # contiguously in time order and a replay is a single clustered range scan.
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS fills (
-                id TEXT PRIMARY KEY, 
-                user TEXT,
-                coin TEXT,
-                time INTEGER,
-                closedPnl TEXT,
-                fee TEXT,
-                builder TEXT,
-                raw_json TEXT
-            )
+                user_id INTEGER NOT NULL,
+                time INTEGER NOT NULL,
+                tid INTEGER NOT NULL,
+                coin_id INTEGER NOT NULL,
+                side INTEGER NOT NULL,
+                sz INTEGER NOT NULL,
+                px INTEGER NOT NULL,
+                fee INTEGER NOT NULL,
+                closed_pnl INTEGER NOT NULL,
+                builder_id INTEGER,
+                PRIMARY KEY (user_id, time, tid)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_fills_user_coin ON fills (user_id, coin_id, time)')
+
+        # Funding events are few (one per position per hour) and passed to the
+        # replay verbatim, so they are kept as JSON keyed for idempotent syncs
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS funding (
+                user_id INTEGER NOT NULL,
+                time INTEGER NOT NULL,
+                event_key TEXT NOT NULL,
+                raw_json TEXT NOT NULL,
+                PRIMARY KEY (user_id, time, event_key)
+            ) WITHOUT ROWID
         ''')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_user_time ON fills (user, time)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_user_coin ON fills (user, coin)')
-
-        # New SaaS Tables
-        # api_keys is managed by SQLAlchemy in database.py
-        # c.execute('''
-        #     CREATE TABLE IF NOT EXISTS api_keys (
-        #         key TEXT PRIMARY KEY,
-        #         name TEXT,
-        #         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        #         is_active BOOLEAN DEFAULT 1
-        #     )
-        # ''')
-
-        # request_logs is now managed by SQLAlchemy in database.py
-        # c.execute('''
-        #     CREATE TABLE IF NOT EXISTS request_logs (
-        #         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        #         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        #         endpoint TEXT,
-        #         status_code INTEGER,
-        #         latency_ms REAL,
-        #         api_key TEXT,
-        #         user_addr TEXT
-        #     )
-        # ''')
-        # c.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON request_logs (timestamp)')
-
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS app_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
+
+        # Optional raw upstream payloads, never read on the replay path
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fills_raw (
+                user_id INTEGER NOT NULL,
+                tid INTEGER NOT NULL,
+                raw_json TEXT NOT NULL,
+                PRIMARY KEY (user_id, tid)
+            ) WITHOUT ROWID
         ''')
 
-        conn.commit()
-        conn.close()
+    def _migrate_legacy_fills(self, conn: sqlite3.Connection, batch_size: int = 5000):
+        legacy = conn.execute('SELECT user, raw_json FROM fills_legacy ORDER BY user, time')
+        migrated = 0
+        while True:
+            rows = legacy.fetchmany(batch_size)
+            if not rows:
+                break
+            by_user: Dict[str, List[Any]] = {}
+            for user, raw in rows:
+                by_user.setdefault(user, []).append(json.loads(raw))
+            for user, fills in by_user.items():
+                self._insert_fills(conn, user, fills)
+            migrated += len(rows)
+        logger.info(f"Migrated {migrated} fills to typed schema v{SCHEMA_VERSION}")
+
+    # --- Interning ---
+
+    def _intern(self, conn: sqlite3.Connection, table: str, column: str, cache: Dict[str, int], value: str) -> int:
+        value_id = cache.get(value)
+        if value_id is None:
+            conn.execute(f'INSERT OR IGNORE INTO {table} ({column}) VALUES (?)', (value,))
+            value_id = conn.execute(f'SELECT id FROM {table} WHERE {column} = ?', (value,)).fetchone()[0]
+            cache[value] = value_id
+        return value_id
+
+    def _user_id(self, conn: sqlite3.Connection, user: str) -> Optional[int]:
+        user_id = self._user_ids.get(user)
+        if user_id is None:
+            row = conn.execute(SQL_USER_ID, (user,)).fetchone()
+            if row:
+                user_id = self._user_ids[user] = row[0]
+        return user_id
+
+    def _coin_id(self, conn: sqlite3.Connection, coin: str) -> Optional[int]:
+        coin_id = self._coin_ids.get(coin)
+        if coin_id is None:
+            row = conn.execute('SELECT id FROM fill_coins WHERE name = ?', (coin,)).fetchone()
+            if row:
+                coin_id = self._coin_ids[coin] = row[0]
+        return coin_id
+
+    def _reset_interned(self):
+        self._user_ids, self._coin_ids, self._builder_ids = {}, {}, {}
+
+    def _load_names(self, conn: sqlite3.Connection):
+        self._coin_names = dict(conn.execute('SELECT id, name FROM fill_coins'))
+        self._builder_names = dict(conn.execute('SELECT id, address FROM fill_builders'))
 
     # --- SaaS Methods ---
 
     def create_api_key(self, key: str, name: str):
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('INSERT INTO api_keys (key, name) VALUES (?, ?)', (key, name))
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute('INSERT INTO api_keys (key, name) VALUES (?, ?)', (key, name))
 
     def get_api_key(self, key: str) -> Optional[dict]:
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('SELECT key, name, is_active FROM api_keys WHERE key = ?', (key,))
-        row = c.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT key, name, is_active FROM api_keys WHERE key = ?', (key,)).fetchone()
         if row:
             return {"key": row[0], "name": row[1], "is_active": bool(row[2])}
         return None
-    
+
     def log_request(self, endpoint: str, status_code: int, latency_ms: float, api_key: str = None, user_addr: str = None):
         # Fire and forget logging (blocking for sqlite but fast enough)
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO request_logs (endpoint, status_code, latency_ms, api_key, user_addr)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (endpoint, status_code, latency_ms, api_key, user_addr))
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO request_logs (endpoint, status_code, latency_ms, api_key, user_addr)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (endpoint, status_code, latency_ms, api_key, user_addr))
 
     def get_setting(self, key: str) -> Optional[str]:
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('SELECT value FROM app_settings WHERE key = ?', (key,))
-        row = c.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            row = conn.execute(SQL_GET_SETTING, (key,)).fetchone()
         return row[0] if row else None
 
     def set_setting(self, key: str, value: str):
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('INSERT OR REPLACE INTO app_settings (key, value) VALUES (?, ?)', (key, value))
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute(SQL_SET_SETTING, (key, value))
 
+    @timed_storage("sqlite")
     def get_latest_timestamp(self, user: str, coin: str = None) -> Optional[int]:
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        if coin:
-            c.execute('SELECT MAX(time) FROM fills WHERE user = ? AND coin = ?', (user, coin))
-        else:
-            c.execute('SELECT MAX(time) FROM fills WHERE user = ?', (user,))
-        row = c.fetchone()
-        conn.close()
-        return row[0] if row and row[0] else 0
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return 0
+            if coin:
+                coin_id = self._coin_id(conn, coin)
+                if coin_id is None:
+                    return 0
+                row = conn.execute(SQL_LATEST_TS_COIN, (user_id, coin_id)).fetchone()
+            else:
+                row = conn.execute(SQL_LATEST_TS, (user_id,)).fetchone()
+        if row and row[0]:
+            return row[0]
+        # Hot rows are always newer than the archive, only fall back when there are none
+        return self.archive.latest_time(user, coin) if self.archive else 0
+
+    def _insert_fills(self, conn: sqlite3.Connection, user: str, fills: List[Any]):
+        user_id = self._intern(conn, 'fill_users', 'address', self._user_ids, user)
 
-    def save_fills(self, user: str, fills: List[Any]):
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        
         data_to_insert = []
+        raw_to_insert = []
         for fill in fills:
-            tid = fill.get('tid') or fill.get('oid') or f"{fill['time']}_{fill['coin']}_{fill['sz']}"
-            row_id = f"{user}_{tid}"
-            
-            # Extract analytics columns
-            closed_pnl = str(fill.get('closedPnl', '0.0'))
-            fee = str(fill.get('fee', '0.0'))
-            builder = fill.get('builder') or (fill.get('builderInfo') or {}).get('builder')
-            
+            tid = fill_tid(fill)
+            builder = fill_builder(fill)
             data_to_insert.append((
-                row_id,
-                user,
-                fill.get('coin'),
-                fill['time'],
-                closed_pnl,
-                fee,
-                builder,
-                json.dumps(fill)
+                user_id,
+                int(fill['time']),
+                tid,
+                self._intern(conn, 'fill_coins', 'name', self._coin_ids, fill.get('coin')),
+                encode_side(fill.get('side')),
+                to_fixed(fill.get('sz')),
+                to_fixed(fill.get('px')),
+                to_fixed(fill.get('fee')),
+                to_fixed(fill.get('closedPnl')),
+                self._intern(conn, 'fill_builders', 'address', self._builder_ids, builder) if builder else None,
             ))
-            
-        c.executemany('''
-            INSERT OR IGNORE INTO fills (id, user, coin, time, closedPnl, fee, builder, raw_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', data_to_insert)
-        
-        conn.commit()
-        conn.close()
+            if self.keep_raw:
+                raw_to_insert.append((user_id, tid, json.dumps(fill)))
+
+        conn.executemany(SQL_INSERT_FILL, data_to_insert)
+        if raw_to_insert:
+            conn.executemany(SQL_INSERT_RAW, raw_to_insert)
+
+    @timed_storage("sqlite")
+    def save_fills(self, user: str, fills: List[Any]):
+        if not fills:
+            return
+        if self.archive:
+            watermark = self.archive.watermark(user)
+            if watermark is not None:
+                # Already archived, the archive is immutable
+                fills = [f for f in fills if int(f['time']) > watermark]
+                if not fills:
+                    return
+        if self.writer:
+            self.writer.submit(user, fills).result()
+            return
+        self._save_direct(user, fills)
+
+    def submit_fills(self, user: str, fills: List[Any]) -> Future:
+        """Queue fills for the next group commit, the Future resolves once they are committed."""
+        if not self.writer:
+            future: Future = Future()
+            try:
+                self.save_fills(user, fills)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(len(fills))
+            return future
+        return self.writer.submit(user, fills)
 
+    def _save_direct(self, user: str, fills: List[Any]):
+        try:
+            with self.pool.connection() as conn:
+                self._insert_fills(conn, user, fills)
+        except Exception:
+            # Ids interned inside the rolled back transaction are not durable
+            self._reset_interned()
+            raise
+
+    def _decode_rows(self, conn: sqlite3.Connection, rows: List[tuple]) -> List[Dict[str, Any]]:
+        as_str = fixed_to_str_cached
+        coin_names = self._coin_names
+        builder_names = self._builder_names
+        out = []
+        for time, tid, coin_id, side, sz, px, fee, closed_pnl, builder_id in rows:
+            coin = coin_names.get(coin_id)
+            if coin is None or (builder_id is not None and builder_id not in builder_names):
+                # Interned by another process since we last looked
+                self._load_names(conn)
+                coin_names, builder_names = self._coin_names, self._builder_names
+                coin = coin_names.get(coin_id)
+            out.append({
+                "coin": coin,
+                "side": decode_side(side),
+                "sz": as_str(sz),
+                "px": as_str(px),
+                "time": time,
+                "fee": as_str(fee),
+                "closedPnl": as_str(closed_pnl),
+                "builder": builder_names.get(builder_id) if builder_id is not None else None,
+                "tid": tid,
+            })
+        return out
+
+    @timed_storage("sqlite")
     def get_all_fills(self, user: str) -> List[Any]:
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('SELECT raw_json FROM fills WHERE user = ? ORDER BY time ASC', (user,))
-        rows = c.fetchall()
-        conn.close()
+        if self.archive:
+            return list(self.iter_fills(user))
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return []
+            rows = conn.execute(SQL_ALL_FILLS, (user_id,)).fetchall()
+            return self._decode_rows(conn, rows)
+
+    def iter_fills(self, user: str, coin: str = None, from_ms: int = None, to_ms: int = None,
+                   batch_size: int = 5000) -> Iterator[Any]:
+        watermark = None
+        if self.archive:
+            watermark = self.archive.watermark(user)
+            if watermark is not None and (from_ms is None or from_ms <= watermark):
+                # Cold segments first, they hold everything up to the watermark
+                yield from self.archive.iter_fills(user, coin, from_ms, to_ms, batch_size)
+                if to_ms is not None and to_ms <= watermark:
+                    return
+
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return
+            coin_id = self._coin_id(conn, coin) if coin else None
+            if coin and coin_id is None:
+                return
+
+        where = ['user_id = ?']
+        params: List[Any] = [user_id]
+        if watermark is not None:
+            # Rows left behind by an interrupted archive run are already in a segment
+            where.append('time > ?')
+            params.append(watermark)
+        if coin_id is not None:
+            # Served by idx_fills_user_coin (user_id, coin_id, time)
+            where.append('coin_id = ?')
+            params.append(coin_id)
+        if from_ms is not None:
+            where.append('time >= ?')
+            params.append(from_ms)
+        if to_ms is not None:
+            where.append('time <= ?')
+            params.append(to_ms)
+        query = f'SELECT {FILL_COLUMNS} FROM fills WHERE {" AND ".join(where)}'
+        first_page = f'{query} ORDER BY time, tid LIMIT ?'
+        next_page = f'{query} AND (time, tid) > (?, ?) ORDER BY time, tid LIMIT ?'
+
+        # Keyset pagination: every batch is its own query on a borrowed connection,
+        # so no connection is held while the consumer (a replay, a slow export
+        # download) works through a batch.
+        observe = STORAGE_SECONDS.labels("sqlite", "iter_fills").observe
+        after = None
+        while True:
+            start = time.perf_counter()
+            with self.pool.connection() as conn:
+                if after is None:
+                    rows = conn.execute(first_page, (*params, batch_size)).fetchall()
+                else:
+                    rows = conn.execute(next_page, (*params, *after, batch_size)).fetchall()
+                if not rows:
+                    return
+                batch = self._decode_rows(conn, rows)
+            observe(time.perf_counter() - start)
+            yield from batch
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][0], rows[-1][1])
+
+    @property
+    def has_archive(self) -> bool:
+        return self.archive is not None
+
+    @timed_storage("sqlite")
+    def archive_cold_fills(self, older_than_ms: int) -> int:
+        """Move fills older than older_than_ms into the archive. Returns the number of fills moved."""
+        if not self.archive:
+            raise RuntimeError("Archive is not configured (ARCHIVE_DIR)")
+
+        with self.pool.connection() as conn:
+            users = conn.execute('SELECT id, address FROM fill_users').fetchall()
+
+        moved = 0
+        for user_id, address in users:
+            full = True
+            while full:
+                count, full = self._archive_segment(user_id, address, older_than_ms)
+                moved += count
+
+        logger.info(f"Archived {moved} fills older than {older_than_ms}")
+        return moved
+
+    def _archive_segment(self, user_id: int, address: str, older_than_ms: int) -> Tuple[int, bool]:
+        """Move the user's next ARCHIVE_SEGMENT_ROWS cold fills into a segment.
+        Returns the number moved and whether more may be left."""
+        # One write transaction per segment so live inserts are only blocked briefly
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            watermark = self.archive.watermark(address)
+            if watermark is None:
+                rows = conn.execute(SQL_COLD_FILLS_FIRST, (user_id, older_than_ms, ARCHIVE_SEGMENT_ROWS)).fetchall()
+            else:
+                rows = conn.execute(SQL_COLD_FILLS, (user_id, watermark, older_than_ms, ARCHIVE_SEGMENT_ROWS)).fetchall()
+            full = len(rows) == ARCHIVE_SEGMENT_ROWS
+            delete_before = older_than_ms
+            if full:
+                # The watermark is a time, so a segment takes all fills of its last millisecond
+                last_time, last_tid = rows[-1][0], rows[-1][1]
+                rows += conn.execute(SQL_COLD_FILLS_REST_OF_MS, (user_id, last_time, last_tid)).fetchall()
+                delete_before = last_time + 1
+            if rows:
+                self._load_names(conn)
+                # Publish the segment before deleting: if we crash in between,
+                # reads skip the leftover rows via the watermark.
+                self.archive.write_segment(address, rows, self._coin_names, self._builder_names)
+            conn.execute(SQL_DELETE_COLD, (user_id, delete_before))
+        return len(rows), full
+
+    # --- Funding ---
+
+    @timed_storage("sqlite")
+    def get_latest_funding_timestamp(self, user: str) -> Optional[int]:
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return 0
+            row = conn.execute(SQL_LATEST_FUNDING, (user_id,)).fetchone()
+        return row[0] if row and row[0] else 0
+
+    @timed_storage("sqlite")
+    def save_funding(self, user: str, funding: List[Any]):
+        if not funding:
+            return
+        try:
+            with self.pool.connection() as conn:
+                user_id = self._intern(conn, 'fill_users', 'address', self._user_ids, user)
+                conn.executemany(SQL_INSERT_FUNDING, [
+                    (user_id, int(event['time']), funding_key(event), json.dumps(event))
+                    for event in funding
+                ])
+        except Exception:
+            self._reset_interned()
+            raise
+
+    @timed_storage("sqlite")
+    def get_funding(self, user: str, from_ms: int = None, to_ms: int = None) -> List[Any]:
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return []
+            rows = conn.execute(
+                'SELECT raw_json FROM funding WHERE user_id = ? AND time BETWEEN ? AND ? ORDER BY time',
+                (user_id, from_ms if from_ms is not None else 0, to_ms if to_ms is not None else 2 ** 63 - 1),
+            ).fetchall()
         return [json.loads(r[0]) for r in rows]
 
+    def get_raw_fills(self, user: str) -> List[Any]:
+        """Original upstream payloads, only available when keep_raw is enabled."""
+        with self.pool.connection() as conn:
+            user_id = self._user_id(conn, user)
+            if user_id is None:
+                return []
+            rows = conn.execute('SELECT raw_json FROM fills_raw WHERE user_id = ? ORDER BY tid', (user_id,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    @timed_storage("sqlite")
     def get_leaderboard_stats(self, metric: str = "pnl") -> List[Any]:
         # Return composite stats for basic leaderboard stub
         # We aggregate by user.
-        # SQLite doesn't have Decimal type, so SUM() on text fields might be wonky without casting.
-        # However, for PnL ranking, simple float sum logic in SQL might be "good enough" for sorting?
-        # Or we fetch all users and sum in python? Fetching all is safer for exactness but slower.
-        # Let's try SQL sum.
-        
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        
-        # We need to sum fees and pnl.
-        # SQLite CAST(col as REAL) works for basic sorting.
+        # closed_pnl is 1e8 fixed-point, so SUM() is exact integer arithmetic.
         # NOTE: This ignores the sophisticated "Taint" logic for exclusion.
         # The Taint logic runs at Query-time (assembling lifecycles).
         # We cannot easily replicate "Lifecycle Taint" in pure SQLite Query without complex window functions.
         # Strategy: Fetch aggregated basics here, but for "Pure Builder Mode" accuracy,
         # we might need to load trades and re-run logic.
         # FOR NOW: Simple aggregation.
-        
+
         query = '''
-            SELECT 
-                user, 
-                SUM(CAST(closedPnl AS REAL)) as total_pnl, 
-                COUNT(*) as trade_count 
-            FROM fills 
-            GROUP BY user 
-            ORDER BY total_pnl DESC 
+            SELECT
+                u.address,
+                SUM(f.closed_pnl) as total_pnl,
+                COUNT(*) as trade_count
+            FROM fills f
+            JOIN fill_users u ON u.id = f.user_id
+            GROUP BY f.user_id
+            ORDER BY total_pnl DESC
             LIMIT 50
         '''
-        c.execute(query)
-        rows = c.fetchall()
-        conn.close()
-        
+        if self.archive:
+            rows = self._leaderboard_with_archive()
+        else:
+            with self.pool.connection() as conn:
+                rows = conn.execute(query).fetchall()
+
         # Structure: [{'user': ..., 'pnl': ..., 'count': ...}]
         results = []
         for r in rows:
             results.append({
                 "user": r[0],
-                "metricValue": r[1],
+                "metricValue": fixed_to_float(r[1]),
                 "tradeCount": r[2]
             })
         return results
-    
+
+    def _leaderboard_with_archive(self, limit: int = 50) -> List[tuple]:
+        # Archived users may have no hot rows left, so start from fill_users
+        query = '''
+            SELECT u.id, u.address, COALESCE(SUM(f.closed_pnl), 0), COUNT(f.user_id)
+            FROM fill_users u
+            LEFT JOIN fills f ON f.user_id = u.id
+            GROUP BY u.id
+        '''
+        with self.pool.connection() as conn:
+            hot = conn.execute(query).fetchall()
+
+        rows = []
+        for user_id, address, pnl, count in hot:
+            watermark = self.archive.watermark(address)
+            if watermark is not None:
+                # Rows an interrupted archive run left behind are already in a segment
+                with self.pool.connection() as conn:
+                    pnl, count = conn.execute(SQL_HOT_TOTALS_AFTER, (user_id, watermark)).fetchone()
+            # Segment headers carry the totals, no column data is touched
+            cold_pnl, cold_count = self.archive.totals(address)
+            if count + cold_count:
+                rows.append((address, pnl + cold_pnl, count + cold_count))
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows[:limit]
+
     def get_request_timeseries(self, duration: str = "24h") -> List[Any]:
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        
         # Format string for SQLite strftime
         # %Y-%m-%d %H:%M:%S
-        
+
         group_format = "%Y-%m-%d %H:00:00" # Default hourly
         delta = "-1 day"
-        
+
         if duration == "1h":
             group_format = "%Y-%m-%d %H:%M:00"
             delta = "-1 hour"
@@ -232,17 +813,40 @@ class SqliteStorage(StorageBackend):
         elif duration == "30d":
             group_format = "%Y-%m-%d"
             delta = "-30 days"
-            
+
         query = f'''
-            SELECT strftime('{group_format}', created_at) as bucket, COUNT(*) 
-            FROM request_logs 
+            SELECT strftime('{group_format}', created_at) as bucket, COUNT(*)
+            FROM request_logs
             WHERE created_at >= datetime('now', '{delta}')
-            GROUP BY bucket 
+            GROUP BY bucket
             ORDER BY bucket ASC
         '''
-        
-        c.execute(query)
-        rows = c.fetchall()
-        conn.close()
-        
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(query).fetchall()
+
         return [{"name": r[0], "val": r[1]} for r in rows]
+
+
+# One storage instance (and therefore one pool) per database per process.
+_shared_storages: Dict[str, SqliteStorage] = {}
+_shared_lock = threading.Lock()
+
+def get_shared_storage(db_path: str) -> SqliteStorage:
+    """Return the process-wide SqliteStorage for db_path, creating it once."""
+    storage = _shared_storages.get(db_path)
+    if storage is None:
+        with _shared_lock:
+            storage = _shared_storages.get(db_path)
+            if storage is None:
+                from ..config import settings
+                storage = SqliteStorage(
+                    db_path,
+                    pool_size=settings.SQLITE_POOL_SIZE,
+                    keep_raw=settings.STORE_RAW_FILLS,
+                    archive_dir=settings.ARCHIVE_DIR or None,
+                    group_commit=settings.SQLITE_GROUP_COMMIT,
+                    group_commit_ms=settings.SQLITE_GROUP_COMMIT_MS,
+                )
+                _shared_storages[db_path] = storage
+    return storage
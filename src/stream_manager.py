@@ -1,10 +1,11 @@
 import asyncio
 import json
 import logging
-from typing import Dict, List, Any
+from typing import Dict, List, Set, Any
 from fastapi import WebSocket
 from hyperliquid.info import Info
 from hyperliquid.utils.types import Any
+from .metrics import WEBSOCKET_SUBSCRIBERS, WEBSOCKET_UPSTREAM_SUBSCRIPTIONS
 
 class StreamManager:
     _instance = None
@@ -21,7 +22,8 @@ class StreamManager:
             
         self.active_connections: Dict[str, List[WebSocket]] = {}
         self._info = None
-        self.subscriptions: List[str] = []
+        # Addresses subscribed upstream; never unsubscribed, so reconnects reuse them
+        self.subscriptions: Set[str] = set()
         self._initialized = True
         self.logger = logging.getLogger("StreamManager")
         self.logger.setLevel(logging.INFO)
@@ -39,10 +41,14 @@ class StreamManager:
         
         if address not in self.active_connections:
             self.active_connections[address] = []
+        if address not in self.subscriptions:
             # Subscribe to Upstream if first client
             self._subscribe_upstream(address)
+            self.subscriptions.add(address)
+            WEBSOCKET_UPSTREAM_SUBSCRIPTIONS.set(len(self.subscriptions))
             
         self.active_connections[address].append(websocket)
+        WEBSOCKET_SUBSCRIBERS.inc()
         self.logger.info(f"Client connected for {address}. Total: {len(self.active_connections[address])}")
 
     def disconnect(self, websocket: WebSocket, address: str):
@@ -50,13 +56,15 @@ class StreamManager:
         if address in self.active_connections:
             if websocket in self.active_connections[address]:
                 self.active_connections[address].remove(websocket)
+                WEBSOCKET_SUBSCRIBERS.dec()
             
             if not self.active_connections[address]:
                 del self.active_connections[address]
                 # Optional: Unsubscribe upstream to save bandwidth?
                 # info.unsubscribe not always exposed cleanly or robustly in simple SDKs,
                 # but we can try if implemented.
-                # For now, keeping the subscription open is safer than flapping.
+                # For now, keeping the subscription open is safer than flapping;
+                # it stays in self.subscriptions and is reused on reconnect.
 
     def _subscribe_upstream(self, address: str):
         """Subscribe to Hyperliquid 'userFills' for the user."""
@@ -0,0 +1,306 @@
+import json
+import queue
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from .config import settings
+from .database import SessionLocal, RequestLog, RequestRollup, LatencyHistogramRow, SlowRequest
+from .histogram import LatencyHistogram
+from .metrics import status_class
+
+logger = logging.getLogger(__name__)
+
+POLICY_DROP = "drop"
+POLICY_SAMPLE = "sample"
+
+ADDITIVE_COLUMNS = ("count", "error_count", "latency_sum")
+RESOLUTIONS = ("m", "h", "d")
+
+PRUNE_INTERVAL_S = 3600
+
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    if resolution == "m":
+        return ts.replace(second=0, microsecond=0)
+    if resolution == "h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_rows(minutes: Dict[tuple, Dict[str, float]]) -> List[Dict[str, Any]]:
+    """Expand per-minute rollup deltas, keyed by (minute, endpoint, api key), into deltas for every resolution."""
+    rollups: Dict[tuple, Dict[str, Any]] = {}
+    for (minute, endpoint, api_key), deltas in minutes.items():
+        for resolution in RESOLUTIONS:
+            key = (resolution, bucket_start(minute, resolution), endpoint, api_key)
+            row = rollups.get(key)
+            if row is None:
+                row = rollups[key] = dict(zip(("resolution", "bucket_start", "endpoint", "api_key"), key))
+                row.update(dict.fromkeys(ADDITIVE_COLUMNS, 0))
+            for column, n in deltas.items():
+                row[column] += n
+    return list(rollups.values())
+
+
+def histogram_rows(histograms: Dict[tuple, LatencyHistogram]) -> List[Dict[str, Any]]:
+    """Expand per-minute histograms into latency_histograms deltas for every resolution."""
+    counts: Dict[tuple, int] = {}
+    for (minute, endpoint, status), histogram in histograms.items():
+        for resolution in RESOLUTIONS:
+            start = bucket_start(minute, resolution)
+            for index, n in histogram.counts.items():
+                key = (resolution, start, endpoint, status, index)
+                counts[key] = counts.get(key, 0) + n
+    fields = ("resolution", "bucket_start", "endpoint", "status_class", "bucket")
+    return [dict(zip(fields, key), count=n) for key, n in counts.items()]
+
+
+def _upsert_additive(db, model, keys: List[str], columns: tuple, rows: List[Dict[str, Any]]):
+    # INSERT .. ON CONFLICT DO UPDATE SET col = col + excluded.col
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={c: getattr(model, c) + stmt.excluded[c] for c in columns},
+    )
+    db.execute(stmt, rows)
+
+
+def upsert_rollups(db, rows: List[Dict[str, Any]]):
+    """Add rollup deltas onto existing rows."""
+    _upsert_additive(db, RequestRollup, ["resolution", "bucket_start", "endpoint", "api_key"], ADDITIVE_COLUMNS, rows)
+
+
+def upsert_histograms(db, rows: List[Dict[str, Any]]):
+    """Add histogram bucket counts onto existing rows, merging with other workers."""
+    _upsert_additive(db, LatencyHistogramRow, ["resolution", "bucket_start", "endpoint", "status_class", "bucket"], ("count",), rows)
+
+
+class RequestLogWriter:
+    """Buffers request logs in memory and bulk-inserts them from a background thread.
+
+    The request path only does a non-blocking put. Once started (at app
+    startup) the writer flushes every `flush_ms` or as soon as `batch_size`
+    rows are waiting: raw rows and the matching rollup deltas go in one
+    transaction. It also prunes raw rows and fine rollups past retention.
+
+    Rollup totals (per minute, endpoint and API key) and latency histograms
+    (per minute, endpoint and status class) are accumulated as requests are
+    logged, before any sampling or dropping, and written on every flush, so
+    the persisted counts and percentiles stay exact when raw rows are shed
+    under load.
+
+    Entries logged with `stages` (slow requests) also get a slow_requests row
+    with their stage breakdown.
+
+    When the queue fills up:
+      - "drop": new entries are discarded.
+      - "sample": past half full, only 1 in `sample_rate` successful requests
+        is kept (errors and slow requests are always kept while there is
+        room); at full, drop.
+    `dropped` counts what was discarded either way.
+    """
+
+    def __init__(self, max_size: int = 10000, flush_ms: float = 500, batch_size: int = 500,
+                 policy: str = POLICY_DROP, sample_rate: int = 10, session_factory=SessionLocal,
+                 retention_days: float = 7, minute_retention_days: float = 2, hour_retention_days: float = 90,
+                 clock=datetime.utcnow):
+        self.max_size = max_size
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.policy = policy
+        self.sample_rate = max(1, sample_rate)
+        self.session_factory = session_factory
+        # Stamps logged entries (and picks their rollup buckets), tests pin it
+        self.clock = clock
+        self.retention = {
+            "raw": timedelta(days=retention_days),
+            "m": timedelta(days=minute_retention_days),
+            "h": timedelta(days=hour_retention_days),
+        }
+        self._last_prune = 0.0
+
+        self.dropped = 0
+        self.written = 0
+        self._sampled = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_size)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._histograms: Dict[tuple, LatencyHistogram] = {}
+        self._rollups: Dict[tuple, Dict[str, float]] = {}
+        self._aggregate_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+                self._thread.start()
+
+    def log(self, endpoint: str, status_code: int, latency_ms: float,
+            api_key: str = None, user_addr: str = None,
+            stages: Dict[str, float] = None, query: str = None):
+        """Enqueue one request log. Never blocks."""
+        now = self.clock()
+        minute = bucket_start(now, "m")
+        key = (minute, endpoint, status_class(status_code))
+        with self._aggregate_lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.record(latency_ms)
+            rollup_key = (minute, endpoint, api_key or "")
+            deltas = self._rollups.get(rollup_key)
+            if deltas is None:
+                deltas = self._rollups[rollup_key] = dict.fromkeys(ADDITIVE_COLUMNS, 0)
+            deltas["count"] += 1
+            deltas["error_count"] += status_code >= 400
+            deltas["latency_sum"] += latency_ms
+
+        if (self.policy == POLICY_SAMPLE and status_code < 500 and stages is None
+                and self._queue.qsize() >= self.max_size // 2):
+            self._sampled += 1
+            if self._sampled % self.sample_rate:
+                self.dropped += 1
+                return
+
+        entry = {
+            "endpoint": endpoint,
+            "status_code": status_code,
+            "latency_ms": latency_ms,
+            "api_key": api_key,
+            "user_addr": user_addr,
+            # Stamped here, not at flush time
+            "created_at": now,
+        }
+        if stages is not None:
+            entry["slow"] = {"stages": json.dumps(stages), "query": query}
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self._last_prune >= PRUNE_INTERVAL_S:
+                self.prune()
+        self.flush()
+
+    def flush(self):
+        """Write everything currently queued, then the rollups and histograms recorded so far."""
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+        self._write_aggregates()
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        slow = []
+        for entry in batch:
+            extra = entry.pop("slow", None)
+            if extra is not None:
+                slow.append({**entry, **extra})
+
+        db = self.session_factory()
+        try:
+            # One executemany in one transaction for the whole batch
+            db.execute(insert(RequestLog), batch)
+            if slow:
+                db.execute(insert(SlowRequest), slow)
+            db.commit()
+            self.written += len(batch)
+        except Exception as e:
+            db.rollback()
+            self.dropped += len(batch)
+            logger.error(f"Failed to write {len(batch)} request logs: {e}")
+        finally:
+            db.close()
+
+    def _write_aggregates(self):
+        with self._aggregate_lock:
+            histograms, self._histograms = self._histograms, {}
+            rollups, self._rollups = self._rollups, {}
+        if not histograms and not rollups:
+            return
+        db = self.session_factory()
+        try:
+            upsert_rollups(db, rollup_rows(rollups))
+            upsert_histograms(db, histogram_rows(histograms))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to write {len(rollups)} request rollups and {len(histograms)} latency histograms: {e}")
+        finally:
+            db.close()
+
+    def prune(self, now: datetime = None):
+        """Delete raw and slow request logs, and minute/hour rollups and histograms, past their retention. Day rollups are kept."""
+        now = now or self.clock()
+        self._last_prune = time.monotonic()
+        db = self.session_factory()
+        try:
+            deleted = 0
+            for model in (RequestLog, SlowRequest):
+                deleted += db.query(model).filter(model.created_at < now - self.retention["raw"]).delete(synchronize_session=False)
+            for resolution in ("m", "h"):
+                for model in (RequestRollup, LatencyHistogramRow):
+                    deleted += db.query(model).filter(
+                        model.resolution == resolution,
+                        model.bucket_start < now - self.retention[resolution],
+                    ).delete(synchronize_session=False)
+            db.commit()
+            if deleted:
+                logger.info(f"Pruned {deleted} request log rows past retention")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Request log retention failed: {e}")
+        finally:
+            db.close()
+
+    def stop(self):
+        """Stop the thread after a final flush."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+request_log_writer = RequestLogWriter(
+    max_size=settings.TELEMETRY_QUEUE_SIZE,
+    flush_ms=settings.TELEMETRY_FLUSH_MS,
+    batch_size=settings.TELEMETRY_BATCH_SIZE,
+    policy=settings.TELEMETRY_QUEUE_POLICY,
+    sample_rate=settings.TELEMETRY_SAMPLE_RATE,
+    retention_days=settings.REQUEST_LOG_RETENTION_DAYS,
+    minute_retention_days=settings.ROLLUP_MINUTE_RETENTION_DAYS,
+    hour_retention_days=settings.ROLLUP_HOUR_RETENTION_DAYS,
+)
@@ -0,0 +1,101 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional
+
+# Per-request stage timings, rendered as a Server-Timing header.
+# RequestMiddleware starts a StageTimer for every request; code on the
+# request path wraps its stages in `with stage(...)`. Threads started with
+# asyncio.to_thread (or through AsyncStorage) inherit the context, so they
+# add to the same timer. Outside a request every helper is a no-op.
+#
+# Stages can nest and concurrent ones overlap (fills and funding sync in
+# parallel), so they are not expected to add up to the total.
+#
+# The timer also carries the request's work counts (fills replayed,
+# upstream calls, bytes sent), added with `count(...)` and charged against
+# the API key's quota once the request is done.
+
+
+class StageTimer:
+    __slots__ = ("stages", "counts", "start")
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.start = time.perf_counter()
+
+    def add(self, name: str, ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self, total_ms: float = None) -> str:
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed_ms() if total_ms is None else total_ms:.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[StageTimer]] = ContextVar("stage_timer", default=None)
+
+
+def begin() -> StageTimer:
+    """Start timing the current request."""
+    timer = StageTimer()
+    _current.set(timer)
+    return timer
+
+
+def current() -> Optional[StageTimer]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - start) * 1000)
+
+
+def count(name: str, n: int = 1):
+    timer = _current.get()
+    if timer is not None:
+        timer.count(name, n)
+
+
+def timed_iter(iterable: Iterable, name: str) -> Iterable:
+    """Wrap a lazy iterable so the time spent producing items counts as `name`.
+
+    The timer is captured here, so it keeps counting when the iterable is
+    consumed from another thread.
+    """
+    timer = _current.get()
+    if timer is None:
+        return iterable
+    return _timed(iter(iterable), name, timer)
+
+
+def _timed(it: Iterator, name: str, timer: StageTimer) -> Iterator:
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                spent += time.perf_counter() - start
+            yield item
+    finally:
+        timer.add(name, spent * 1000)
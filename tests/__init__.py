@@ -0,0 +1,4 @@
+import os
+
+# Keep test runs off the rate limit segment of a deployment on this host
+os.environ.setdefault("RATE_LIMIT_STORAGE_URI", "memory://")
@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from src.services import LedgerService
+from src.storage.sqlite import SqliteStorage
+from src.storage.async_storage import AsyncStorage
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "closedPnl": "0.0", "tid": 1},
+    {"coin": "BTC", "side": "A", "sz": "1.0", "px": "51000.0", "time": 2000, "fee": "5.0", "closedPnl": "1000.0", "tid": 2},
+]
+FUNDING = [{"coin": "BTC", "time": 1500, "usdc": "-3.0", "hash": "0x1"}]
+
+class BarrierDataSource:
+    """Fills and funding fetches only complete if they run at the same time."""
+    def __init__(self):
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def get_user_fills(self, address, since=0):
+        self.barrier.wait()
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        self.barrier.wait()
+        return [f for f in FUNDING if start <= f["time"] <= end]
+
+    def get_all_mids(self):
+        return {}
+
+class SerialDataSource(BarrierDataSource):
+    def __init__(self):
+        pass
+
+    def get_user_fills(self, address, since=0):
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        return [f for f in FUNDING if start <= f["time"] <= end]
+
+class TestAsyncService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = SqliteStorage(os.path.join(self.tmp.name, "async.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    async def test_syncs_fills_and_funding_concurrently(self):
+        service = LedgerService(BarrierDataSource(), storage=self.storage)
+        pnl = await service.get_pnl_async("0xA", builder_only=False)
+        service.close()
+
+        self.assertEqual(pnl.realizedPnl, Decimal("1000"))
+        self.assertEqual(pnl.fundingPaid, Decimal("-3"))
+        self.assertEqual(self.storage.get_latest_timestamp("0xA"), 2000)
+        self.assertEqual(self.storage.get_latest_funding_timestamp("0xA"), 1500)
+
+    async def test_matches_sync_entry_points(self):
+        service = LedgerService(SerialDataSource(), storage=self.storage)
+        self.assertEqual(await service.get_trades_async("0xA"), service.get_trades("0xA"))
+        self.assertEqual(await service.get_pnl_history_async("0xA"), service.get_pnl_history("0xA"))
+        self.assertEqual(await service.get_position_history_async("0xA"), service.get_position_history("0xA"))
+        service.close()
+
+        # No storage: upstream only
+        service = LedgerService(SerialDataSource())
+        self.assertEqual(await service.get_pnl_async("0xA"), service.get_pnl("0xA"))
+
+    async def test_async_storage_iter_fills(self):
+        self.storage.save_fills("0xA", [dict(f, tid=i, time=i) for i, f in enumerate(FILLS * 5)])
+        astorage = AsyncStorage(self.storage, max_workers=2)
+        times = [f["time"] async for f in astorage.iter_fills("0xA", batch_size=3)]
+        astorage.close()
+        self.assertEqual(times, list(range(10)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from src.database import Base
+from src import cache as cache_module
+from src.cache import VersionedCache, bump_version, read_version
+from src.config import settings
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestVersionedCache(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.clock = FakeClock()
+        self.loads = 0
+
+    def cache(self, **kwargs):
+        return VersionedCache("keys", ttl_s=60, check_interval_s=1, session_factory=self.Session,
+                              clock=self.clock, **kwargs)
+
+    def loader(self, value):
+        def load():
+            self.loads += 1
+            return value
+        return load
+
+    def bump(self):
+        db = self.Session()
+        try:
+            bump_version(db, "keys")
+            db.commit()
+        finally:
+            db.close()
+
+    def test_hits_and_ttl(self):
+        cache = self.cache()
+        self.assertEqual(cache.get("a", self.loader(1)), 1)
+        self.assertEqual(cache.get("a", self.loader(2)), 1)
+        # Misses are cached too
+        self.assertIsNone(cache.get("b", self.loader(None)))
+        self.assertIsNone(cache.get("b", self.loader("late")))
+        self.assertEqual(self.loads, 2)
+
+        self.clock.now += 61
+        self.assertEqual(cache.get("a", self.loader(2)), 2)
+        self.assertEqual(self.loads, 3)
+
+    def test_peek_never_blocks(self):
+        cache = self.cache()
+        missing = object()
+        # Nothing cached and the version not read yet
+        self.assertIs(cache.peek("a", missing), missing)
+        cache.get("a", self.loader(1))
+        cache.get("b", self.loader(None))
+        self.assertEqual(cache.peek("a", missing), 1)
+        self.assertIsNone(cache.peek("b", missing))
+        self.assertIs(cache.peek("c", missing), missing)
+
+        # A version check is due: left to get
+        self.clock.now += 1
+        with mock.patch.object(cache, "session_factory", side_effect=AssertionError("queried")):
+            self.assertIs(cache.peek("a", missing), missing)
+        self.assertEqual(self.loads, 2)
+
+    def test_version_bump_reaches_other_workers(self):
+        worker = self.cache()
+        worker.get("a", self.loader("active"))
+
+        # Another worker revokes: bumps the version, invalidates itself
+        other = self.cache()
+        self.bump()
+        other.invalidate()
+        self.assertEqual(other.get("a", self.loader("revoked")), "revoked")
+
+        # This worker only looks at the version once per check interval
+        self.assertEqual(worker.get("a", self.loader("revoked")), "active")
+        self.clock.now += 1
+        self.assertEqual(worker.get("a", self.loader("revoked")), "revoked")
+
+        db = self.Session()
+        try:
+            self.assertEqual(read_version(db, "keys"), 1)
+        finally:
+            db.close()
+        self.bump()
+        db = self.Session()
+        try:
+            self.assertEqual(read_version(db, "keys"), 2)
+        finally:
+            db.close()
+
+    def test_load_racing_invalidation_is_not_stored(self):
+        cache = self.cache()
+        cache.get("a", self.loader("old"))
+        self.clock.now += 61
+
+        # The loader read the old value, then the key was revoked before it returned
+        def stale_load():
+            self.loads += 1
+            cache.invalidate()
+            return "stale"
+        self.assertEqual(cache.get("a", stale_load), "stale")
+        self.assertEqual(cache.get("a", self.loader("revoked")), "revoked")
+
+        # Same when another thread notices a version bump mid-load
+        self.clock.now += 61
+        def stale_across_bump():
+            self.loads += 1
+            self.bump()
+            self.clock.now += 1
+            cache.get("other", self.loader(None))
+            return "stale"
+        self.assertEqual(cache.get("a", stale_across_bump), "stale")
+        self.assertEqual(cache.get("a", self.loader("fresh")), "fresh")
+        self.assertEqual(self.loads, 6)
+
+    def test_bounded(self):
+        cache = self.cache(max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.get(key, self.loader(key))
+        self.assertEqual(set(cache._entries), {"b", "c"})
+
+    def test_target_builder_setting(self):
+        db = self.Session()
+        db.execute(text("CREATE TABLE app_settings (key TEXT PRIMARY KEY, value TEXT)"))
+        db.execute(text("INSERT INTO app_settings VALUES ('TARGET_BUILDER', '0xbuilder')"))
+        db.commit()
+        db.close()
+
+        app_cache = self.cache()
+        with mock.patch.object(cache_module, "app_settings_cache", app_cache), \
+             mock.patch.object(cache_module, "SessionLocal", self.Session):
+            self.assertEqual(settings.TARGET_BUILDER, "0xbuilder")
+
+            db = self.Session()
+            db.execute(text("UPDATE app_settings SET value = '0xother' WHERE key = 'TARGET_BUILDER'"))
+            db.commit()
+            db.close()
+            # Served from the cache until the version moves
+            self.assertEqual(settings.TARGET_BUILDER, "0xbuilder")
+            self.bump()
+            self.clock.now += 1
+            self.assertEqual(settings.TARGET_BUILDER, "0xother")
+
+if __name__ == '__main__':
+    unittest.main()
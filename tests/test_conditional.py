@@ -0,0 +1,144 @@
+import os
+import unittest
+import asyncio
+import tempfile
+from unittest import mock
+from starlette.datastructures import QueryParams
+from src import conditional
+from src.conditional import ledger_etag, cache_headers, etag_matches, MarkToMarket, known_open_coins, remember_open_coins
+from src.services import LedgerService, DataVersion
+from src.storage.sqlite import SqliteStorage
+
+class DataSource:
+    def __init__(self):
+        self.fills = [
+            {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "closedPnl": "0.0", "tid": 1},
+        ]
+        self.mids = {"BTC": "51000.0"}
+        self.mids_calls = 0
+
+    def get_user_fills(self, address, since=0):
+        # Inclusive like the upstream startTime, the stored duplicates are ignored
+        return [f for f in self.fills if f["time"] >= since]
+
+    def get_user_funding(self, address, start, end):
+        return []
+
+    def get_all_mids(self):
+        self.mids_calls += 1
+        if self.mids is None:
+            raise RuntimeError("upstream down")
+        return dict(self.mids)
+
+class TestEtag(unittest.TestCase):
+    def test_etag_inputs(self):
+        version = DataVersion(1000, 1, 0, "0xbuilder")
+        etag = ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), version, "m1")
+        # Weak, the same tag goes out with every Content-Encoding
+        self.assertTrue(etag.startswith('W/"') and etag.endswith('"'))
+        # Parameter order does not matter, everything else does
+        self.assertEqual(etag, ledger_etag("/v1/pnl", QueryParams("coin=BTC&user=0xa"), version, "m1"))
+        for other in (
+            ledger_etag("/v1/trades", QueryParams("user=0xa&coin=BTC"), version, "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=ETH"), version, "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), DataVersion(1001, 1, 0, "0xbuilder"), "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), DataVersion(1000, 2, 0, "0xbuilder"), "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), DataVersion(1000, 1, 5, "0xbuilder"), "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), DataVersion(1000, 1, 0, "0xother"), "m1"),
+            ledger_etag("/v1/pnl", QueryParams("user=0xa&coin=BTC"), version, "m2"),
+        ):
+            self.assertNotEqual(etag, other)
+
+    def test_matching(self):
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"x", W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches("*", '"abc"'))
+        self.assertFalse(etag_matches('"abd"', '"abc"'))
+        self.assertFalse(etag_matches(None, '"abc"'))
+        self.assertTrue(etag_matches('W/"abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('"abc"', 'W/"abc"'))
+        self.assertFalse(etag_matches('W/"abd"', 'W/"abc"'))
+
+    def test_headers(self):
+        headers = cache_headers('"abc"', 1700000000000, 2)
+        self.assertEqual(headers["Cache-Control"], "private, max-age=2, must-revalidate")
+        self.assertEqual(headers["Last-Modified"], "Tue, 14 Nov 2023 22:13:20 GMT")
+        self.assertNotIn("Last-Modified", cache_headers('"abc"', 0, 2))
+
+class TestDataVersion(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.storage = SqliteStorage(os.path.join(tmp.name, "version.db"))
+        self.addCleanup(self.storage.close)
+        self.source = DataSource()
+        self.service = LedgerService(self.source, storage=self.storage)
+        self.addCleanup(self.service.close)
+
+    def test_version_follows_stored_fills(self):
+        async def run():
+            version = await self.service.sync_async("0xabc", target_builder="0xB")
+            synced = await self.service.get_trades_async("0xabc", target_builder="0xB", synced=True)
+            self.source.fills.append(
+                {"coin": "BTC", "side": "A", "sz": "1.0", "px": "52000.0", "time": 2000, "fee": "10.0", "closedPnl": "2000.0", "tid": 2})
+            newer = await self.service.sync_async("0xabc", target_builder="0xB")
+            # A second fill in the same millisecond still changes the version
+            self.source.fills.append(
+                {"coin": "ETH", "side": "B", "sz": "1.0", "px": "3000.0", "time": 2000, "fee": "1.0", "closedPnl": "0.0", "tid": 3})
+            same_ms = await self.service.sync_async("0xabc", target_builder="0xB")
+            return version, synced, newer, same_ms
+
+        version, synced, newer, same_ms = asyncio.run(run())
+        self.assertEqual(version, DataVersion(1000, 1, 0, "0xb"))
+        self.assertEqual(len(synced), 1)
+        self.assertEqual(newer.fills_ms, 2000)
+        self.assertEqual((same_ms.fills_ms, same_ms.fills_at_ms), (2000, 2))
+
+    def test_mids_snapshot(self):
+        with mock.patch.dict(os.environ, {"MIDS_SNAPSHOT_S": "60"}):
+            first = self.service.mids_snapshot()
+            self.assertIs(self.service.mids_snapshot(), first)
+            self.assertEqual(self.source.mids_calls, 1)
+        with mock.patch.dict(os.environ, {"MIDS_SNAPSHOT_S": "0"}):
+            # Same prices, same id
+            self.assertEqual(self.service.mids_snapshot()[0], first[0])
+            self.source.mids = {"BTC": "52000.0"}
+            self.assertNotEqual(self.service.mids_snapshot()[0], first[0])
+            # Failures are not cached
+            self.source.mids = None
+            self.assertEqual(self.service.mids_snapshot()[2], {})
+            self.source.mids = {"BTC": "52000.0"}
+            self.assertEqual(self.service.mids_snapshot()[2], {"BTC": "52000.0"})
+
+    def test_marks_only_open_positions(self):
+        def pnl(mids):
+            marks = MarkToMarket(lambda: ("", 1.0, mids))
+            result = asyncio.run(self.service.get_pnl_async("0xabc", mids=marks, target_builder="", builder_only=False))
+            return marks, result
+
+        # Open BTC position: only the BTC mid is in the tag
+        marks, result = pnl({"BTC": "51000.0", "ETH": "3000.0"})
+        self.assertEqual(marks.coins, ("BTC",))
+        self.assertEqual(result.unrealizedPnl, 1000)
+        self.assertEqual(pnl({"BTC": "51000.0", "ETH": "3100.0"})[0].mids_id(), marks.mids_id())
+        self.assertNotEqual(pnl({"BTC": "52000.0", "ETH": "3000.0"})[0].mids_id(), marks.mids_id())
+
+        # Flat account: no mids fetched, none in the tag
+        self.source.fills.append(
+            {"coin": "BTC", "side": "A", "sz": "1.0", "px": "52000.0", "time": 2000, "fee": "10.0", "closedPnl": "2000.0", "tid": 2})
+        marks = MarkToMarket(mock.Mock(side_effect=AssertionError("mids fetched")))
+        asyncio.run(self.service.get_pnl_async("0xabc", mids=marks, target_builder="", builder_only=False))
+        self.assertEqual((marks.coins, marks.mids_id(), marks.fetched_at), ((), "", None))
+        self.assertEqual(self.source.mids_calls, 0)
+
+    def test_open_coins_bounded(self):
+        self.addCleanup(conditional._open_coins.clear)
+        with mock.patch.object(conditional, "OPEN_COINS_ENTRIES", 2):
+            for tag, coins in (('"a"', ()), ('"b"', ("BTC",)), ('"c"', ("ETH",))):
+                remember_open_coins(tag, coins)
+        self.assertIsNone(known_open_coins('"a"'))
+        self.assertEqual(known_open_coins('"b"'), ("BTC",))
+        self.assertEqual(known_open_coins('"c"'), ("ETH",))
+
+if __name__ == '__main__':
+    unittest.main()
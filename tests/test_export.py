@@ -0,0 +1,172 @@
+import io
+import csv
+import gzip
+import json
+import time
+import unittest
+import asyncio
+import threading
+from unittest import mock
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from src import export
+from src.replay import LedgerReplay, OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY
+from src.serialize import stream_response
+from src.replay_pool import checked_iter, ReplayCancelled
+from src.services import LedgerService
+
+BUILDER_A = "0x" + "a" * 40
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "0.5", "px": "50000.0", "time": 1000, "fee": "1.0", "builder": BUILDER_A},
+    {"coin": "ETH", "side": "B", "sz": "1.0", "px": "3000.0", "time": 1500, "fee": "1.0"},
+    {"coin": "BTC", "side": "A", "sz": "0.5", "px": "51000.25", "time": 2000, "fee": "0.5", "builder": BUILDER_A},
+]
+FUNDING = [{"coin": "BTC", "time": 1800, "usdc": "-7.5"}]
+
+def records(output, models=False):
+    replay = LedgerReplay(iter(FILLS), FUNDING, outputs=(output,), models=models)
+    return [item for _, item in replay]
+
+def body(chunks):
+    return b"".join(chunks)
+
+class TestEncoders(unittest.TestCase):
+    def setUp(self):
+        # Small batches so the outputs span several of them
+        patcher = mock.patch.object(export, "EXPORT_BATCH_ROWS", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expected(self, output):
+        return jsonable_encoder(records(output, models=True))
+
+    def test_columnar(self):
+        for output in (OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY):
+            rows = self.expected(output)
+            columns = json.loads(body(export.encode(iter(records(output)), export.COLUMNAR, output)))
+            self.assertEqual(list(columns), [name for name, _ in export.FIELDS[output]])
+            self.assertEqual(columns, {name: [row[name] for row in rows] for name in columns})
+            # Spooled to disk
+            with mock.patch.object(export, "COLUMN_SPOOL_BYTES", 8), mock.patch.object(export, "SPOOL_READ_BYTES", 5):
+                self.assertEqual(json.loads(body(export.encode(iter(records(output)), export.COLUMNAR, output))), columns)
+
+    def test_ndjson(self):
+        for output in (OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY):
+            chunks = list(export.encode(iter(records(output)), export.NDJSON, output))
+            lines = body(chunks).decode().splitlines()
+            self.assertEqual([json.loads(line) for line in lines], self.expected(output))
+
+    def test_csv(self):
+        chunks = list(export.encode(iter(records(OUTPUT_TRADES)), export.CSV, OUTPUT_TRADES))
+        # Header goes out with the first batch, one chunk per batch
+        self.assertEqual(len(chunks), 2)
+        parsed = list(csv.DictReader(io.StringIO(body(chunks).decode())))
+        expected = self.expected(OUTPUT_TRADES)
+        self.assertEqual([row["px"] for row in parsed], [row["px"] for row in expected])
+        self.assertEqual([row["builder"] for row in parsed], [row["builder"] or "" for row in expected])
+
+    def test_empty(self):
+        self.assertEqual(json.loads(body(export.encode(iter([]), export.COLUMNAR, OUTPUT_POSITIONS))),
+                         {"timeMs": [], "netSize": [], "avgEntryPx": [], "tainted": []})
+        self.assertEqual(body(export.encode(iter([]), export.NDJSON, OUTPUT_POSITIONS)), b"")
+        self.assertEqual(body(export.encode(iter([]), export.CSV, OUTPUT_POSITIONS)), b"timeMs,netSize,avgEntryPx,tainted\n")
+
+    @unittest.skipIf(export.pyarrow is None, "pyarrow not installed")
+    def test_arrow(self):
+        for output in (OUTPUT_TRADES, OUTPUT_HISTORY):
+            data = body(export.encode(iter(records(output)), export.ARROW, output))
+            reader = export.pyarrow.ipc.open_stream(data)
+            self.assertEqual(reader.schema, export.arrow_schema(output))
+            self.assertEqual(reader.read_all().to_pylist(), self.expected(output))
+        empty = export.pyarrow.ipc.open_stream(body(export.encode(iter([]), export.ARROW, OUTPUT_TRADES)))
+        self.assertEqual(empty.read_all().num_rows, 0)
+
+    def test_check_format(self):
+        export.check_format("csv")
+        with self.assertRaises(HTTPException) as ctx:
+            export.check_format("xml")
+        self.assertEqual(ctx.exception.status_code, 400)
+        with mock.patch.object(export, "pyarrow", None), self.assertRaises(HTTPException) as ctx:
+            export.check_format("arrow")
+        self.assertEqual(ctx.exception.status_code, 501)
+
+class TestStreamResponse(unittest.TestCase):
+    def stream(self, accept_encoding=None):
+        headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+        request = Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+        chunks = export.encode(iter(records(OUTPUT_TRADES)), export.NDJSON, OUTPUT_TRADES)
+        with mock.patch.dict("os.environ", {"RESPONSE_ENCODINGS": "gzip"}):
+            response = stream_response(request, chunks, export.MEDIA_TYPES[export.NDJSON])
+
+        async def read():
+            return b"".join([chunk async for chunk in response.body_iterator])
+        return response, asyncio.run(read())
+
+    def test_compressed_stream(self):
+        plain_response, plain = self.stream()
+        self.assertNotIn("content-encoding", plain_response.headers)
+        response, data = self.stream("gzip")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(data), plain)
+
+    def endless(self, stop_after_s=5):
+        # Stands in for a long replay, gives up on its own if nothing stops it
+        start = time.time()
+        while time.time() - start < stop_after_s:
+            yield {"n": 1}
+
+    def test_disconnect_stops_replay(self):
+        cancelled = threading.Event()
+        stopped = []
+        def chunks():
+            # Columnar: the first chunk only comes once every record is consumed
+            try:
+                yield b"".join(b"x" for _ in checked_iter(self.endless(), time.time() + 60, cancelled))
+            except ReplayCancelled:
+                stopped.append(True)
+                raise
+
+        request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+        response = stream_response(request, chunks(), "application/json", cancelled=cancelled)
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+        async def send(message):
+            pass
+
+        start = time.time()
+        asyncio.run(response({"type": "http"}, receive, send))
+        # asyncio.run waits for the producer thread
+        self.assertLess(time.time() - start, 4)
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(stopped, [True])
+
+    def test_deadline_stops_replay(self):
+        with self.assertRaises(ReplayCancelled):
+            list(checked_iter(self.endless(), time.time() - 1, threading.Event()))
+
+class DataSource:
+    def get_user_fills(self, address, since=0):
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        return FUNDING
+
+class TestIterLedgerAsync(unittest.TestCase):
+    def test_records_stream(self):
+        service = LedgerService(DataSource())
+
+        async def run():
+            stream = await service.iter_ledger_async("0xa", outputs=(OUTPUT_TRADES,), models=False)
+            return await asyncio.to_thread(list, stream)
+        items = asyncio.run(run())
+        self.assertEqual([kind for kind, _ in items], [OUTPUT_TRADES] * 3)
+        self.assertEqual([record.to_row() for _, record in items],
+                         jsonable_encoder(service.get_trades("0xa")))
+
+if __name__ == '__main__':
+    unittest.main()
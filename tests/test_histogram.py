@@ -0,0 +1,42 @@
+import unittest
+import random
+from src.histogram import LatencyHistogram, bucket_index, bucket_bounds
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_bucket_bounds_contain_value(self):
+        for value in list(range(200)) + [1000, 4095, 4096, 123456, 60_000_000]:
+            low, high = bucket_bounds(bucket_index(value))
+            self.assertLessEqual(low, value)
+            self.assertLess(value, high)
+            # Never wider than ~3% of the value above the linear range
+            if value >= 64:
+                self.assertLessEqual((high - low) / low, 1 / 32)
+
+    def test_percentiles_within_bucket_error(self):
+        rng = random.Random(7)
+        values = sorted(rng.lognormvariate(3, 1) for _ in range(10000))
+        h = LatencyHistogram()
+        for v in values:
+            h.record(v)
+        for q in (50, 95, 99):
+            exact = values[int(q / 100 * len(values)) - 1]
+            self.assertAlmostEqual(h.percentile(q), exact, delta=exact * 0.04)
+
+    def test_merge_is_additive(self):
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for v in (1, 2, 3, 500):
+            a.record(v)
+            both.record(v)
+        for v in (4, 900, 1200):
+            b.record(v)
+            both.record(v)
+        merged = LatencyHistogram(a.counts).merge(b)
+        self.assertEqual(merged.counts, both.counts)
+        self.assertEqual(merged.total, 7)
+        self.assertEqual(merged.percentiles(), both.percentiles())
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
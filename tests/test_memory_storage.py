@@ -0,0 +1,77 @@
+import unittest
+import os
+import tempfile
+from src.storage.memory import MemoryStorage
+
+def make_fills(n, start=0, coin="BTC"):
+    return [
+        {"coin": coin, "side": "B", "time": start + i, "px": "100.0", "sz": "1.0", "closedPnl": "1.5", "tid": start + i}
+        for i in range(n)
+    ]
+
+class TestMemoryStorage(unittest.TestCase):
+    def test_save_and_retrieve(self):
+        storage = MemoryStorage()
+        storage.save_fills("0xA", make_fills(3, start=10) + make_fills(2, start=100, coin="ETH"))
+        # Duplicates and an out-of-order batch
+        storage.save_fills("0xA", make_fills(3, start=10) + make_fills(1, start=5))
+
+        fills = storage.get_all_fills("0xA")
+        self.assertEqual([f["time"] for f in fills], [5, 10, 11, 12, 100, 101])
+        self.assertEqual(storage.get_latest_timestamp("0xA"), 101)
+        self.assertEqual(storage.get_latest_timestamp("0xA", coin="BTC"), 12)
+        self.assertEqual(storage.get_latest_timestamp("0xB"), 0)
+        self.assertEqual([f["time"] for f in storage.iter_fills("0xA", coin="BTC", from_ms=10, to_ms=11)], [10, 11])
+        # Same millisecond, lower tid arriving later: kept in (time, tid) order, both inside the window
+        storage.save_fills("0xA", [dict(make_fills(1, start=11)[0], tid=3)])
+        self.assertEqual([(f["time"], f["tid"]) for f in storage.iter_fills("0xA", from_ms=11, to_ms=11)], [(11, 3), (11, 11)])
+
+        board = storage.get_leaderboard_stats()
+        self.assertEqual(board[0]["tradeCount"], 7)
+        self.assertAlmostEqual(board[0]["metricValue"], 10.5)
+
+    def test_funding(self):
+        storage = MemoryStorage()
+        self.assertTrue(storage.caches_funding)
+        events = [{"time": 300, "coin": "BTC", "usdc": "1.0"}, {"time": 100, "coin": "BTC", "usdc": "2.0"}]
+        storage.save_funding("0xA", events)
+        storage.save_funding("0xA", events)
+
+        self.assertEqual(storage.get_latest_funding_timestamp("0xA"), 300)
+        self.assertEqual([e["time"] for e in storage.get_funding("0xA")], [100, 300])
+        self.assertEqual([e["time"] for e in storage.get_funding("0xA", from_ms=200)], [300])
+        self.assertEqual([e["time"] for e in storage.get_funding("0xA", from_ms=100, to_ms=299)], [100])
+
+    def test_lru_eviction(self):
+        storage = MemoryStorage(max_bytes=1)
+        storage.save_fills("0xA", make_fills(10))
+        storage.save_fills("0xB", make_fills(10))
+
+        # Over budget: the least recently used user goes, the one just written stays
+        self.assertEqual(storage.get_all_fills("0xA"), [])
+        self.assertEqual(len(storage.get_all_fills("0xB")), 10)
+
+        storage = MemoryStorage(max_bytes=10 ** 9)
+        storage.save_fills("0xA", make_fills(10))
+        storage.save_fills("0xB", make_fills(10))
+        storage.get_latest_timestamp("0xA")  # touch 0xA
+        storage.max_bytes = storage.used_bytes - 1
+        storage.save_fills("0xC", make_fills(1))
+        self.assertEqual(storage.get_all_fills("0xB"), [])
+        self.assertEqual(len(storage.get_all_fills("0xA")), 10)
+
+    def test_snapshot_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "memory.json")
+            storage = MemoryStorage(snapshot_path=path)
+            storage.save_fills("0xA", make_fills(5))
+            storage.save_funding("0xA", [{"time": 1, "coin": "BTC", "usdc": "1.0"}])
+            storage.close()
+
+            restored = MemoryStorage(snapshot_path=path)
+            self.assertEqual(restored.get_all_fills("0xA"), storage.get_all_fills("0xA"))
+            self.assertEqual(restored.get_funding("0xA"), storage.get_funding("0xA"))
+            self.assertEqual(restored.get_leaderboard_stats(), storage.get_leaderboard_stats())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+import os
+import tempfile
+from prometheus_client import REGISTRY
+from hyperliquid.utils.error import ClientError
+from src.metrics import upstream_call, render_latest
+from src.services import LedgerService
+from src.storage.sqlite import SqliteStorage
+from src.stream_manager import stream_manager
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "closedPnl": "0.0", "tid": 1},
+    {"coin": "BTC", "side": "A", "sz": "1.0", "px": "51000.0", "time": 2000, "fee": "5.0", "closedPnl": "1000.0", "tid": 2},
+]
+
+class StaticDataSource:
+    def get_user_fills(self, address, since=0):
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        return []
+
+    def get_all_mids(self):
+        return {}
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+class TestMetrics(unittest.TestCase):
+    def test_upstream_outcomes(self):
+        before = sample("ledger_upstream_rate_limited_total", type="test_call")
+        with upstream_call("test_call"):
+            pass
+        with self.assertRaises(ClientError):
+            with upstream_call("test_call"):
+                raise ClientError(429, None, "rate limited", {})
+        with self.assertRaises(ValueError):
+            with upstream_call("test_call"):
+                raise ValueError("boom")
+
+        self.assertEqual(sample("ledger_upstream_rate_limited_total", type="test_call") - before, 1)
+        self.assertGreaterEqual(sample("ledger_upstream_requests_total", type="test_call", outcome="ok"), 1)
+        self.assertGreaterEqual(sample("ledger_upstream_requests_total", type="test_call", outcome="error"), 1)
+        self.assertGreaterEqual(sample("ledger_upstream_request_duration_seconds_count", type="test_call"), 3)
+
+    def test_service_instrumentation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SqliteStorage(os.path.join(tmp, "metrics.db"))
+            try:
+                service = LedgerService(StaticDataSource(), storage=storage)
+                misses = sample("ledger_cache_lookups_total", cache="fills", result="miss")
+                hits = sample("ledger_cache_lookups_total", cache="fills", result="hit")
+                replays = sample("ledger_replay_fills_count", output="pnl")
+                fills = sample("ledger_replay_fills_sum", output="pnl")
+                writes = sample("ledger_storage_operation_duration_seconds_count", backend="sqlite", operation="save_fills")
+
+                service.get_pnl("0xabc")
+                service.get_pnl("0xabc")
+
+                self.assertEqual(sample("ledger_cache_lookups_total", cache="fills", result="miss") - misses, 1)
+                self.assertEqual(sample("ledger_cache_lookups_total", cache="fills", result="hit") - hits, 1)
+                self.assertEqual(sample("ledger_replay_fills_count", output="pnl") - replays, 2)
+                self.assertEqual(sample("ledger_replay_fills_sum", output="pnl") - fills, 4)
+                self.assertEqual(sample("ledger_storage_operation_duration_seconds_count",
+                                        backend="sqlite", operation="save_fills") - writes, 1)
+                service.close()
+            finally:
+                storage.close()
+
+    def test_upstream_subscriptions_gauge(self):
+        # Upstream subscriptions are kept after the last client leaves, so a
+        # reconnect reuses them and the gauge tracks the ones actually held.
+        subscribed = []
+        stream_manager._subscribe_upstream = subscribed.append
+        try:
+            before = sample("ledger_websocket_upstream_subscriptions")
+            for _ in range(3):
+                ws = FakeWebSocket()
+                asyncio.run(stream_manager.connect(ws, "0xGAUGE"))
+                stream_manager.disconnect(ws, "0xgauge")
+
+            self.assertEqual(subscribed, ["0xgauge"])
+            self.assertEqual(sample("ledger_websocket_upstream_subscriptions") - before, 1)
+        finally:
+            del stream_manager._subscribe_upstream
+
+    def test_exposition(self):
+        body, content_type = render_latest()
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertIn(b"ledger_replay_duration_seconds", body)
+        self.assertIn(b"ledger_websocket_subscribers", body)
+
+if __name__ == '__main__':
+    unittest.main()
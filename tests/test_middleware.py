@@ -0,0 +1,127 @@
+import unittest
+import asyncio
+from unittest import mock
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from src.middleware import RequestMiddleware, AccessLog
+
+class RecordingWriter:
+    def __init__(self):
+        self.calls = []
+
+    def log(self, **kwargs):
+        self.calls.append(kwargs)
+
+def make_app(access_log):
+    app = FastAPI()
+
+    @app.get("/v1/ping")
+    async def ping(user: str = None):
+        return {"user": user}
+
+    @app.get("/v1/stream")
+    async def stream():
+        async def chunks():
+            for part in (b"a", b"b", b"c"):
+                yield part
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    @app.get("/v1/keyed")
+    async def keyed(request: Request):
+        request.state.quota_key = 7
+        return {"ok": True}
+
+    @app.get("/admin/thing")
+    async def admin_thing():
+        return {}
+
+    app.add_middleware(RequestMiddleware, slow_ms=0, access_log=access_log)
+    return app
+
+async def call(app, path, query=b""):
+    messages = []
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query, "server": ("test", 80), "client": ("127.0.0.1", 5000),
+        "headers": [(b"host", b"test"), (b"x-api-key", b"pk_testkey123456")],
+    }
+    await app(scope, receive, send)
+    return messages
+
+class TestRequestMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.writer = RecordingWriter()
+        patcher = mock.patch("src.middleware.request_log_writer", self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.access_log = AccessLog(sample_rate=1)
+        self.app = make_app(self.access_log)
+
+    def test_headers_and_request_log(self):
+        messages = asyncio.run(call(self.app, "/v1/ping", b"user=0xabc"))
+        start = messages[0]
+        self.assertEqual(start["status"], 200)
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"x-frame-options"], b"DENY")
+        self.assertEqual(headers[b"x-content-type-options"], b"nosniff")
+        self.assertIn(b"total;dur=", headers[b"server-timing"])
+
+        self.assertEqual(len(self.writer.calls), 1)
+        entry = self.writer.calls[0]
+        self.assertEqual(entry["endpoint"], "/v1/ping")
+        self.assertEqual(entry["status_code"], 200)
+        self.assertEqual(entry["user_addr"], "0xabc")
+        self.assertEqual(entry["api_key"], "pk_testkey123456")
+        # slow_ms=0 disables the slow request capture
+        self.assertIsNone(entry["stages"])
+
+    def test_streaming_passes_through(self):
+        messages = asyncio.run(call(self.app, "/v1/stream"))
+        bodies = [m for m in messages if m["type"] == "http.response.body" and m.get("body")]
+        self.assertEqual([m["body"] for m in bodies], [b"a", b"b", b"c"])
+        self.assertIn(b"server-timing", dict(messages[0]["headers"]))
+
+    def test_admin_and_unmatched(self):
+        asyncio.run(call(self.app, "/admin/thing"))
+        self.assertEqual(self.writer.calls, [])
+        messages = asyncio.run(call(self.app, "/nope"))
+        self.assertEqual(messages[0]["status"], 404)
+        self.assertEqual(self.writer.calls[0]["status_code"], 404)
+
+    def test_quota_charged_for_admitted_key(self):
+        with mock.patch("src.middleware.quota_manager") as quota:
+            asyncio.run(call(self.app, "/v1/keyed"))
+            asyncio.run(call(self.app, "/v1/ping"))
+        (key, timer), _ = quota.charge.call_args_list[0]
+        self.assertEqual(key, 7)
+        self.assertEqual(timer.counts["bytes"], len(b'{"ok":true}'))
+        self.assertIsNone(quota.charge.call_args_list[1][0][0])
+
+class TestAccessLog(unittest.TestCase):
+    def test_sampling(self):
+        access_log = AccessLog(sample_rate=3)
+        with mock.patch.object(access_log.logger, "isEnabledFor", return_value=True), \
+                mock.patch.object(access_log.logger, "info") as info:
+            for _ in range(6):
+                access_log.log("1.2.3.4", "GET", "/v1/pnl", 200, 1.0)
+            self.assertEqual(info.call_count, 2)
+            access_log.log("1.2.3.4", "GET", "/v1/pnl", 500, 1.0, always=True)
+            self.assertEqual(info.call_count, 3)
+            args = info.call_args[0]
+            self.assertIn(500, args)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import os
+import time
+import tempfile
+import threading
+from src.profiler import Profiler, ProfileStore
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(ProfileStore(self.tmp.name), interval_ms=1, max_seconds=0.2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_request_profile_is_folded_and_listed(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+        worker.start()
+        sampler = self.profiler.begin("request")
+        # Only one profile at a time per process
+        self.assertIsNone(self.profiler.begin("request"))
+        time.sleep(0.1)
+        profile_id = self.profiler.end(sampler, endpoint="/v1/pnl")
+        stop.set()
+        worker.join()
+
+        with open(self.profiler.store.path(profile_id)) as f:
+            lines = f.read().splitlines()
+        busy = [l for l in lines if l.startswith("busy-worker;") and "busy_loop (tests/test_profiler.py" in l]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+
+        [info] = self.profiler.store.list()
+        self.assertEqual((info["id"], info["kind"], info["endpoint"]), (profile_id, "request", "/v1/pnl"))
+        self.assertGreater(info["samples"], 0)
+
+    def test_time_boxed_profile(self):
+        profile_id = self.profiler.run_for(30)   # capped at max_seconds
+        deadline = time.time() + 5
+        # The .folded is published last, once it exists the profile is listed too
+        while self.profiler.store.path(profile_id) is None and time.time() < deadline:
+            time.sleep(0.05)
+        [info] = self.profiler.store.list()
+        self.assertEqual((info["id"], info["kind"], info["requested_s"]), (profile_id, "process", 0.2))
+        sampler = self.profiler.begin("request")
+        self.assertIsNotNone(sampler)
+        self.profiler.end(sampler)
+
+    def test_path_rejects_untrusted_ids(self):
+        open(os.path.join(self.tmp.name, "secret.folded"), "w").close()
+        for bad in ("../secret", "secret", "1-request-zz/../../x"):
+            self.assertIsNone(self.profiler.store.path(bad))
+
+if __name__ == '__main__':
+    unittest.main()
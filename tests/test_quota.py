@@ -0,0 +1,70 @@
+import unittest
+import asyncio
+import contextvars
+from fastapi import HTTPException
+from limits.storage import storage_from_string
+from src import timing
+from src.metrics import upstream_call
+from src.quota import QuotaManager
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def request_timer(fills=0, upstream_calls=0, nbytes=0):
+    def run():
+        timer = timing.begin()
+        timing.count("fills", fills)
+        for _ in range(upstream_calls):
+            with upstream_call("test"):
+                pass
+        timing.count("bytes", nbytes)
+        return timer
+    return contextvars.Context().run(run)
+
+class TestQuotaManager(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.quota = QuotaManager(
+            storage_from_string("memory://"), units_per_minute=100, cpu_budget=0.5, queue_timeout_s=0.2,
+            fills_per_unit=1000, upstream_call_units=2, bytes_per_unit=1000, cpu_clock=self.clock,
+        )
+
+    def test_units(self):
+        self.assertEqual(self.quota.units(request_timer()), 1)
+        # 1 + 50 fills + 1 call + 200 bytes
+        self.assertEqual(self.quota.units(request_timer(fills=50, upstream_calls=1, nbytes=200)), 4)
+        self.assertEqual(self.quota.units(request_timer(fills=500000)), 501)
+
+    def test_key_budget(self):
+        asyncio.run(self.quota.admit(1))
+        # A large replay is charged in full even though it overshoots the budget
+        self.assertEqual(self.quota.charge(1, request_timer(fills=150000)), 151)
+        self.assertEqual(self.quota.remaining(1), 0)
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.quota.admit(1))
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertGreaterEqual(int(ctx.exception.headers["Retry-After"]), 1)
+        # Other keys are unaffected, unkeyed requests are not charged
+        asyncio.run(self.quota.admit(2))
+        self.assertEqual(self.quota.charge(None, request_timer(fills=150000)), 0)
+
+    def test_cpu_budget(self):
+        # 0.5 CPU s/s over 10s windows is 5000ms, spend 6s of CPU
+        self.clock.now = 6.0
+        self.quota.charge(None, request_timer())
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.quota.admit(1))
+        self.assertEqual(ctx.exception.status_code, 503)
+
+    def test_disabled(self):
+        quota = QuotaManager(storage_from_string("memory://"), units_per_minute=0)
+        asyncio.run(quota.admit(1))
+        self.assertEqual(quota.charge(1, request_timer(fills=10 ** 7)), 0)
+        self.assertIsNone(quota.remaining(1))
+
+if __name__ == '__main__':
+    unittest.main()
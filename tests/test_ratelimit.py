@@ -0,0 +1,91 @@
+import os
+import unittest
+import tempfile
+import multiprocessing
+from unittest import mock
+from limits import RateLimitItemPerMinute, RateLimitItemPerSecond
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter, FixedWindowRateLimiter
+from src.ratelimit import SharedMemoryStorage
+
+def _hit_many(uri, count, results):
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    item = RateLimitItemPerMinute(50)
+    results.put(sum(limiter.hit(item, "client") for _ in range(count)))
+
+class TestSharedMemoryStorage(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.uri = "shm://" + os.path.join(tmp.name, "limits.shm")
+        self.storage = storage_from_string(self.uri, slots=64)
+
+    def test_scheme_registered(self):
+        self.assertIsInstance(self.storage, SharedMemoryStorage)
+        self.assertTrue(self.storage.check())
+
+    def test_sliding_window(self):
+        limiter = SlidingWindowCounterRateLimiter(self.storage)
+        item = RateLimitItemPerMinute(3)
+        # Mid-window, so the two windows cannot roll over during the test
+        with mock.patch("src.ratelimit.time.time", return_value=6000 * 60 + 30):
+            self.assertEqual([limiter.hit(item, "a") for _ in range(4)], [True, True, True, False])
+            self.assertTrue(limiter.hit(item, "b"))
+            self.assertEqual(limiter.get_window_stats(item, "a").remaining, 0)
+        # Halfway into the next window the 3 previous hits weigh 1.5, so 2 more fit
+        with mock.patch("src.ratelimit.time.time", return_value=6001 * 60 + 30):
+            self.assertEqual([limiter.hit(item, "a") for _ in range(3)], [True, True, False])
+        # Two windows later nothing is left
+        with mock.patch("src.ratelimit.time.time", return_value=6003 * 60):
+            self.assertEqual(limiter.get_window_stats(item, "a").remaining, 3)
+            limiter.hit(item, "a")
+            limiter.clear(item, "a")
+            self.assertEqual(limiter.get_window_stats(item, "a").remaining, 3)
+
+    def test_fixed_window(self):
+        limiter = FixedWindowRateLimiter(self.storage)
+        item = RateLimitItemPerSecond(2)
+        with mock.patch("src.ratelimit.time.time", return_value=1000.5):
+            self.assertEqual([limiter.hit(item, "a") for _ in range(3)], [True, True, False])
+            self.assertEqual(self.storage.get_expiry(item.key_for("a")), 1001)
+
+    def test_full_table_reuses_slots(self):
+        limiter = SlidingWindowCounterRateLimiter(self.storage)
+        item = RateLimitItemPerMinute(1)
+        with mock.patch("src.ratelimit.time.time", return_value=6000 * 60):
+            for i in range(200):
+                self.assertTrue(limiter.hit(item, f"client-{i}"))
+            self.assertEqual(self.storage.reset(), 64)
+
+    def test_shared_between_processes(self):
+        # Reopening the file sees the same counters
+        other = SharedMemoryStorage(self.uri)
+        self.assertEqual(other.slots, 64)
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_hit_many, args=(self.uri, 40, results)) for _ in range(3)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join(30)
+        # Unless the test straddles a minute, exactly the limit is allowed overall
+        allowed = sum(results.get(timeout=5) for _ in workers)
+        self.assertGreaterEqual(allowed, 50)
+        self.assertLessEqual(allowed, 100)
+
+    def test_default_uri_per_deployment(self):
+        from src.config import settings
+        def default_uri(database_url):
+            with mock.patch.dict("os.environ", {"DATABASE_URL": database_url}):
+                # tests/__init__.py sets it for the test run
+                os.environ.pop("RATE_LIMIT_STORAGE_URI", None)
+                return settings.RATE_LIMIT_STORAGE_URI
+        a, b = default_uri("sqlite:////srv/a/ledger.db"), default_uri("sqlite:////srv/b/ledger.db")
+        self.assertTrue(a.startswith("shm://hyperliquid-ledger-ratelimit-"))
+        self.assertNotEqual(a, b)
+        self.assertEqual(a, default_uri("sqlite:////srv/a/ledger.db"))
+        with mock.patch.dict("os.environ", {"RATE_LIMIT_STORAGE_URI": "memory://"}):
+            self.assertEqual(settings.RATE_LIMIT_STORAGE_URI, "memory://")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from decimal import Decimal
+from src.replay import LedgerReplay, OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY
+
+BUILDER_A = "0x" + "a" * 40
+BUILDER_B = "0x" + "b" * 40
+
+FILLS = [
+    # Clean BTC lifecycle (Builder A)
+    {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "builder": BUILDER_A},
+    # Tainted ETH lifecycle, opened while BTC is still open
+    {"coin": "ETH", "side": "B", "sz": "1.0", "px": "3000.0", "time": 1500, "fee": "1.0", "builder": BUILDER_A},
+    {"coin": "BTC", "side": "A", "sz": "1.0", "px": "51000.0", "time": 2000, "fee": "5.0", "builder": BUILDER_A},
+    {"coin": "ETH", "side": "A", "sz": "1.0", "px": "3100.0", "time": 3000, "fee": "1.0", "builder": BUILDER_B},
+]
+
+FUNDING = [
+    {"coin": "BTC", "time": 1800, "usdc": "7.0"},  # inside clean BTC lifecycle
+    {"coin": "ETH", "time": 2500, "usdc": "3.0"},  # inside tainted ETH lifecycle
+    {"coin": "ETH", "time": 4000, "usdc": "2.0"},  # ETH flat again, not tainted
+]
+
+def run(outputs, **kwargs):
+    replay = LedgerReplay(iter(FILLS), FUNDING, outputs=outputs, **kwargs)
+    items = list(replay)
+    return replay, items
+
+class TestLedgerReplay(unittest.TestCase):
+    def test_builder_only_aggregates(self):
+        replay, items = run((), target_builder=BUILDER_A, builder_only=True)
+
+        # No outputs requested, nothing is materialized
+        self.assertEqual(items, [])
+        self.assertEqual(replay.realized_pnl, Decimal("1000.0"))
+        self.assertEqual(replay.fees_paid, Decimal("15.0"))
+        self.assertEqual(replay.trade_count, 2)
+        self.assertEqual(replay.funding_paid, Decimal("9.0"))
+        self.assertTrue(replay.tainted)
+        self.assertEqual(replay.open_positions, [])
+
+    def test_aggregates_match_with_and_without_records(self):
+        kwargs = dict(target_builder=BUILDER_A, builder_only=True)
+        lean, _ = run((), **kwargs)
+        full, _ = run((OUTPUT_TRADES, OUTPUT_POSITIONS, OUTPUT_HISTORY), **kwargs)
+
+        self.assertEqual(lean.realized_pnl, full.realized_pnl)
+        self.assertEqual(lean.fees_paid, full.fees_paid)
+        self.assertEqual(lean.trade_count, full.trade_count)
+        self.assertEqual(lean.funding_paid, full.funding_paid)
+        self.assertEqual(lean.tainted, full.tainted)
+
+    def test_outputs_are_time_ordered(self):
+        _, items = run((OUTPUT_TRADES, OUTPUT_HISTORY), target_builder=BUILDER_A)
+
+        trades = [i for k, i in items if k == OUTPUT_TRADES]
+        history = [i for k, i in items if k == OUTPUT_HISTORY]
+
+        self.assertEqual([t.time for t in trades], [1000, 1500, 2000, 3000])
+        self.assertEqual([t.tainted for t in trades], [False, True, False, True])
+        self.assertEqual([h.time for h in history], sorted(h.time for h in history))
+        # All funding counts outside builder-only mode
+        self.assertEqual(history[-1].fundingPaid, Decimal("12.0"))
+        self.assertEqual(history[-1].realizedPnl, Decimal("1100.0"))
+
+    def test_open_position_reported(self):
+        fills = FILLS[:2]
+        replay = LedgerReplay(iter(fills), [], outputs=(OUTPUT_POSITIONS,))
+        positions = [i for _, i in replay]
+
+        self.assertEqual(len(positions), 2)
+        self.assertEqual(sorted(p[0] for p in replay.open_positions), ["BTC", "ETH"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import unittest
+import asyncio
+import tempfile
+from unittest import mock
+from fastapi import HTTPException
+from limits.storage import storage_from_string
+from src import timing
+from src.quota import QuotaManager
+from src.services import LedgerService
+from src.storage.sqlite import SqliteStorage
+from src.replay_pool import ReplayPool, ReplayJob, cancel_on_disconnect
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "closedPnl": "0.0", "tid": 1},
+    {"coin": "BTC", "side": "A", "sz": "1.0", "px": "51000.0", "time": 2000, "fee": "10.0", "closedPnl": "1000.0", "tid": 2},
+    {"coin": "ETH", "side": "B", "sz": "2.0", "px": "3000.0", "time": 3000, "fee": "1.0", "closedPnl": "0.0", "tid": 3},
+]
+
+class StaticDataSource:
+    def get_user_fills(self, address, since=0):
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        return []
+
+    def get_all_mids(self):
+        return {"ETH": "3100.0"}
+
+class TestReplayPool(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "pool.db")
+        # Spawned workers open the same file through DATABASE_URL
+        env = mock.patch.dict(os.environ, {"DATABASE_URL": self.db_path})
+        env.start()
+        self.addCleanup(env.stop)
+        self.storage = SqliteStorage(self.db_path)
+        self.addCleanup(self.storage.close)
+
+    def test_matches_thread_replay(self):
+        pool = ReplayPool("sqlite", workers=1)
+        pooled = LedgerService(StaticDataSource(), storage=self.storage, replay_pool=pool)
+        threaded = LedgerService(StaticDataSource(), storage=self.storage)
+        self.addCleanup(threaded.close)
+        self.addCleanup(pooled.close)
+
+        async def both(method, **kwargs):
+            return await getattr(pooled, method)("0xabc", **kwargs), await getattr(threaded, method)("0xabc", **kwargs)
+
+        for method in ("get_trades_async", "get_pnl_history_async", "get_position_history_async", "get_pnl_async"):
+            got, expected = asyncio.run(both(method, target_builder="", builder_only=False))
+            self.assertEqual(got, expected, method)
+        trades, _ = asyncio.run(both("get_trades_async", coin_filter="ETH", target_builder=""))
+        self.assertEqual([t.coin for t in trades], ["ETH"])
+
+    def test_queue_full_and_queue_deadline(self):
+        pool = ReplayPool("sqlite", workers=1, queue_size=1, deadline_s=0.2)
+        self.addCleanup(pool.close)
+
+        async def run():
+            # First call sets up the slot, then keep the only worker busy
+            pool.start()
+            pool._slots = asyncio.Queue()
+            waiter = asyncio.ensure_future(pool.run(ReplayJob("0xabc", [])))
+            await asyncio.sleep(0)
+            with self.assertRaises(HTTPException) as full:
+                await pool.run(ReplayJob("0xabc", []))
+            with self.assertRaises(HTTPException) as late:
+                await waiter
+            return full.exception, late.exception
+
+        full, late = asyncio.run(run())
+        self.assertEqual(full.status_code, 503)
+        self.assertIn("Retry-After", full.headers)
+        self.assertEqual(late.status_code, 503)
+        self.assertIn("deadline", late.detail)
+
+    def test_worker_cpu_counts_against_budget(self):
+        # The API process itself uses no CPU here, all of it is in the worker
+        quota = QuotaManager(storage_from_string("memory://"), units_per_minute=0, cpu_budget=0.001,
+                             queue_timeout_s=0.1, cpu_clock=lambda: 0.0)
+        self.storage.save_fills("0xabc", [
+            {"coin": "BTC", "side": "B" if i % 2 else "A", "sz": "1.0", "px": "50000.0", "time": 1000 + i,
+             "fee": "1.0", "closedPnl": "0.0", "tid": i}
+            for i in range(20000)
+        ])
+        pool = ReplayPool("sqlite", workers=1)
+        self.addCleanup(pool.close)
+
+        async def run():
+            await quota.admit(1)
+            timer = timing.begin()
+            result = await pool.run(ReplayJob("0xabc", [], models=False))
+            quota.charge(None, timer)
+            return result, timer
+
+        result, timer = asyncio.run(run())
+        self.assertGreater(result.cpu_s, 0)
+        # 0.001 CPU s/s is 10ms per window, the replay alone spends more
+        self.assertGreater(timer.counts["worker_cpu_ms"], 10)
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(quota.admit(1))
+        self.assertEqual(ctx.exception.status_code, 503)
+
+class DisconnectingRequest:
+    def __init__(self, disconnect_after: float):
+        self.disconnect_after = disconnect_after
+
+    async def receive(self):
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+class TestCancelOnDisconnect(unittest.TestCase):
+    def test_cancels_work(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            with self.assertRaises(HTTPException) as ctx:
+                await cancel_on_disconnect(DisconnectingRequest(0.01), slow())
+            await asyncio.sleep(0)
+            return ctx.exception
+
+        self.assertEqual(asyncio.run(run()).status_code, 499)
+        self.assertEqual(cancelled, [True])
+
+    def test_returns_result(self):
+        async def quick():
+            return 42
+        self.assertEqual(asyncio.run(cancel_on_disconnect(DisconnectingRequest(10), quick())), 42)
+
+if __name__ == '__main__':
+    unittest.main()
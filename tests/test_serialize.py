@@ -0,0 +1,111 @@
+import gzip
+import json
+import unittest
+import asyncio
+from decimal import Decimal
+from unittest import mock
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from src import serialize
+from src.models import PnLResponse
+from src.replay import LedgerReplay, ALL_OUTPUTS
+from src.serialize import dumps, negotiate_encoding, json_response
+
+BUILDER_A = "0x" + "a" * 40
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "0.00000001", "px": "50000.0", "time": 1000, "fee": "1E+1", "builder": BUILDER_A},
+    {"coin": "ETH", "side": "B", "sz": "1.0", "px": "3000.0", "time": 1500, "fee": "1.0"},
+    {"coin": "BTC", "side": "A", "sz": "0.00000001", "px": "51000.25", "time": 2000, "fee": "5.0", "builder": BUILDER_A},
+    {"coin": "ETH", "side": "A", "sz": "1.0", "px": "3100.0", "time": 3000, "fee": "1.0"},
+]
+FUNDING = [{"coin": "BTC", "time": 1800, "usdc": "-7.5"}]
+
+def replay_items(models):
+    replay = LedgerReplay(iter(FILLS), FUNDING, target_builder=BUILDER_A, builder_only=True,
+                          outputs=ALL_OUTPUTS, models=models)
+    return [item for _, item in replay]
+
+def request(accept_encoding=None):
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+class TestDumps(unittest.TestCase):
+    def test_records_match_models(self):
+        models = replay_items(True)
+        records = replay_items(False)
+        self.assertEqual(len(models), len(records))
+        expected = jsonable_encoder(models)
+        self.assertEqual(json.loads(dumps(records)), expected)
+        # Rows, as the replay pool returns them
+        self.assertEqual(json.loads(dumps([r.to_row() for r in records])), expected)
+        # Decimals keep their exact string form
+        trades = [row for row in expected if "sz" in row]
+        self.assertEqual(trades[0]["sz"], "1E-8")
+
+    def test_other_data(self):
+        pnl = PnLResponse(realizedPnl=Decimal("1.50"), returnPct=Decimal("0"), feesPaid=Decimal("0.1"), tradeCount=2)
+        self.assertEqual(json.loads(dumps(pnl)), jsonable_encoder(pnl))
+        self.assertEqual(json.loads(dumps([])), [])
+
+class TestNegotiation(unittest.TestCase):
+    offered = ["zstd", "br", "gzip"]
+
+    def test_preference(self):
+        self.assertEqual(negotiate_encoding("gzip, deflate, br", self.offered), "br")
+        self.assertEqual(negotiate_encoding("gzip, br;q=0.5", self.offered), "gzip")
+        self.assertEqual(negotiate_encoding("*", self.offered), "zstd")
+        self.assertEqual(negotiate_encoding("*;q=0.1, gzip", self.offered), "gzip")
+
+    def test_identity(self):
+        self.assertIsNone(negotiate_encoding(None, self.offered))
+        self.assertIsNone(negotiate_encoding("identity", self.offered))
+        self.assertIsNone(negotiate_encoding("gzip;q=0", self.offered))
+        self.assertIsNone(negotiate_encoding("gzip;q=x", self.offered))
+        self.assertIsNone(negotiate_encoding("gzip", []))
+
+class TestJsonResponse(unittest.TestCase):
+    data = [{"n": i, "px": "50000.0"} for i in range(200)]
+
+    def respond(self, accept_encoding, data=None, encodings="gzip"):
+        with mock.patch.dict("os.environ", {"RESPONSE_ENCODINGS": encodings, "COMPRESS_MIN_BYTES": "1024"}):
+            return asyncio.run(json_response(request(accept_encoding), self.data if data is None else data, {"ETag": '"x"'}))
+
+    def test_compressed(self):
+        response = self.respond("gzip")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(response.headers["etag"], '"x"')
+        self.assertEqual(json.loads(gzip.decompress(response.body)), self.data)
+
+    def test_uncompressed(self):
+        # Not accepted, too small, or disabled
+        for response in (self.respond(None), self.respond("gzip", data=[1, 2]), self.respond("gzip", encodings="")):
+            self.assertNotIn("content-encoding", response.headers)
+            self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(json.loads(self.respond(None).body), self.data)
+        self.assertNotIn("vary", self.respond("gzip", encodings="").headers)
+
+    def test_missing_packages_not_offered(self):
+        with mock.patch.object(serialize, "brotli", None), mock.patch.object(serialize, "zstandard", None):
+            response = self.respond("zstd, br, gzip;q=0.1", encodings="zstd,br,gzip")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+
+    def test_large_bodies_serialized_in_thread(self):
+        with mock.patch.object(serialize, "SERIALIZE_IN_THREAD_ITEMS", 100), \
+                mock.patch.object(serialize.asyncio, "to_thread", wraps=asyncio.to_thread) as to_thread:
+            response = self.respond(None)
+            self.respond(None, data=self.data[:99])
+        self.assertEqual([c.args[0] for c in to_thread.call_args_list], [serialize.dumps])
+        self.assertEqual(json.loads(response.body), self.data)
+
+    @unittest.skipIf(serialize.brotli is None or serialize.zstandard is None, "brotli/zstandard not installed")
+    def test_brotli_zstd(self):
+        response = self.respond("br", encodings="zstd,br,gzip")
+        self.assertEqual(json.loads(serialize.brotli.decompress(response.body)), self.data)
+        response = self.respond("zstd, br", encodings="zstd,br,gzip")
+        body = serialize.zstandard.ZstdDecompressor().decompress(response.body)
+        self.assertEqual(json.loads(body), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import glob
+import tempfile
+import threading
+from fastapi import HTTPException
+from src.routers.admin import archive_fills
+from src.storage.memory import MemoryStorage
+from src.storage.sharded import ShardedSqliteStorage, shard_paths
+
+class TestShardedStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "fills.db")
+        self.storage = ShardedSqliteStorage(f"sqlite:///{self.db_path}", shards=3)
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def test_routes_users_to_one_shard(self):
+        self.assertEqual(shard_paths(f"sqlite:///{self.db_path}", 2),
+                         [os.path.join(self.tmp.name, "fills.shard0.db"), os.path.join(self.tmp.name, "fills.shard1.db")])
+
+        users = [f"0x{i:040x}" for i in range(30)]
+        for i, user in enumerate(users):
+            self.storage.save_fills(user, [{"coin": "BTC", "time": 1000 + i, "sz": "1.0", "closedPnl": str(i), "tid": i}])
+            self.storage.save_funding(user, [{"time": 1000 + i, "coin": "BTC", "usdc": "1.0", "hash": "0x1"}])
+
+        # Every shard got some users, and each user's data lives in exactly one
+        self.assertTrue(all(s.get_leaderboard_stats() for s in self.storage.shards))
+        for i, user in enumerate(users):
+            self.assertEqual(self.storage.get_latest_timestamp(user), 1000 + i)
+            self.assertEqual(self.storage.get_latest_funding_timestamp(user), 1000 + i)
+            holders = [s for s in self.storage.shards if s.get_all_fills(user)]
+            self.assertEqual(holders, [self.storage.shard_for(user)])
+
+        board = self.storage.get_leaderboard_stats()
+        self.assertEqual([r["user"] for r in board[:3]], [users[29], users[28], users[27]])
+        self.assertEqual(len(board), 30)
+
+    def test_concurrent_writers(self):
+        errors = []
+
+        def worker(i):
+            try:
+                user = f"0x{i}"
+                self.storage.save_fills(user, [{"coin": "ETH", "time": t, "sz": "1.0", "tid": t} for t in range(200)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(12)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(r["tradeCount"] for r in self.storage.get_leaderboard_stats()), 12 * 200)
+
+    def test_rejects_changed_shard_count(self):
+        self.storage.close()
+        with self.assertRaises(RuntimeError):
+            ShardedSqliteStorage(self.db_path, shards=2)
+        self.storage = ShardedSqliteStorage(self.db_path, shards=3)
+        self.assertEqual(len(glob.glob(os.path.join(self.tmp.name, "fills.shard*.db"))), 3)
+
+    def test_admin_archive_uses_configured_backend(self):
+        # No ARCHIVE_DIR, or a backend without an archive tier
+        for backend in (self.storage, MemoryStorage(), None):
+            with self.assertRaises(HTTPException) as ctx:
+                archive_fills(days=0, current_user=None, storage_backend=backend)
+            self.assertEqual(ctx.exception.status_code, 400)
+
+        self.storage.close()
+        self.storage = ShardedSqliteStorage(self.db_path, shards=3, archive_dir=os.path.join(self.tmp.name, "archive"))
+        self.assertTrue(self.storage.has_archive)
+        users = [f"0x{i:040x}" for i in range(6)]
+        for i, user in enumerate(users):
+            self.storage.save_fills(user, [{"coin": "BTC", "time": 1000 + i, "sz": "1.0", "closedPnl": "1", "tid": i}])
+        result = archive_fills(days=0, current_user=None, storage_backend=self.storage)
+        self.assertEqual(result["fills"], 6)
+        self.assertEqual([len(self.storage.get_all_fills(u)) for u in users], [1] * 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,13 @@
 import unittest
 import os
-from src.storage.sqlite import SqliteStorage
+import json
+import sqlite3
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from src.storage import sqlite as sqlite_storage
+from src.storage.sqlite import SqliteStorage, get_shared_storage
 
 class TestStorage(unittest.TestCase):
     def setUp(self):
@@ -12,8 +19,10 @@ class TestStorage(unittest.TestCase):
         self.storage = SqliteStorage(self.test_db)
 
     def tearDown(self):
-        if os.path.exists(self.file_name):
-            os.remove(self.file_name)
+        self.storage.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.file_name + suffix):
+                os.remove(self.file_name + suffix)
 
     def test_save_and_retrieve(self):
         fills = [
@@ -54,5 +63,263 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(stats[1]["user"], "0xA")
         self.assertEqual(stats[1]["metricValue"], 50.0)
 
+    def test_typed_roundtrip(self):
+        fills = [
+            {"coin": "kPEPE", "side": "A", "time": 1000, "px": "0.0012345", "sz": "125000.0",
+             "fee": "-0.015", "closedPnl": "12.5", "tid": 901, "builderInfo": {"builder": "0xABC"}},
+        ]
+        self.storage.save_fills("0xA", fills)
+        self.storage.save_fills("0xA", fills) # duplicate tid is ignored
+
+        retrieved = self.storage.get_all_fills("0xA")
+        self.assertEqual(len(retrieved), 1)
+        fill = retrieved[0]
+        self.assertEqual(fill["side"], "A")
+        self.assertEqual(fill["px"], "0.0012345")
+        self.assertEqual(fill["sz"], "125000.0")
+        self.assertEqual(fill["fee"], "-0.015")
+        self.assertEqual(fill["closedPnl"], "12.5")
+        self.assertEqual(fill["builder"], "0xabc")
+        self.assertEqual(fill["tid"], 901)
+
+    def test_iter_fills_push_down(self):
+        fills = [
+            {"coin": "BTC", "side": "B", "time": 1000, "px": "50000", "sz": "1.0", "tid": 1},
+            {"coin": "ETH", "side": "B", "time": 1500, "px": "3000", "sz": "2.0", "tid": 2},
+            {"coin": "BTC", "side": "A", "time": 2000, "px": "51000", "sz": "1.0", "tid": 3},
+            {"coin": "BTC", "side": "B", "time": 3000, "px": "52000", "sz": "1.0", "tid": 4},
+        ]
+        self.storage.save_fills("0xA", fills)
+
+        btc = list(self.storage.iter_fills("0xA", coin="BTC", batch_size=2))
+        self.assertEqual([f["tid"] for f in btc], [1, 3, 4])
+
+        window = list(self.storage.iter_fills("0xA", coin="BTC", from_ms=1500, to_ms=2500))
+        self.assertEqual([f["tid"] for f in window], [3])
+
+        self.assertEqual(list(self.storage.iter_fills("0xA", coin="DOGE")), [])
+        self.assertEqual(list(self.storage.iter_fills("0xB")), [])
+
+    def test_iter_fills_does_not_hold_connections(self):
+        storage = SqliteStorage(self.test_db, pool_size=2, group_commit=False)
+        storage.pool.timeout = 0.5
+        try:
+            # Same millisecond across a batch boundary: paging is by (time, tid)
+            storage.save_fills("0xA", [
+                {"coin": "BTC", "side": "B", "time": 1000 + i // 2, "px": "1", "sz": "1", "tid": i}
+                for i in range(7)
+            ])
+            readers = [storage.iter_fills("0xA", batch_size=2) for _ in range(3)]
+            firsts = [next(reader) for reader in readers]
+            # Three open readers on a pool of two, and writes still get a connection
+            storage.save_fills("0xA", [{"coin": "BTC", "side": "B", "time": 5000, "px": "1", "sz": "1", "tid": 99}])
+            self.assertEqual(storage.get_latest_timestamp("0xA"), 5000)
+            tids = [[first["tid"]] + [f["tid"] for f in reader] for first, reader in zip(firsts, readers)]
+            self.assertEqual(tids, [list(range(7)) + [99]] * 3)
+        finally:
+            storage.close()
+
+    def test_read_only_storage(self):
+        self.storage.save_fills("0xA", [{"coin": "BTC", "side": "B", "time": 1000, "px": "1", "sz": "1", "tid": 1}])
+        reader = SqliteStorage(self.test_db, read_only=True)
+        try:
+            self.assertIsNone(reader.writer)
+            self.assertEqual([f["tid"] for f in reader.iter_fills("0xA")], [1])
+            with self.assertRaises(sqlite3.OperationalError):
+                reader.set_setting("k", "v")
+        finally:
+            reader.close()
+
+    def test_migrates_legacy_schema(self):
+        self.storage.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.file_name + suffix):
+                os.remove(self.file_name + suffix)
+
+        legacy = {"coin": "BTC", "side": "B", "time": 1000, "px": "50000.0", "sz": "1.0", "fee": "10.0", "tid": 7}
+        conn = sqlite3.connect(self.file_name)
+        conn.execute('''
+            CREATE TABLE fills (id TEXT PRIMARY KEY, user TEXT, coin TEXT, time INTEGER,
+                                closedPnl TEXT, fee TEXT, builder TEXT, raw_json TEXT)
+        ''')
+        conn.execute("INSERT INTO fills VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     ("0xA_7", "0xA", "BTC", 1000, "0.0", "10.0", None, json.dumps(legacy)))
+        conn.commit()
+        conn.close()
+
+        self.storage = SqliteStorage(self.test_db)
+        retrieved = self.storage.get_all_fills("0xA")
+        self.assertEqual(len(retrieved), 1)
+        self.assertEqual(retrieved[0]["px"], "50000.0")
+        self.assertEqual(retrieved[0]["tid"], 7)
+        self.assertEqual(self.storage.get_latest_timestamp("0xA", coin="BTC"), 1000)
+
+        with self.storage.pool.connection() as conn:
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn("fills_legacy", tables)
+
+    def test_pool_reuses_tuned_connections(self):
+        with self.storage.pool.connection() as conn:
+            first = conn
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+            temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+
+        self.assertEqual(mode, "wal")
+        self.assertEqual(sync, 1) # NORMAL
+        self.assertEqual(temp_store, 2) # MEMORY
+
+        self.storage.get_latest_timestamp("0xA")
+        with self.storage.pool.connection() as conn:
+            self.assertIs(conn, first)
+
+    def test_pool_concurrent_access(self):
+        errors = []
+
+        def worker(i):
+            try:
+                user = f"0x{i}"
+                self.storage.save_fills(user, [{"coin": "BTC", "time": 1000 + i, "sz": "1.0", "tid": i}])
+                self.assertEqual(self.storage.get_latest_timestamp(user), 1000 + i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.storage.pool._created, self.storage.pool.size)
+
+    def test_pool_exhaustion_times_out(self):
+        pool = sqlite_storage.ConnectionPool(self.file_name, size=1, timeout=0.05)
+        try:
+            with pool.connection():
+                with self.assertRaises(TimeoutError) as ctx:
+                    with pool.connection():
+                        pass
+            self.assertIn("all 1 of", str(ctx.exception))
+            # The held connection went back and is usable again
+            with pool.connection() as conn:
+                self.assertEqual(conn.execute("SELECT 1").fetchone()[0], 1)
+        finally:
+            pool.close()
+
+    def test_shared_storage_is_singleton(self):
+        shared = get_shared_storage(self.test_db)
+        self.assertIs(shared, get_shared_storage(self.test_db))
+        shared.close()
+        sqlite_storage._shared_storages.pop(self.test_db, None)
+
+    def test_archive_cold_fills(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        self.storage.close()
+        self.storage = SqliteStorage(self.test_db, archive_dir=archive_dir)
+
+        fills = [
+            {"coin": "BTC", "side": "B", "time": 1000, "px": "50000.5", "sz": "0.1", "fee": "1.25", "closedPnl": "0.0", "tid": 1, "builder": "0xB"},
+            {"coin": "ETH", "side": "A", "time": 2000, "px": "3000", "sz": "2", "closedPnl": "-7.5", "tid": 2},
+            {"coin": "BTC", "side": "A", "time": 3000, "px": "51000", "sz": "0.1", "closedPnl": "99.95", "tid": 3},
+        ]
+        self.storage.save_fills("0xA", fills)
+        before = self.storage.get_all_fills("0xA")
+
+        self.assertEqual(self.storage.archive_cold_fills(2500), 2)
+
+        # Cold rows left SQLite, reads stitch both tiers back together
+        with self.storage.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM fills").fetchone()[0], 1)
+        self.assertEqual(self.storage.get_all_fills("0xA"), before)
+        self.assertEqual([f["tid"] for f in self.storage.iter_fills("0xA", coin="BTC")], [1, 3])
+        self.assertEqual([f["tid"] for f in self.storage.iter_fills("0xA", to_ms=2000)], [1, 2])
+        self.assertEqual(self.storage.get_latest_timestamp("0xA", coin="ETH"), 2000)
+
+        # Re-saving archived fills is a no-op
+        self.storage.save_fills("0xA", fills)
+        self.assertEqual(len(self.storage.get_all_fills("0xA")), 3)
+
+        self.storage.archive_cold_fills(5000)
+        self.assertEqual(self.storage.get_all_fills("0xA"), before)
+        self.assertEqual(self.storage.get_latest_timestamp("0xA"), 3000)
+        board = self.storage.get_leaderboard_stats()
+        self.assertEqual(board[0]["tradeCount"], 3)
+        self.assertAlmostEqual(board[0]["metricValue"], 92.45)
+
+    def _archived_storage(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        self.storage.close()
+        self.storage = SqliteStorage(self.test_db, archive_dir=archive_dir)
+        return self.storage
+
+    def test_archive_interrupted_before_delete(self):
+        storage = self._archived_storage()
+        storage.save_fills("0xA", [
+            {"coin": "BTC", "side": "B", "time": 1000, "px": "1", "sz": "1", "closedPnl": "10", "tid": 1},
+            {"coin": "BTC", "side": "A", "time": 3000, "px": "1", "sz": "1", "closedPnl": "5", "tid": 2},
+        ])
+        write_segment = storage.archive.write_segment
+
+        def crash_after_publish(*args):
+            write_segment(*args)
+            raise RuntimeError("killed")
+
+        with mock.patch.object(storage.archive, "write_segment", crash_after_publish):
+            with self.assertRaises(RuntimeError):
+                storage.archive_cold_fills(2000)
+        # The archived row is still hot too, and counted once
+        with storage.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM fills").fetchone()[0], 2)
+        [entry] = storage.get_leaderboard_stats()
+        self.assertEqual(entry["tradeCount"], 2)
+        self.assertAlmostEqual(entry["metricValue"], 15.0)
+
+    def test_archive_writes_bounded_segments(self):
+        storage = self._archived_storage()
+        fills = [{"coin": "BTC", "side": "B", "time": t, "px": "1", "sz": "1", "tid": i}
+                 for i, t in enumerate((1000, 1001, 1001, 1001, 1002, 1003, 5000))]
+        storage.save_fills("0xA", fills)
+        before = storage.get_all_fills("0xA")
+        with mock.patch.object(sqlite_storage, "ARCHIVE_SEGMENT_ROWS", 2):
+            self.assertEqual(storage.archive_cold_fills(2000), 6)
+        # A millisecond is never split between segments
+        self.assertEqual([(s.rows, s.max_time) for s in storage.archive.segments("0xA")],
+                         [(4, 1001), (2, 1003)])
+        self.assertEqual(storage.get_all_fills("0xA"), before)
+
+    def test_group_commit_batches_concurrent_writers(self):
+        writer = self.storage.writer
+        writer.max_delay = 0.05
+        barrier = threading.Barrier(10)
+        errors = []
+
+        def worker(i):
+            try:
+                barrier.wait()
+                self.storage.save_fills(f"0x{i}", [{"coin": "BTC", "time": t, "sz": "1.0", "tid": t} for t in range(100)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(writer.requests, 10)
+        self.assertLess(writer.batches, 10)
+        for i in range(10):
+            self.assertEqual(len(self.storage.get_all_fills(f"0x{i}")), 100)
+
+    def test_group_commit_isolates_failures(self):
+        self.storage.writer.max_delay = 0.05
+        good = self.storage.submit_fills("0xA", [{"coin": "BTC", "time": 1, "sz": "1.0", "tid": 1}])
+        bad = self.storage.submit_fills("0xB", [{"coin": "BTC", "time": "not-a-time", "tid": 2}])
+
+        self.assertEqual(good.result(timeout=5), 1)
+        with self.assertRaises(ValueError):
+            bad.result(timeout=5)
+        self.assertEqual(len(self.storage.get_all_fills("0xA")), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,200 @@
+import unittest
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import json
+from src.database import Base, RequestLog, RequestRollup, LatencyHistogramRow, SlowRequest, drop_rollup_latency_columns
+from src.telemetry import RequestLogWriter, POLICY_SAMPLE
+
+class TestRequestLogWriter(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine)
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+
+    def count(self):
+        db = self.Session()
+        try:
+            return db.query(RequestLog).count()
+        finally:
+            db.close()
+
+    def test_batches_and_flushes_on_stop(self):
+        writer = RequestLogWriter(flush_ms=10000, batch_size=50, session_factory=self.Session)
+        writer.start()
+        for i in range(120):
+            writer.log("/v1/pnl", 200, 1.5, api_key="k", user_addr="0xA")
+
+        # Two full batches wake the writer before the flush interval
+        deadline = time.time() + 5
+        while writer.written < 100 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(writer.written, 100)
+
+        writer.stop()
+        self.assertEqual(self.count(), 120)
+        self.assertEqual(writer.dropped, 0)
+
+    def test_drop_when_full(self):
+        writer = RequestLogWriter(max_size=10, batch_size=1000, session_factory=self.Session)
+        # Not started, nothing drains
+        for i in range(15):
+            writer.log("/v1/pnl", 200, 1.0)
+        self.assertEqual(writer.dropped, 5)
+
+        writer.flush()
+        self.assertEqual(self.count(), 10)
+
+    def test_sample_keeps_errors(self):
+        writer = RequestLogWriter(max_size=100, batch_size=1000, policy=POLICY_SAMPLE,
+                                  sample_rate=10, session_factory=self.Session)
+        for i in range(50):
+            writer.log("/v1/pnl", 200, 1.0)
+        # Past half full: 1 in 10 successes, every error
+        for i in range(100):
+            writer.log("/v1/pnl", 200, 1.0)
+        for i in range(10):
+            writer.log("/v1/pnl", 500, 1.0)
+        self.assertEqual(writer._queue.qsize(), 50 + 10 + 10)
+        self.assertEqual(writer.dropped, 90)
+
+    def test_slow_requests_keep_breakdown(self):
+        writer = RequestLogWriter(max_size=10, batch_size=1000, policy=POLICY_SAMPLE,
+                                  sample_rate=1000, session_factory=self.Session)
+        for i in range(5):
+            writer.log("/v1/pnl", 200, 1.0)
+        # Past half full, but slow requests are never sampled away
+        writer.log("/v1/pnl", 200, 2500.0, user_addr="0xA",
+                   stages={"upstream_fills": 2000.0, "replay": 400.0}, query="user=0xA")
+        writer.flush()
+
+        db = self.Session()
+        try:
+            self.assertEqual(db.query(RequestLog).count(), 6)
+            slow = db.query(SlowRequest).one()
+            self.assertEqual((slow.endpoint, slow.query, slow.latency_ms), ("/v1/pnl", "user=0xA", 2500.0))
+            self.assertEqual(json.loads(slow.stages), {"upstream_fills": 2000.0, "replay": 400.0})
+        finally:
+            db.close()
+
+    def test_rollups_are_incremental(self):
+        # Both flushes land in the same minute, hour and day bucket
+        now = [datetime(2024, 5, 1, 12, 30, 15)]
+        writer = RequestLogWriter(batch_size=1000, session_factory=self.Session, clock=lambda: now[0])
+        for latency in (3, 7, 7, 400, 9000):
+            writer.log("/v1/pnl", 200, latency, api_key="k1")
+        writer.log("/v1/pnl", 500, 20, api_key="k1")
+        writer.flush()
+        now[0] += timedelta(seconds=40)
+        writer.log("/v1/trades", 200, 1, api_key=None)
+        writer.log("/v1/pnl", 200, 2, api_key="k1")
+        writer.flush()
+
+        db = self.Session()
+        try:
+            rows = db.query(RequestRollup).filter_by(endpoint="/v1/pnl").all()
+            self.assertEqual(sorted(r.resolution for r in rows), ["d", "h", "m"])
+            for r in rows:
+                self.assertEqual((r.count, r.error_count), (7, 1))
+                self.assertEqual(r.latency_sum, 3 + 7 + 7 + 400 + 9000 + 20 + 2)
+            anon = db.query(RequestRollup).filter_by(endpoint="/v1/trades", resolution="m").one()
+            self.assertEqual((anon.api_key, anon.count), ("", 1))
+        finally:
+            db.close()
+
+    def test_rollups_count_dropped_requests(self):
+        writer = RequestLogWriter(max_size=10, batch_size=1000, policy=POLICY_SAMPLE,
+                                  sample_rate=1000, session_factory=self.Session)
+        for i in range(30):
+            writer.log("/v1/pnl", 200, 5.0, api_key="k1")
+        for i in range(5):
+            writer.log("/v1/pnl", 500, 5.0, api_key="k1")
+        self.assertGreater(writer.dropped, 0)
+        writer.flush()
+
+        db = self.Session()
+        try:
+            self.assertLess(db.query(RequestLog).count(), 35)
+            # Totals cover every request, not only the raw rows that were kept
+            for r in db.query(RequestRollup).filter_by(endpoint="/v1/pnl"):
+                self.assertEqual((r.count, r.error_count, r.latency_sum), (35, 5, 175.0))
+        finally:
+            db.close()
+
+    def test_drops_old_rollup_latency_columns(self):
+        with self.engine.begin() as conn:
+            RequestRollup.__table__.drop(conn)
+            conn.execute(text(
+                "CREATE TABLE request_rollups (id INTEGER PRIMARY KEY, resolution VARCHAR(1) NOT NULL, "
+                "bucket_start DATETIME NOT NULL, endpoint VARCHAR(255) NOT NULL, api_key VARCHAR(255) NOT NULL, "
+                "count INTEGER NOT NULL, error_count INTEGER NOT NULL, latency_sum FLOAT NOT NULL, "
+                "lat_5 INTEGER NOT NULL, lat_inf INTEGER NOT NULL)"))
+            conn.execute(text(
+                "INSERT INTO request_rollups VALUES (1, 'd', '2024-05-01 00:00:00', '/v1/pnl', 'k1', 3, 1, 30.0, 2, 1)"))
+            drop_rollup_latency_columns(conn)
+            drop_rollup_latency_columns(conn)
+            self.assertNotIn("lat_inf", {c["name"] for c in inspect(conn).get_columns("request_rollups")})
+
+        # Kept the totals, and new rollups are written on top of them
+        writer = RequestLogWriter(session_factory=self.Session, clock=lambda: datetime(2024, 5, 1, 12))
+        writer.log("/v1/pnl", 200, 10.0, api_key="k1")
+        writer.flush()
+        db = self.Session()
+        try:
+            day = db.query(RequestRollup).filter_by(resolution="d").one()
+            self.assertEqual((day.count, day.error_count, day.latency_sum), (4, 1, 40.0))
+        finally:
+            db.close()
+
+    def test_retention(self):
+        writer = RequestLogWriter(session_factory=self.Session, retention_days=7,
+                                  minute_retention_days=2, hour_retention_days=90)
+        writer.log("/v1/pnl", 200, 1.0)
+        writer.flush()
+
+        db = self.Session()
+        try:
+            writer.prune(now=datetime.utcnow() + timedelta(days=3))
+            self.assertEqual(db.query(RequestLog).count(), 1)
+            self.assertEqual(sorted(r.resolution for r in db.query(RequestRollup)), ["d", "h"])
+
+            writer.prune(now=datetime.utcnow() + timedelta(days=100))
+            self.assertEqual(db.query(RequestLog).count(), 0)
+            self.assertEqual([r.resolution for r in db.query(RequestRollup)], ["d"])
+        finally:
+            db.close()
+
+    def test_histograms_merge_across_workers(self):
+        from src.routers.admin import get_stats
+
+        # Two writers stand in for two worker processes sharing the database
+        first = RequestLogWriter(session_factory=self.Session)
+        second = RequestLogWriter(session_factory=self.Session)
+        for i in range(90):
+            first.log("/v1/pnl", 200, 10.0)
+        for i in range(10):
+            second.log("/v1/pnl", 200, 1000.0)
+        second.log("/v1/pnl", 503, 50.0)
+        first.flush()
+        second.flush()
+
+        db = self.Session()
+        try:
+            classes = {r.status_class for r in db.query(LatencyHistogramRow).filter_by(resolution="m")}
+            self.assertEqual(classes, {"2xx", "5xx"})
+
+            stats = get_stats(duration="1h", endpoint=None, current_user=None, db=db)
+            self.assertAlmostEqual(stats["p50_ms"], 10.0, delta=0.5)
+            self.assertAlmostEqual(stats["p99_ms"], 1000.0, delta=35)
+            self.assertEqual(stats["total_requests"], 101)
+            self.assertEqual(sum(point["val"] for point in stats["chart_data"]), 101)
+            self.assertTrue(all("p95_ms" in point for point in stats["chart_data"]))
+            self.assertEqual([(e["status_class"], e["count"]) for e in stats["endpoints"]], [("2xx", 100), ("5xx", 1)])
+        finally:
+            db.close()
+
+if __name__ == '__main__':
+    unittest.main()
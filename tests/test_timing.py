@@ -0,0 +1,77 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import contextvars
+from src import timing
+from src.services import LedgerService
+from src.storage.sqlite import SqliteStorage
+
+FILLS = [
+    {"coin": "BTC", "side": "B", "sz": "1.0", "px": "50000.0", "time": 1000, "fee": "10.0", "closedPnl": "0.0", "tid": 1},
+]
+
+class StaticDataSource:
+    def get_user_fills(self, address, since=0):
+        return [f for f in FILLS if f["time"] > since]
+
+    def get_user_funding(self, address, start, end):
+        return []
+
+    def get_all_mids(self):
+        return {}
+
+class TestStageTimer(unittest.TestCase):
+    def test_noop_outside_request(self):
+        ctx = contextvars.Context()
+        def run():
+            with timing.stage("x"):
+                pass
+            items = [1, 2]
+            self.assertIs(timing.timed_iter(items, "y"), items)
+            return timing.current()
+        self.assertIsNone(ctx.run(run))
+
+    def test_stages_and_header(self):
+        def run():
+            timer = timing.begin()
+            with timing.stage("a"):
+                pass
+            with timing.stage("a"):
+                pass
+            self.assertEqual(list(timing.timed_iter(range(3), "read")), [0, 1, 2])
+            return timer
+        timer = contextvars.Context().run(run)
+        self.assertEqual(set(timer.stages), {"a", "read"})
+        header = timer.server_timing(12.345)
+        self.assertTrue(header.startswith("a;dur="))
+        self.assertTrue(header.endswith("total;dur=12.3"))
+
+    def test_service_stages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SqliteStorage(os.path.join(tmp, "timing.db"))
+            service = LedgerService(StaticDataSource(), storage=storage)
+            try:
+                def sync_request():
+                    timer = timing.begin()
+                    service.get_trades("0xabc")
+                    return timer
+
+                async def async_request():
+                    timer = timing.begin()
+                    await service.get_pnl_async("0xdef")
+                    return timer
+
+                for timer in (contextvars.Context().run(sync_request),
+                              contextvars.Context().run(asyncio.run, async_request())):
+                    # Includes stages that ran on the storage I/O pool and in to_thread workers
+                    for name in ("upstream_fills", "save_fills", "upstream_funding", "read_funding", "read_fills", "replay"):
+                        self.assertIn(name, timer.stages)
+                    # Work counts for the quota
+                    self.assertEqual(timer.counts["fills"], 1)
+            finally:
+                service.close()
+                storage.close()
+
+if __name__ == '__main__':
+    unittest.main()